@@ -111,17 +111,31 @@ def main():
     logger.info(f"使用模型: {get_value('model', 'deepseek-r1')}")
     logger.info("====================================")
     
+    # 定期输出运行指标
+    stats_log_interval = get_value("stats_log_interval", 0)
+    if stats_log_interval and stats_log_interval > 0:
+        from common.stats import stats_registry
+        stats_registry.start_reporter(stats_log_interval)
+    
     # 只有在配置加载完成后才导入依赖模块
     from channel.wechat_mp_channel import WechatMpChannel
-    from bot.bot import DeepSeekBot
-    
-    # 创建机器人实例
-    bot = DeepSeekBot()
     
     # 创建微信公众号通道
     channel_type = get_value("channel_type")
-    if channel_type == "wechat_mp_service":
-        channel = WechatMpChannel(bot)
+    if channel_type in ("wechat_mp_service", "wechat_mp_service_async"):
+        server_mode = "asyncio" if channel_type == "wechat_mp_service_async" else "threaded"
+        worker_processes = get_value("worker_processes", 1)
+        
+        if worker_processes > 1:
+            # 多进程模式，机器人实例在各工作进程中创建
+            from channel.wechat_mp_router import WechatMpRouterChannel
+            channel = WechatMpRouterChannel(worker_processes, server_mode=server_mode)
+        else:
+            from bot.bot import DeepSeekBot
+            
+            # 创建机器人实例
+            bot = DeepSeekBot()
+            channel = WechatMpChannel(bot, server_mode=server_mode)
         
         # 注册信号处理
         signal.signal(signal.SIGINT, signal_handler)
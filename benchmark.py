@@ -0,0 +1,714 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+性能基准测试脚本
+
+用法:
+    python benchmark.py ingress [--requests 2000] [--concurrency 32] [--idle 0]
+    python benchmark.py parse [--iterations 20000]
+    python benchmark.py sessions [--sessions 200] [--messages 10] [--workers 32]
+    python benchmark.py session-db [--sessions 1000000] [--lookups 20000]
+    python benchmark.py memory [--sessions 100000] [--turns 10]
+    python benchmark.py hedging [--requests 600] [--slow-rate 0.03] [--slow-delay 3]
+    python benchmark.py fairness [--heavy-users 40] [--heavy-messages 10] [--light-users 100]
+"""
+
+import re
+import sys
+import random
+import gc
+import tracemalloc
+import time
+import socket
+import tempfile
+import logging
+import argparse
+import threading
+import http.client
+
+import config
+from common.log import logger
+
+def percentile(samples, pct):
+    """
+    计算百分位数
+    :param samples: 已排序的样本列表
+    :param pct: 百分位(0-100)
+    :return: 百分位数值
+    """
+    if not samples:
+        return 0.0
+    index = min(len(samples) - 1, int(len(samples) * pct / 100))
+    return samples[index]
+
+def print_table(headers, rows):
+    """输出对齐的结果表格"""
+    widths = [max(len(str(row[i])) for row in [headers] + rows) for i in range(len(headers))]
+    for row in [headers] + rows:
+        print("  ".join(str(value).ljust(widths[i]) for i, value in enumerate(row)))
+
+# ---------------------------------------------------------------------------
+# ingress: 对比 http.server 与 asyncio 服务器的吞吐量和延迟
+# ---------------------------------------------------------------------------
+
+SAMPLE_TEXT_XML = (
+    "<xml><ToUserName><![CDATA[gh_benchmark]]></ToUserName>"
+    "<FromUserName><![CDATA[o_benchmark_user]]></FromUserName>"
+    "<CreateTime>1700000000</CreateTime>"
+    "<MsgType><![CDATA[text]]></MsgType>"
+    "<Content><![CDATA[你好]]></Content>"
+    "<MsgId>{msg_id}</MsgId></xml>"
+)
+
+class StubBot:
+    """不调用上游API的机器人，只用于测量入口开销"""
+    def reply_async(self, session_id, message, callback=None, on_segment=None):
+        return {"success": True, "message": "正在处理中"}
+
+def run_ingress_client(port, total, concurrency):
+    """
+    并发发送POST请求，每个线程复用一个连接
+    :return: (总耗时, 延迟列表, 失败数)
+    """
+    latencies = []
+    failures = [0]
+    lock = threading.Lock()
+    counter = [0]
+
+    def worker():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        local = []
+        while True:
+            with lock:
+                if counter[0] >= total:
+                    break
+                counter[0] += 1
+                # 每个请求使用不同的MsgId，避免被消息去重直接返回
+                body = SAMPLE_TEXT_XML.format(msg_id=f"{time.time_ns()}{counter[0]}").encode("utf-8")
+            start = time.perf_counter()
+            try:
+                conn.request("POST", "/wechat", body=body, headers={"Content-Type": "text/xml"})
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    raise RuntimeError(f"HTTP {response.status}")
+                local.append(time.perf_counter() - start)
+            except Exception:
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                with lock:
+                    failures[0] += 1
+        conn.close()
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, latencies, failures[0]
+
+def open_idle_connections(port, count):
+    """建立一批不发送请求的空闲连接"""
+    sockets = []
+    for _ in range(count):
+        try:
+            sockets.append(socket.create_connection(("127.0.0.1", port), timeout=5))
+        except OSError:
+            break
+    return sockets
+
+def bench_ingress(args):
+    """
+    在本地端口分别启动两种服务器，使用相同的负载测量请求吞吐量和延迟
+    """
+    from channel.wechat_mp_channel import WechatMpChannel, WechatMpServer
+    from channel.wechat_mp_async_server import WechatMpAsyncServer
+
+    channel = WechatMpChannel(StubBot())
+    servers = [
+        ("http.server", lambda: WechatMpServer(("127.0.0.1", 0), channel, max_workers=args.workers, backlog=1024, client_timeout=args.client_timeout)),
+        ("asyncio", lambda: WechatMpAsyncServer(("127.0.0.1", 0), channel, max_workers=args.workers, backlog=1024, client_timeout=args.client_timeout))
+    ]
+
+    rows = []
+    for name, factory in servers:
+        server = factory()
+        port = server.server_address[1]
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        idle = open_idle_connections(port, args.idle)
+        elapsed, latencies, failures = run_ingress_client(port, args.requests, args.concurrency)
+        for sock in idle:
+            sock.close()
+
+        server.shutdown()
+        server.server_close()
+
+        latencies.sort()
+        rows.append([
+            name,
+            len(idle),
+            f"{len(latencies) / elapsed:.0f}",
+            f"{percentile(latencies, 50) * 1000:.2f}",
+            f"{percentile(latencies, 99) * 1000:.2f}",
+            failures
+        ])
+
+    print(f"请求数: {args.requests}, 并发连接: {args.concurrency}, 处理线程: {args.workers}")
+    print_table(["server", "idle", "req/s", "p50(ms)", "p99(ms)", "failed"], rows)
+
+# ---------------------------------------------------------------------------
+# parse: 单次扫描解析器与原有逐字段正则解析的对比
+# ---------------------------------------------------------------------------
+
+def _wrap(msg_type, body, create_time=1700000000):
+    return (
+        "<xml><ToUserName><![CDATA[gh_benchmark]]></ToUserName>\n"
+        "<FromUserName><![CDATA[o_benchmark_user]]></FromUserName>\n"
+        f"<CreateTime>{create_time}</CreateTime>\n"
+        f"<MsgType><![CDATA[{msg_type}]]></MsgType>\n"
+        f"{body}</xml>"
+    )
+
+# 覆盖所有消息类型的样例及期望解析结果
+SAMPLE_MESSAGES = [
+    ("text", _wrap("text", "<Content><![CDATA[你好，<b>世界</b> & more]]></Content><MsgId>1234567890123456</MsgId>"),
+     {"MsgType": "text", "Content": "你好，<b>世界</b> & more", "MsgId": "1234567890123456"}),
+    ("image", _wrap("image", "<PicUrl><![CDATA[http://mmbiz.qpic.cn/pic]]></PicUrl><MediaId><![CDATA[media_img]]></MediaId><MsgId>2</MsgId>"),
+     {"MsgType": "image", "PicUrl": "http://mmbiz.qpic.cn/pic", "MediaId": "media_img", "MsgId": "2"}),
+    ("voice", _wrap("voice", "<MediaId><![CDATA[media_voice]]></MediaId><Format><![CDATA[amr]]></Format><Recognition><![CDATA[今天天气怎么样]]></Recognition><MsgId>3</MsgId>"),
+     {"MsgType": "voice", "MediaId": "media_voice", "Format": "amr", "Recognition": "今天天气怎么样", "MsgId": "3"}),
+    ("video", _wrap("video", "<MediaId><![CDATA[media_video]]></MediaId><ThumbMediaId><![CDATA[thumb]]></ThumbMediaId><MsgId>4</MsgId>"),
+     {"MsgType": "video", "MediaId": "media_video", "ThumbMediaId": "thumb", "MsgId": "4"}),
+    ("shortvideo", _wrap("shortvideo", "<MediaId><![CDATA[media_short]]></MediaId><ThumbMediaId><![CDATA[thumb2]]></ThumbMediaId><MsgId>5</MsgId>"),
+     {"MsgType": "shortvideo", "MediaId": "media_short", "ThumbMediaId": "thumb2", "MsgId": "5"}),
+    ("location", _wrap("location", "<Location_X>23.134521</Location_X><Location_Y>113.358803</Location_Y><Scale>20</Scale><Label><![CDATA[位置信息]]></Label><MsgId>6</MsgId>"),
+     {"MsgType": "location", "Location_X": "23.134521", "Location_Y": "113.358803", "Scale": "20", "Label": "位置信息", "MsgId": "6"}),
+    ("link", _wrap("link", "<Title><![CDATA[标题]]></Title><Description><![CDATA[描述]]></Description><Url><![CDATA[http://example.com/?a=1&b=2]]></Url><MsgId>7</MsgId>"),
+     {"MsgType": "link", "Title": "标题", "Description": "描述", "Url": "http://example.com/?a=1&b=2", "MsgId": "7"}),
+    ("event.subscribe", _wrap("event", "<Event><![CDATA[subscribe]]></Event><EventKey><![CDATA[qrscene_123]]></EventKey><Ticket><![CDATA[ticket]]></Ticket>"),
+     {"MsgType": "event", "Event": "subscribe", "EventKey": "qrscene_123", "Ticket": "ticket"}),
+    ("event.unsubscribe", _wrap("event", "<Event><![CDATA[unsubscribe]]></Event>"),
+     {"MsgType": "event", "Event": "unsubscribe"}),
+    ("event.SCAN", _wrap("event", "<Event><![CDATA[SCAN]]></Event><EventKey><![CDATA[123]]></EventKey><Ticket><![CDATA[ticket]]></Ticket>"),
+     {"MsgType": "event", "Event": "SCAN", "EventKey": "123", "Ticket": "ticket"}),
+    ("event.LOCATION", _wrap("event", "<Event><![CDATA[LOCATION]]></Event><Latitude>23.137466</Latitude><Longitude>113.352425</Longitude><Precision>119.385040</Precision>"),
+     {"MsgType": "event", "Event": "LOCATION", "Latitude": "23.137466", "Longitude": "113.352425", "Precision": "119.385040"}),
+    ("event.CLICK", _wrap("event", "<Event><![CDATA[CLICK]]></Event><EventKey><![CDATA[MENU_HELP]]></EventKey>"),
+     {"MsgType": "event", "Event": "CLICK", "EventKey": "MENU_HELP"}),
+    ("event.VIEW", _wrap("event", "<Event><![CDATA[VIEW]]></Event><EventKey><![CDATA[http://example.com]]></EventKey><MenuId>1</MenuId>"),
+     {"MsgType": "event", "Event": "VIEW", "EventKey": "http://example.com", "MenuId": "1"}),
+    ("event.scancode_push", _wrap("event", "<Event><![CDATA[scancode_push]]></Event><EventKey><![CDATA[rselfmenu_0_1]]></EventKey><ScanCodeInfo><ScanType><![CDATA[qrcode]]></ScanType><ScanResult><![CDATA[1]]></ScanResult></ScanCodeInfo>"),
+     {"MsgType": "event", "Event": "scancode_push", "ScanType": "qrcode", "ScanResult": "1"}),
+    ("event.pic_sysphoto", _wrap("event", "<Event><![CDATA[pic_sysphoto]]></Event><EventKey><![CDATA[rselfmenu_1_0]]></EventKey><SendPicsInfo><Count>1</Count><PicList><item><PicMd5Sum><![CDATA[1b5f7c23b5bf75682a53e7b6d163e185]]></PicMd5Sum></item></PicList></SendPicsInfo>"),
+     {"MsgType": "event", "Event": "pic_sysphoto", "Count": "1", "PicMd5Sum": "1b5f7c23b5bf75682a53e7b6d163e185"}),
+    ("event.location_select", _wrap("event", "<Event><![CDATA[location_select]]></Event><EventKey><![CDATA[rselfmenu_2_0]]></EventKey><SendLocationInfo><Location_X><![CDATA[23]]></Location_X><Location_Y><![CDATA[113]]></Location_Y><Scale><![CDATA[15]]></Scale><Label><![CDATA[ 广州市]]></Label><Poiname><![CDATA[]]></Poiname></SendLocationInfo>"),
+     {"MsgType": "event", "Event": "location_select", "Location_X": "23", "Label": " 广州市", "Poiname": ""}),
+    ("event.TEMPLATESENDJOBFINISH", _wrap("event", "<Event><![CDATA[TEMPLATESENDJOBFINISH]]></Event><MsgID>200163836</MsgID><Status><![CDATA[success]]></Status>"),
+     {"MsgType": "event", "Event": "TEMPLATESENDJOBFINISH", "MsgID": "200163836", "Status": "success"})
+]
+
+def legacy_parse(xml_data):
+    """原有实现：do_POST中的3次re.search加上_parse_xml_to_dict中的8次正则"""
+    re.search(r'<FromUserName><!\[CDATA\[(.*?)\]\]></FromUserName>', xml_data)
+    re.search(r'<ToUserName><!\[CDATA\[(.*?)\]\]></ToUserName>', xml_data)
+    re.search(r'<MsgType><!\[CDATA\[(.*?)\]\]></MsgType>', xml_data)
+    message = {}
+    pattern_map = {
+        'ToUserName': r'<ToUserName><!\[CDATA\[(.*?)\]\]></ToUserName>',
+        'FromUserName': r'<FromUserName><!\[CDATA\[(.*?)\]\]></FromUserName>',
+        'CreateTime': r'<CreateTime>(.*?)</CreateTime>',
+        'MsgType': r'<MsgType><!\[CDATA\[(.*?)\]\]></MsgType>',
+        'Content': r'<Content><!\[CDATA\[(.*?)\]\]></Content>',
+        'MsgId': r'<MsgId>(.*?)</MsgId>',
+        'Event': r'<Event><!\[CDATA\[(.*?)\]\]></Event>',
+        'Recognition': r'<Recognition><!\[CDATA\[(.*?)\]\]></Recognition>'
+    }
+    for key, pattern in pattern_map.items():
+        match = re.search(pattern, xml_data)
+        if match:
+            message[key] = match.group(1)
+    return message
+
+def bench_parse(args):
+    """
+    先用样例校验解析结果，再分别测量两种解析方式的单条消息耗时
+    """
+    from channel.wechat_mp_message import parse_message
+
+    failed = 0
+    for name, xml_data, expected in SAMPLE_MESSAGES:
+        message = parse_message(xml_data)
+        expected = dict(expected, ToUserName="gh_benchmark", FromUserName="o_benchmark_user", CreateTime="1700000000")
+        mismatched = {key: (value, message.get(key)) for key, value in expected.items() if message.get(key) != value}
+        if mismatched:
+            failed += 1
+            print(f"[校验失败] {name}: {mismatched}")
+    print(f"样例校验: {len(SAMPLE_MESSAGES) - failed}/{len(SAMPLE_MESSAGES)} 通过")
+    if failed:
+        sys.exit(1)
+
+    rows = []
+    for name, xml_data, _ in SAMPLE_MESSAGES:
+        row = [name]
+        for parser in (legacy_parse, parse_message):
+            start = time.perf_counter()
+            for _ in range(args.iterations):
+                parser(xml_data)
+            row.append(f"{(time.perf_counter() - start) / args.iterations * 1e6:.2f}")
+        row.append(f"{len(legacy_parse(xml_data))}/{len(parse_message(xml_data))}")
+        rows.append(row)
+
+    print(f"每条消息解析耗时(微秒)，迭代次数: {args.iterations}")
+    print_table(["msg_type", "legacy(us)", "single_pass(us)", "fields"], rows)
+
+def bench_sessions(args):
+    """
+    多会话并发压力测试：每个会话连续发送多条消息，全部通过reply_async并发提交，
+    上游API用随机延迟模拟，结束后校验每个会话的历史记录是否按发送顺序一问一答
+    """
+    config.config.update({
+        "open_ai_api_key": "benchmark",
+        "character_desc": "benchmark",
+        "conversation_max_tokens": 10 ** 9,
+        "response_cache_enabled": False,
+        "request_coalescing_enabled": False,
+        "scheduler_workers": args.workers,
+        "scheduler_queue_size": args.sessions * args.messages
+    })
+    from bot.bot import DeepSeekBot
+    from common.scheduler import job_scheduler
+
+    class EchoBot(DeepSeekBot):
+        """上游API替换为随机延迟后回显用户消息"""
+        def send_to_api(self, messages, timeout):
+            time.sleep(random.uniform(0, args.delay * 2))
+            return True, "re:" + messages[-1].content
+
+    bot = EchoBot()
+    total = args.sessions * args.messages
+    latencies = []
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def submit(session_id, text):
+        submit_time = time.perf_counter()
+        def callback(session_id, reply):
+            with lock:
+                latencies.append(time.perf_counter() - submit_time)
+                if len(latencies) == total:
+                    done.set()
+        bot.reply_async(session_id, text, callback=callback)
+
+    start = time.perf_counter()
+    # 按轮次交错提交，模拟同一用户在其他用户的消息之间连续发送
+    for m in range(args.messages):
+        for i in range(args.sessions):
+            submit(f"bench:{i}", f"{i}-{m}")
+    if not done.wait(timeout=max(60, total * args.delay * 4)):
+        print(f"[超时] 仅完成 {len(latencies)}/{total}")
+        sys.exit(1)
+    elapsed = time.perf_counter() - start
+
+    broken = 0
+    for i in range(args.sessions):
+        history = [msg.content for msg in bot.get_session(f"bench:{i}").messages if msg.role != "system"]
+        expected = []
+        for m in range(args.messages):
+            expected += [f"{i}-{m}", f"re:{i}-{m}"]
+        if history != expected:
+            broken += 1
+            if broken <= 3:
+                print(f"[校验失败] bench:{i}: {history[:6]}")
+    print(f"历史顺序校验: {args.sessions - broken}/{args.sessions} 通过")
+
+    latencies.sort()
+    # 理想耗时：每个会话串行处理自己的消息，不同会话受工作线程数限制并行
+    ideal = args.messages * args.delay * max(1, args.sessions / args.workers)
+    print_table(
+        ["sessions", "messages", "workers", "elapsed(s)", "ideal(s)", "msg/s", "p50(ms)", "p99(ms)"],
+        [[args.sessions, total, args.workers, f"{elapsed:.2f}", f"{ideal:.2f}", f"{total / elapsed:.0f}",
+          f"{percentile(latencies, 50) * 1000:.0f}", f"{percentile(latencies, 99) * 1000:.0f}"]]
+    )
+    print(job_scheduler.get_stats())
+    if broken:
+        sys.exit(1)
+
+def bench_session_db(args):
+    """
+    会话持久化基准测试：批量写入指定数量的会话，再随机读取，统计吞吐量和延迟
+    同时统计回复流程中标记待写入(mark_dirty)的耗时
+    """
+    import os
+    from bot.session import Session
+    from bot.session_backend import SqliteSessionBackend
+    from common.tokenizer import estimate_tokens
+
+    directory = None
+    path = args.path
+    if not path:
+        directory = tempfile.mkdtemp(prefix="session-db-")
+        path = os.path.join(directory, "sessions.db")
+    # 关闭后台定时写入，由测试显式调用flush
+    backend = SqliteSessionBackend(path, flush_interval=3600, batch_size=10 ** 9)
+
+    mark_time = 0.0
+    flush_time = 0.0
+    start = time.perf_counter()
+    for offset in range(0, args.sessions, args.batch):
+        sessions = []
+        for i in range(offset, min(offset + args.batch, args.sessions)):
+            session = Session(f"wechat_mp:o_bench_{i}", estimate_tokens)
+            session.append("user", f"你好，这是第{i}个用户的问题")
+            session.append("assistant", "你好！有什么可以帮你的吗？" * 3)
+            sessions.append(session)
+        t = time.perf_counter()
+        for session in sessions:
+            backend.mark_dirty(session)
+        mark_time += time.perf_counter() - t
+        t = time.perf_counter()
+        backend.flush()
+        flush_time += time.perf_counter() - t
+    elapsed = time.perf_counter() - start
+
+    latencies = []
+    found = 0
+    for _ in range(args.lookups):
+        # 约10%的查询是数据库中不存在的新用户
+        i = random.randrange(int(args.sessions * 1.1))
+        t = time.perf_counter()
+        if backend.load(f"wechat_mp:o_bench_{i}") is not None:
+            found += 1
+        latencies.append(time.perf_counter() - t)
+    lookup_time = sum(latencies)
+    latencies.sort()
+    backend.close()
+
+    size = sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix))
+    print(f"数据库: {path}，大小: {size / 1024 / 1024:.1f}MB，总耗时: {elapsed:.1f}秒(含构建会话)")
+    print_table(
+        ["operation", "count", "ops/s", "avg(us)", "p50(us)", "p99(us)"],
+        [
+            ["mark_dirty", args.sessions, f"{args.sessions / mark_time:.0f}", f"{mark_time / args.sessions * 1e6:.2f}", "-", "-"],
+            ["insert(flush)", args.sessions, f"{args.sessions / flush_time:.0f}", f"{flush_time / args.sessions * 1e6:.2f}", "-", "-"],
+            ["lookup", args.lookups, f"{args.lookups / lookup_time:.0f}", f"{lookup_time / args.lookups * 1e6:.2f}",
+             f"{percentile(latencies, 50) * 1e6:.1f}", f"{percentile(latencies, 99) * 1e6:.1f}"],
+        ]
+    )
+    print(f"查询命中: {found}/{args.lookups}")
+    if directory:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        os.rmdir(directory)
+
+def _traced_bytes(build):
+    """
+    测量build()返回的对象占用的内存
+    :return: (对象, 字节数)
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+def bench_memory(args):
+    """
+    会话内存基准测试：创建指定数量、每个包含若干轮对话的会话，
+    对比旧的存储方式（每个会话复制一份人设、消息为字典）和当前方式的每会话内存占用
+    """
+    persona = ("你是一名耐心、专业的客服助手，熟悉公司的全部产品和售后政策，回答时语气亲切。" * 20)[:args.persona_chars]
+    config.config.update({
+        "open_ai_api_key": "benchmark",
+        "character_desc": persona,
+        "conversation_max_tokens": 10 ** 9,
+        "session_max_count": 0,
+        "session_idle_ttl": 0,
+        "session_cold_after": 0,
+        "session_backend": ""
+    })
+    from bot.bot import DeepSeekBot
+
+    def user_text(i, t):
+        return f"用户{i}的第{t}个问题：请问这个产品应该怎么设置？"
+
+    def reply_text(i, t):
+        return f"您好，针对第{t}个问题：打开设置页面，选择对应选项并保存即可。如有其他问题请随时联系我们。({i})"
+
+    def build_legacy():
+        # 与原create_session一致：每个会话重新生成系统提示词，消息为字典列表
+        conversations = {}
+        for i in range(args.sessions):
+            session_id = f"wechat_mp:o_bench_{i}"
+            system_prompt = f"{persona}\n\n注意：你的回复会在微信公众号显示，过长的回复将被自动分段发送。如果可能，尽量控制单次回复长度在2000字以内，但不要因此牺牲回答质量。"
+            messages = [{"role": "system", "content": system_prompt}]
+            for t in range(args.turns):
+                messages.append({"role": "user", "content": user_text(i, t)})
+                messages.append({"role": "assistant", "content": reply_text(i, t)})
+            conversations[session_id] = {"session_id": session_id, "messages": messages}
+        return conversations
+
+    def build_compact(compress=False):
+        bot = DeepSeekBot()
+        for i in range(args.sessions):
+            session_id = f"wechat_mp:o_bench_{i}"
+            for t in range(args.turns):
+                bot.add_message(session_id, "user", user_text(i, t))
+                bot.add_message(session_id, "assistant", reply_text(i, t))
+        if compress:
+            for session in list(bot.conversations.sessions.values()):
+                with session.lock:
+                    session.compress()
+        return bot
+
+    legacy, legacy_bytes = _traced_bytes(build_legacy)
+    del legacy
+    # 两种方式的消息正文相同，单独统计便于对比结构开销
+    contents, content_bytes = _traced_bytes(lambda: [
+        text for i in range(args.sessions) for t in range(args.turns) for text in (user_text(i, t), reply_text(i, t))
+    ])
+    del contents
+    bot, compact_bytes = _traced_bytes(build_compact)
+    del bot
+    bot, cold_bytes = _traced_bytes(lambda: build_compact(compress=True))
+    del bot
+
+    n = args.sessions
+    print(f"会话数: {n}，每会话{args.turns}轮对话，人设长度: {len(persona)}字，消息正文约{content_bytes / n:.0f}字节/会话")
+    print_table(
+        ["layout", "total(MB)", "bytes/session", "vs legacy"],
+        [
+            ["legacy dict", f"{legacy_bytes / 1024 / 1024:.1f}", f"{legacy_bytes / n:.0f}", "1.00x"],
+            ["compact", f"{compact_bytes / 1024 / 1024:.1f}", f"{compact_bytes / n:.0f}", f"{legacy_bytes / compact_bytes:.2f}x"],
+            ["compact+cold", f"{cold_bytes / 1024 / 1024:.1f}", f"{cold_bytes / n:.0f}", f"{legacy_bytes / cold_bytes:.2f}x"],
+        ]
+    )
+
+# ---------------------------------------------------------------------------
+# hedging: 上游存在长尾延迟时，对比普通请求和对冲请求的延迟分布
+# ---------------------------------------------------------------------------
+
+def bench_hedging(args):
+    """
+    启动本地模拟API，按slow_rate的概率让请求延迟slow_delay秒，
+    分别关闭和开启对冲请求发送相同数量的消息（每条消息使用新会话），对比延迟分位数和上游请求数
+    """
+    import mock_api
+    options = mock_api.parse_args([
+        "--delay", str(args.delay), "--chunk-delay", "0", "--paragraphs", "1",
+        "--slow-rate", str(args.slow_rate), "--slow-delay", str(args.slow_delay)
+    ])
+    server = mock_api.MockApiServer(("127.0.0.1", 0), options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    config.config.update({
+        "open_ai_api_base": f"http://127.0.0.1:{server.server_address[1]}/v1",
+        "open_ai_api_key": "benchmark",
+        "character_desc": "benchmark",
+        "api_stream": False,
+        "api_adaptive_timeout": True,
+        "api_timeout": 60,
+        "session_backend": "",
+        "response_cache_enabled": False,
+        "request_coalescing_enabled": False
+    })
+    from bot.bot import DeepSeekBot
+
+    rows = []
+    for hedging in (False, True):
+        config.config["api_hedging_enabled"] = hedging
+        bot = DeepSeekBot()
+        # 预热：积累足够的耗时样本后才会计算分位数
+        for i in range(bot.latency.min_samples):
+            bot.reply(f"warmup:{i}", "预热")
+        with server.lock:
+            upstream_before = server.requests
+
+        latencies = []
+        lock = threading.Lock()
+        counter = iter(range(args.requests))
+
+        def worker():
+            for i in counter:
+                start = time.perf_counter()
+                bot.reply(f"bench:{i}", f"问题{i}")
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+
+        threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        latencies.sort()
+        hedge_stats = bot.hedger.get_stats() if bot.hedger else {"fired": 0, "won": 0}
+        rows.append([
+            "hedged" if hedging else "plain", args.requests,
+            f"{percentile(latencies, 50) * 1000:.0f}", f"{percentile(latencies, 95) * 1000:.0f}",
+            f"{percentile(latencies, 99) * 1000:.0f}", f"{latencies[-1] * 1000:.0f}",
+            server.requests - upstream_before, hedge_stats["fired"], hedge_stats["won"]
+        ])
+
+    server.shutdown()
+    print(f"上游: 首字延迟{args.delay}秒，{args.slow_rate:.0%}的请求延迟{args.slow_delay}秒")
+    print_table(
+        ["mode", "requests", "p50(ms)", "p95(ms)", "p99(ms)", "max(ms)", "upstream", "fired", "won"],
+        rows
+    )
+
+# ---------------------------------------------------------------------------
+# fairness: 少数用户连续发送大量长消息时，对比先进先出和公平调度下其他用户的等待时间
+# ---------------------------------------------------------------------------
+
+def bench_fairness(args):
+    """
+    重度用户先各自连续提交多条长消息，随后轻度用户各提交一条短消息，任务耗时与消息长度成正比；
+    fifo模式不传user（各会话仍串行），fair模式按用户公平调度、短消息优先；
+    两种模式分别在不限制和限制每个用户排队数量的情况下运行，限制由测试本身在提交前检查，两种模式完全相同
+    默认队列容量能容纳全部消息，不限制时对比的是排队时间；队列容量小于重度用户的积压时，不限制的结果只反映拒绝情况
+    """
+    from common.scheduler import JobScheduler
+
+    long_chars, short_chars = 1500, 10
+    limits = sorted({0, args.user_queue_limit})
+    rows = []
+    for limit in limits:
+        for mode in ("fifo", "fair"):
+            scheduler = JobScheduler(
+                workers=args.workers, queue_size=args.queue_size, overflow_policy="reject",
+                name=f"bench-{mode}-{limit}", user_queue_limit=0, quantum=500
+            )
+            waits = {"heavy": [], "light": []}
+            rejected = {"heavy": 0, "light": 0}
+            queued = {}
+            lock = threading.Lock()
+            total = args.heavy_users * args.heavy_messages + args.light_users
+            finished = threading.Semaphore(0)
+
+            def submit(kind, user, chars):
+                submit_time = time.perf_counter()
+
+                def run():
+                    with lock:
+                        waits[kind].append(time.perf_counter() - submit_time)
+                        queued[user] -= 1
+                    time.sleep(args.delay * chars / long_chars)
+                    finished.release()
+
+                def reject():
+                    with lock:
+                        rejected[kind] += 1
+                        queued[user] -= 1
+                    finished.release()
+
+                with lock:
+                    if limit and queued.get(user, 0) >= limit:
+                        rejected[kind] += 1
+                        finished.release()
+                        return
+                    queued[user] = queued.get(user, 0) + 1
+
+                fair = mode == "fair"
+                scheduler.submit(
+                    run, key=user, on_reject=reject,
+                    user=user if fair else None, cost=chars, priority=fair and chars <= 20
+                )
+
+            for m in range(args.heavy_messages):
+                for i in range(args.heavy_users):
+                    submit("heavy", f"heavy-{i}", long_chars)
+            for i in range(args.light_users):
+                submit("light", f"light-{i}", short_chars)
+            for _ in range(total):
+                finished.acquire()
+
+            for kind in ("heavy", "light"):
+                samples = sorted(waits[kind])
+                rows.append([
+                    mode, limit or "-", kind, len(samples) + rejected[kind], rejected[kind],
+                    f"{percentile(samples, 50) * 1000:.0f}" if samples else "-",
+                    f"{percentile(samples, 99) * 1000:.0f}" if samples else "-",
+                    f"{samples[-1] * 1000:.0f}" if samples else "-"
+                ])
+
+    print(f"重度用户{args.heavy_users}个×{args.heavy_messages}条长消息，轻度用户{args.light_users}个×1条短消息，"
+          f"工作线程{args.workers}，队列容量{args.queue_size}")
+    print_table(
+        ["mode", "user_limit", "users", "messages", "rejected", "wait p50(ms)", "wait p99(ms)", "wait max(ms)"],
+        rows
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="性能基准测试")
+    subparsers = parser.add_subparsers(dest="command")
+
+    ingress = subparsers.add_parser("ingress", help="对比http.server与asyncio入口服务器")
+    ingress.add_argument("--requests", type=int, default=2000, help="请求总数")
+    ingress.add_argument("--concurrency", type=int, default=32, help="并发连接数")
+    ingress.add_argument("--workers", type=int, default=16, help="处理线程数")
+    ingress.add_argument("--idle", type=int, default=0, help="测试期间保持的空闲连接数")
+    ingress.add_argument("--client-timeout", type=float, default=10, help="服务器读超时(秒)")
+    ingress.set_defaults(func=bench_ingress)
+
+    parse = subparsers.add_parser("parse", help="对比XML消息解析耗时")
+    parse.add_argument("--iterations", type=int, default=20000, help="每个样例的解析次数")
+    parse.set_defaults(func=bench_parse)
+
+    sessions = subparsers.add_parser("sessions", help="多会话并发压力测试，校验每个会话的消息顺序")
+    sessions.add_argument("--sessions", type=int, default=200, help="会话数量")
+    sessions.add_argument("--messages", type=int, default=10, help="每个会话连续发送的消息数")
+    sessions.add_argument("--workers", type=int, default=32, help="后台任务工作线程数")
+    sessions.add_argument("--delay", type=float, default=0.02, help="模拟API平均耗时(秒)")
+    sessions.set_defaults(func=bench_sessions)
+
+    session_db = subparsers.add_parser("session-db", help="会话持久化写入和查询吞吐量")
+    session_db.add_argument("--sessions", type=int, default=1000000, help="写入的会话数量")
+    session_db.add_argument("--batch", type=int, default=5000, help="每批写入的会话数量")
+    session_db.add_argument("--lookups", type=int, default=20000, help="随机查询次数")
+    session_db.add_argument("--path", default="", help="数据库路径，默认使用临时目录并在结束后删除")
+    session_db.set_defaults(func=bench_session_db)
+
+    memory = subparsers.add_parser("memory", help="对比会话的内存占用")
+    memory.add_argument("--sessions", type=int, default=100000, help="会话数量")
+    memory.add_argument("--turns", type=int, default=10, help="每个会话的对话轮数")
+    memory.add_argument("--persona-chars", type=int, default=500, help="人设长度(字)")
+    memory.set_defaults(func=bench_memory)
+
+    hedging = subparsers.add_parser("hedging", help="上游长尾延迟下对比普通请求和对冲请求")
+    hedging.add_argument("--requests", type=int, default=600, help="每种模式的请求数")
+    hedging.add_argument("--concurrency", type=int, default=8, help="并发数")
+    hedging.add_argument("--delay", type=float, default=0.05, help="正常请求的首字延迟(秒)")
+    hedging.add_argument("--slow-rate", type=float, default=0.03, help="慢请求的概率")
+    hedging.add_argument("--slow-delay", type=float, default=3.0, help="慢请求的首字延迟(秒)")
+    hedging.set_defaults(func=bench_hedging)
+
+    fairness = subparsers.add_parser("fairness", help="重度用户存在时对比先进先出和公平调度的排队等待")
+    fairness.add_argument("--heavy-users", type=int, default=40, help="重度用户数")
+    fairness.add_argument("--heavy-messages", type=int, default=10, help="每个重度用户连续发送的长消息数")
+    fairness.add_argument("--light-users", type=int, default=100, help="轻度用户数，每人一条短消息")
+    fairness.add_argument("--workers", type=int, default=8, help="工作线程数")
+    fairness.add_argument("--queue-size", type=int, default=600, help="队列容量")
+    fairness.add_argument("--user-queue-limit", type=int, default=5, help="每个用户最多排队的消息数，两种模式相同，另外还会运行一次不限制的对比")
+    fairness.add_argument("--delay", type=float, default=0.05, help="长消息的处理耗时(秒)")
+    fairness.set_defaults(func=bench_fairness)
+
+    args = parser.parse_args()
+    if not hasattr(args, "func"):
+        parser.print_help()
+        sys.exit(1)
+
+    # 基准测试不需要业务日志
+    logger.setLevel(logging.WARNING)
+    config.config.setdefault("wechat_mp_token", "benchmark")
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
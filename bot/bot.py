@@ -1,10 +1,26 @@
 import json
 import time
+import hashlib
 import requests
 import threading
 import re
 from common.log import logger
-from common.utils import generate_request_id, async_run
+from common.utils import generate_request_id, async_run, normalize_text, backoff_delay
+from common.cache import TTLCache
+from common.singleflight import SingleFlight
+from common.http_pool import PooledSession
+from common.segmenter import StreamSegmenter
+from common.stats import stats_registry
+from common.tokenizer import get_tokenizer
+from common.latency import LatencyTracker, Hedger
+from common.cancel import CancelToken, run_cancellable
+from common.debounce import Debouncer
+from common.scheduler import JobScheduler
+from bot.session import Session, Message
+from bot.session_store import SessionStore
+from bot.session_backend import create_session_backend
+from bot.compaction import SessionCompactor, format_transcript
+from bot.model_router import create_model_router
 from config import get_value
 
 class DeepSeekBot:
@@ -18,11 +34,152 @@ class DeepSeekBot:
         self.model = get_value("model", "deepseek-r1")
         self.character_desc = get_value("character_desc", "")
         self.conversation_max_tokens = get_value("conversation_max_tokens", 1000)
-        self.conversations = {}
-        self.lock = threading.RLock()
         self.api_timeout = get_value("api_timeout", 60)
         self.max_retries = get_value("api_max_retries", 2)
+        # 重试等待时间：指数退避加随机抖动
+        self.retry_base_delay = get_value("api_retry_base_delay", 1)
+        self.retry_max_delay = get_value("api_retry_max_delay", 16)
         self.bailian_app_id = get_value("bailian_app_id", "")
+        # 流式模式：段落生成后立即发送，不等待完整回复
+        self.stream_enabled = get_value("api_stream", False)
+        self.stream_segment_min_chars = get_value("stream_segment_min_chars", 100)
+        # 后台任务队列已满时的回复
+        self.busy_msg = get_value("scheduler_busy_msg", "当前咨询人数较多，请稍后再试")
+        # 不超过该长度的消息优先处理
+        self.short_prompt_chars = get_value("scheduler_short_prompt_chars", 20)
+        
+        # 所有API请求共用一个连接池，复用TCP/TLS连接
+        self.http = PooledSession(
+            pool_size=get_value("api_pool_size", 10),
+            keep_alive=get_value("api_keep_alive", True),
+            proxy=self.proxy
+        )
+        stats_registry.register("api_pool", self.http.get_stats)
+        
+        # 按模型接口统计最近请求的耗时，用于自适应超时、对冲请求和多模型路由
+        self.latency = LatencyTracker(
+            window=get_value("api_latency_window", 200),
+            min_samples=get_value("api_latency_min_samples", 20)
+        )
+        stats_registry.register("api_latency", self.latency.get_stats)
+        
+        # 多模型路由：未配置models时只有model/open_ai_api_base一个接口
+        # 每个接口有自己的熔断器，上游连续失败时快速失败，不让每条消息都等待完整的重试流程
+        self.router = create_model_router(
+            get_value("models", []),
+            {"model": self.model, "api_base": self.api_base, "api_key": self.api_key},
+            self.latency,
+            breaker_options={
+                "failure_threshold": get_value("circuit_breaker_threshold", 5),
+                "recovery_timeout": get_value("circuit_breaker_recovery", 30),
+                "half_open_max_calls": get_value("circuit_breaker_half_open_calls", 1)
+            },
+            error_window=get_value("router_error_window", 50),
+            error_ttl=get_value("router_error_ttl", 60),
+            max_error_rate=get_value("router_max_error_rate", 0.5)
+        )
+        stats_registry.register("model_router", self.router.get_stats)
+        stats_registry.register("circuit_breaker", self.router.get_breaker_stats)
+        self.circuit_open_msg = get_value("circuit_open_msg", "AI服务暂时不可用，请稍后再试")
+        
+        # 自适应超时：按首选接口最近耗时的p99计算
+        self.adaptive_timeout = get_value("api_adaptive_timeout", False)
+        self.api_timeout_min = get_value("api_timeout_min", 10)
+        self.api_timeout_factor = get_value("api_timeout_factor", 3)
+        # 对冲请求：超过最近耗时的p95仍未返回时再发一个相同的请求，采用先返回的结果
+        self.hedger = None
+        if get_value("api_hedging_enabled", False):
+            self.hedger = Hedger(workers=get_value("api_hedge_workers", 16))
+            stats_registry.register("api_hedging", self.hedger.get_stats)
+        
+        # 新消息取代同一会话未完成的回复：未开始的不再调用API，进行中的停止等待并丢弃结果
+        self.supersede_enabled = get_value("supersede_enabled", False)
+        self.reply_tokens = {}
+        self.supersede_lock = threading.Lock()
+        self.supersede_stats = {
+            "superseded": 0,
+            "calls_avoided": 0,
+            "tokens_avoided": 0,
+            "streams_aborted": 0,
+            "results_discarded": 0
+        }
+        self.api_call_scheduler = None
+        if self.supersede_enabled:
+            # 非流式请求在单独的线程中执行，回复被取代时工作线程不必等待请求返回
+            call_workers = get_value("scheduler_workers", 32)
+            self.api_call_scheduler = JobScheduler(workers=call_workers, queue_size=call_workers, overflow_policy="reject", name="api-call")
+            stats_registry.register("supersede", self.get_supersede_stats)
+        
+        # 最近清除会话的时间，清除前提交、清除后才开始处理的消息会被丢弃
+        self.session_resets = TTLCache(max_size=10000, ttl=3600)
+        
+        # 同一会话在防抖窗口内连续发送的消息合并为一条，只请求一次API
+        self.debouncer = None
+        debounce_window = get_value("debounce_window", 0)
+        if debounce_window > 0:
+            self.debouncer = Debouncer(
+                self._flush_debounced,
+                window=debounce_window,
+                max_wait=get_value("debounce_max_wait", 5),
+                max_items=get_value("debounce_max_messages", 10),
+                on_merge=self._release_merged
+            )
+            stats_registry.register("debounce", self.debouncer.get_stats)
+        
+        # 首轮对话回复缓存，键为归一化的用户消息、人设和模型
+        self.response_cache = None
+        if get_value("response_cache_enabled", False):
+            self.response_cache = TTLCache(
+                max_size=get_value("response_cache_size", 1000),
+                ttl=get_value("response_cache_ttl", 3600)
+            )
+            stats_registry.register("response_cache", self.response_cache.get_stats)
+        # 首轮对话的相同问题并发到达时，只调用一次API
+        self.singleflight = None
+        if get_value("request_coalescing_enabled", False):
+            self.singleflight = SingleFlight()
+            stats_registry.register("request_coalescing", self.singleflight.get_stats)
+        # 人设系统消息只构建一次，所有会话共用
+        self.tokenizer = get_tokenizer()
+        self.system_message = None
+        if self.character_desc and len(self.character_desc.strip()) > 0:
+            # 添加长度限制提示
+            system_prompt = f"{self.character_desc}\n\n注意：你的回复会在微信公众号显示，过长的回复将被自动分段发送。如果可能，尽量控制单次回复长度在2000字以内，但不要因此牺牲回答质量。"
+            self.system_message = Message("system", system_prompt, self.tokenizer(system_prompt))
+        # 会话存储：限制会话数量，清理长时间空闲的会话
+        self.conversations = SessionStore(
+            self._new_session,
+            max_sessions=get_value("session_max_count", 100000),
+            idle_ttl=get_value("session_idle_ttl", 86400),
+            cold_after=get_value("session_cold_after", 600)
+        )
+        self.conversations.start_sweeper(get_value("session_sweep_interval", 60))
+        stats_registry.register("sessions", self.conversations.get_stats)
+        # 会话持久化：重启后用户的下一条消息到达时再从数据库加载历史
+        self.session_backend = create_session_backend(
+            get_value("session_backend", ""),
+            get_value("session_db_path", "data/sessions.db"),
+            flush_interval=get_value("session_flush_interval", 1.0),
+            retention=get_value("session_db_retention", 2592000)
+        )
+        if self.session_backend is not None:
+            stats_registry.register("session_db", self.session_backend.get_stats)
+        # 对话压缩：超过高水位时由后台任务把最早的几轮对话总结为摘要，而不是直接丢弃
+        self.compactor = None
+        if get_value("conversation_compaction", False):
+            self.compaction_prompt = get_value(
+                "compaction_prompt",
+                "请用不超过200字总结下面的对话，保留用户的身份信息、需求、偏好和已经给出的关键结论，只输出摘要。"
+            )
+            self.compaction_max_tokens = get_value("compaction_max_tokens", 300)
+            self.compactor = SessionCompactor(
+                self._summarize,
+                high_water=int(self.conversation_max_tokens * get_value("compaction_high_water", 0.7)),
+                keep_messages=get_value("compaction_keep_messages", 4),
+                on_compacted=self._mark_dirty
+            )
+            stats_registry.register("compaction", self.compactor.get_stats)
+        self.persona_digest = hashlib.md5(self.character_desc.encode("utf-8")).hexdigest()
         
         if self.model == "bailian-app" and not self.bailian_app_id:
             logger.error("使用百炼应用模式但未设置应用ID，请在config.json中配置bailian_app_id")
@@ -35,11 +192,23 @@ class DeepSeekBot:
         if not self.api_key or self.api_key == "YOUR_API_KEY":
             logger.error("API Key未设置，请在config.json中配置open_ai_api_key")
 
-    def calculate_timeout(self, message):
+    def _latency_key(self, endpoint, stream=False):
+        """耗时统计键，流式请求统计首段内容的到达时间，与完整响应分开统计"""
+        return f"{endpoint.name}:stream" if stream else endpoint.name
+
+    def calculate_timeout(self, message, stream=False):
         """
         根据消息长度和复杂度动态计算合理的超时时间
+        启用自适应超时后，基础超时按首选模型接口最近请求耗时的p99乘以系数计算，不超过api_timeout
+        :param message: 用户消息
+        :param stream: 是否为流式请求
+        :return: 超时时间(秒)
         """
         base_timeout = self.api_timeout
+        if self.adaptive_timeout:
+            p99 = self.latency.percentile(self._latency_key(self.router.primary, stream), 0.99)
+            if p99 is not None:
+                base_timeout = round(min(self.api_timeout, max(self.api_timeout_min, p99 * self.api_timeout_factor)), 1)
         msg_length = len(message)
         
         # 针对较长消息增加超时时间
@@ -50,130 +219,235 @@ class DeepSeekBot:
         
         return base_timeout
 
+    def _new_session(self, session_id):
+        """构建新会话，由会话存储调用"""
+        if self.system_message:
+            logger.debug(f"为会话 {session_id} 添加系统消息(人设)")
+        session = Session(session_id, self.tokenizer, self.system_message)
+        session.loaded = self.session_backend is None
+        return session
+
     def create_session(self, session_id):
-        """创建会话"""
-        with self.lock:
-            if session_id not in self.conversations:
-                self.conversations[session_id] = {
-                    "session_id": session_id,
-                    "messages": []
-                }
-                # 添加系统消息
-                if self.character_desc and len(self.character_desc.strip()) > 0:
-                    # 添加长度限制提示
-                    system_prompt = f"{self.character_desc}\n\n注意：你的回复会在微信公众号显示，过长的回复将被自动分段发送。如果可能，尽量控制单次回复长度在2000字以内，但不要因此牺牲回答质量。"
-                    self.conversations[session_id]["messages"].append({
-                        "role": "system",
-                        "content": system_prompt
-                    })
-                    logger.debug(f"为会话 {session_id} 添加系统消息(人设)")
-            
-            # 确保会话有系统消息
-            session = self.conversations[session_id]
-            has_system_message = any(msg["role"] == "system" for msg in session["messages"])
-            
-            if not has_system_message and self.character_desc and len(self.character_desc.strip()) > 0:
-                # 添加长度限制提示
-                system_prompt = f"{self.character_desc}\n\n注意：你的回复会在微信公众号显示，过长的回复将被自动分段发送。如果可能，尽量控制单次回复长度在2000字以内，但不要因此牺牲回答质量。"
-                session["messages"].insert(0, {
-                    "role": "system",
-                    "content": system_prompt
-                })
-            
-            return self.conversations[session_id]
+        """
+        获取或创建会话
+        会话存储只在查找和创建时短暂加锁，会话内容由每个会话自己的锁保护，不同会话互不阻塞
+        """
+        session = self.conversations.get_or_create(session_id)
+        if not session.loaded:
+            self._load_session(session)
+        return session
+
+    def _load_session(self, session):
+        """
+        从持久化后端加载会话历史，只持有该会话的锁
+        """
+        with session.lock:
+            if session.loaded:
+                return
+            try:
+                history = self.session_backend.load(session.session_id)
+            except Exception as e:
+                logger.error(f"加载会话失败: {session.session_id}, {str(e)}")
+                history = None
+            session.loaded = True
+            if history:
+                for message in history:
+                    session.append(message["role"], message["content"])
+                session.trim(self.conversation_max_tokens)
+                logger.debug(f"从数据库恢复会话 {session.session_id}，消息数: {len(history)}")
 
     def get_session(self, session_id):
         """获取会话"""
-        with self.lock:
-            return self.create_session(session_id)
+        return self.create_session(session_id)
 
-    def add_message(self, session_id, message):
-        """添加消息到会话"""
-        with self.lock:
-            session = self.create_session(session_id)
-            session["messages"].append(message)
+    def clear_session(self, session_id):
+        """
+        清除会话的对话历史（包括持久化的历史），下一条消息开始新的对话
+        清除前收到、尚未完成的消息不再回复，也不写入新的会话
+        :param session_id: 会话ID
+        """
+        self.session_resets.set(session_id, time.time())
+        # 防抖窗口中尚未提交的消息直接丢弃，合并时已经通知过前面的消息，只需通知最后一条
+        if self.debouncer is not None:
+            items = self.debouncer.discard(session_id)
+            if items:
+                self._release_merged(session_id, items[-1])
+        with self.supersede_lock:
+            token = self.reply_tokens.pop(session_id, None)
+        if token is not None:
+            token.cancel()
+        # 进行中的回复持有旧会话对象，标记后它的写入会被丢弃；不需要等待会话锁
+        session = self.conversations.pop(session_id)
+        if session is not None:
+            session.cleared = True
+        if self.session_backend is not None:
+            try:
+                self.session_backend.delete(session_id)
+            except Exception as e:
+                logger.error(f"删除会话失败: {session_id}, {str(e)}")
+        logger.info(f"已清除会话: {session_id}")
+
+    def add_message(self, session_id, role, content):
+        """
+        添加消息到会话
+        :param session_id: 会话ID
+        :param role: 角色，user或assistant
+        :param content: 消息内容
+        """
+        return self._append(self.create_session(session_id), role, content)
+
+    def _append(self, session, role, content):
+        """
+        添加消息到指定的会话对象，已被清除的会话不再写入
+        :param session: 会话对象
+        :param role: 角色，user或assistant
+        :param content: 消息内容
+        :return: 会话对象
+        """
+        with session.lock:
+            if session.cleared:
+                return session
+            session.append(role, content)
             
             # 限制会话长度，保持在最大token限制内
-            self._trim_conversation(session)
+            session.trim(self.conversation_max_tokens)
+            
+            # 超过高水位时提交后台压缩任务，不等待结果
+            if self.compactor is not None:
+                self.compactor.maybe_schedule(session)
+            
+            self._mark_dirty(session)
             
             return session
-    
-    def _trim_conversation(self, session):
+
+    def _mark_dirty(self, session):
+        """标记会话需要持久化，由后台线程批量写入数据库"""
+        if self.session_backend is not None and not session.cleared:
+            self.session_backend.mark_dirty(session)
+
+    def _summarize(self, messages):
         """
-        清理会话历史，保持在token限制内
-        保留系统消息和最近的用户消息和AI回复
+        调用模型把多轮对话总结为简短摘要，由压缩任务在后台调用
+        后台请求不经过对冲、重试，不计入耗时统计和熔断器，不影响用户请求的超时、对冲和熔断判断；
+        失败时本次放弃，会话下次超过高水位时再压缩
+        :param messages: 要总结的消息列表
+        :return: (成功标志, 摘要或错误信息)
         """
-        messages = session["messages"]
-        
-        # 如果消息数量少于3，不需要清理
-        if len(messages) < 3:
-            return
-            
-        # 分离系统消息和其他消息
-        system_messages = [msg for msg in messages if msg["role"] == "system"]
-        other_messages = [msg for msg in messages if msg["role"] != "system"]
-        
-        # 计算大致的token数量
-        # 这是一个简化的估计，每个字符大约0.5-1个token
-        total_chars = sum(len(msg["content"]) for msg in messages)
-        estimated_tokens = total_chars * 0.7  # 简单估计
-        
-        # 如果预估token数量超过限制，删除较早的非系统消息
-        while estimated_tokens > self.conversation_max_tokens and len(other_messages) > 4:
-            # 每次删除一对对话（用户消息和助手回复）
-            if len(other_messages) >= 2:
-                other_messages.pop(0)  # 删除最早的消息
-                if other_messages and other_messages[0]["role"] == "assistant":
-                    other_messages.pop(0)  # 如果下一条是助手回复，也删除
-            else:
-                # 如果只剩下一条非系统消息，则停止删除
-                break
-                
-            # 重新计算token估计
-            total_chars = sum(len(msg["content"]) for msg in system_messages) + sum(len(msg["content"]) for msg in other_messages)
-            estimated_tokens = total_chars * 0.7
-        
-        # 重建会话消息列表，保持系统消息在最前面
-        session["messages"] = system_messages + other_messages
+        prompt = [
+            Message("system", self.compaction_prompt),
+            Message("user", format_transcript(messages))
+        ]
+        endpoint = self.router.preferred(len(prompt[1].content))
+        if endpoint is None:
+            return False, "上游服务熔断中"
+        data = self._build_request(endpoint, prompt)
+        if "max_tokens" in data:
+            # 摘要不超过原文的一半，否则压缩后仍会很快再次超过高水位
+            old_tokens = sum(message.tokens for message in messages)
+            data["max_tokens"] = max(1, min(self.compaction_max_tokens, old_tokens // 2))
+        return self._post_unrecorded(endpoint, data, self.api_timeout)
 
-    def send_to_api(self, messages, timeout):
+    def _is_first_turn(self, session):
         """
-        发送请求到API
-        :param messages: 消息列表
-        :param timeout: 超时时间
-        :return: (成功标志, 结果或错误信息)
+        判断会话是否处于首轮对话，即历史中只有系统消息
+        """
+        with session.lock:
+            return session.is_first_turn()
+
+    def _build_cache_key(self, message, stream=False):
+        """
+        构建回复缓存键：路由选中的模型 + 人设摘要 + 归一化后的用户消息
+        不同模型的回复不共用缓存，按消息长度或接口健康状况改用其他模型时不会命中原模型的回复
+        :param message: 用户消息
+        :param stream: 是否为流式请求
+        """
+        endpoint = self.router.preferred(len(message), stream)
+        model = endpoint.model if endpoint is not None else self.model
+        return (model, self.persona_digest, normalize_text(message))
+
+    def _prompt_chars(self, messages):
+        """最后一条用户消息的长度，用于按长度规则选择模型接口"""
+        for message in reversed(messages):
+            if message.role == "user":
+                return len(message.content)
+        return 0
+
+    def _build_request(self, endpoint, messages, stream=False):
+        """
+        构建请求数据
+        :param endpoint: 模型接口
+        :param messages: 会话消息(Message)列表，在这里转换为API格式
+        :param stream: 是否为流式请求
+        :return: 请求数据
         """
-        # 准备请求数据
-        if self.model == "bailian-app":
+        if endpoint.model == "bailian-app":
             # 百炼应用请求格式
-            data = {
-                "model": self.model,
-                "messages": messages,
+            return {
+                "model": endpoint.model,
+                "messages": [message.to_dict() for message in messages],
                 "parameters": {
                     "app_id": self.bailian_app_id,  # 百炼应用ID
                     "stream": False
                 }
             }
-            api_endpoint = f"{self.api_base}/chat/completions"
+        # 通义千问兼容模式
+        return {
+            "model": endpoint.model,
+            "messages": [message.to_dict() for message in messages],
+            "stream": stream,
+            "temperature": 0.7,
+            "max_tokens": 2000,
+            "top_p": 0.95
+        }
+
+    def _next_attempt(self, route, retry_count, timeout):
+        """
+        选择本次尝试使用的接口：失败后依次改用备选接口，所有接口都试过后从首选接口重新开始
+        :param route: 候选接口列表
+        :param retry_count: 已重试次数
+        :param timeout: 超时时间
+        :return: (接口, 本次请求的超时时间)
+        """
+        endpoint = route[retry_count % len(route)]
+        if retry_count and endpoint is not route[0]:
+            self.router.mark_fallback(endpoint)
+        # 有备选接口时，单次请求超过耗时预算即改用备选接口
+        if endpoint.latency_budget and len(route) > 1:
+            timeout = min(timeout, endpoint.latency_budget)
+        return endpoint, timeout
+
+    def _wait_before_retry(self, route, retry_count, cancel=None):
+        """
+        重试前等待，还有没试过的备选接口时立即重试
+        :param cancel: 取消标记(CancelToken)，等待期间被取消时立即结束等待，由调用方在下次请求前放弃
+        :return: 是否继续重试
+        """
+        # 所有上游接口都已被熔断，不再等待重试
+        if self.router.is_open():
+            logger.warning("熔断器已打开，停止重试")
+            return False
+        if retry_count < len(route):
+            return True
+        # 退避策略：指数退避加随机抖动，避免大量请求同时重试
+        wait_time = backoff_delay(retry_count - len(route) + 1, self.retry_base_delay, self.retry_max_delay)
+        logger.info(f"等待{wait_time:.1f}秒后重试")
+        if cancel is not None:
+            cancel.event.wait(wait_time)
         else:
-            # 通义千问兼容模式
-            data = {
-                "model": self.model,
-                "messages": messages,
-                "stream": False,
-                "temperature": 0.7,
-                "max_tokens": 2000,
-                "top_p": 0.95
-            }
-            api_endpoint = f"{self.api_base}/chat/completions"
-        
-        # 设置代理
-        proxies = None
-        if self.proxy:
-            proxies = {
-                "http": self.proxy,
-                "https": self.proxy
-            }
+            time.sleep(wait_time)
+        return True
+
+    def send_to_api(self, messages, timeout, cancel=None):
+        """
+        发送请求到API，按用户消息长度和各接口最近的耗时、错误率选择模型接口，失败或超出耗时预算时改用备选接口
+        :param messages: 会话消息(Message)列表，在这里转换为API格式
+        :param timeout: 超时时间
+        :param cancel: 取消标记(CancelToken)，取消后不再重试
+        :return: (成功标志, 结果或错误信息)
+        """
+        route = self.router.route(self._prompt_chars(messages))
+        if not route:
+            return False, "上游服务熔断中"
         
         # 记录开始时间
         start_time = time.time()
@@ -182,43 +456,225 @@ class DeepSeekBot:
         retry_count = 0
         
         while retry_count <= self.max_retries:
-            try:
-                # 发送请求
-                response = requests.post(
-                    api_endpoint,
-                    headers={
-                        "Content-Type": "application/json",
-                        "Authorization": f"Bearer {self.api_key}"
-                    },
-                    json=data,
-                    proxies=proxies,
-                    timeout=timeout
-                )
-                
-                # 如果成功，返回结果
-                if response.status_code == 200:
-                    result = response.json()
-                    reply_content = result["choices"][0]["message"]["content"].strip()
+            # 回复已被新消息取代，不再发出请求（包括第一次请求）
+            if cancel is not None and cancel.cancelled:
+                logger.info("回复已被新消息取代，不再请求API")
+                return False, "回复已被新消息取代"
+            
+            endpoint, attempt_timeout = self._next_attempt(route, retry_count, timeout)
+            data = self._build_request(endpoint, messages)
+            
+            # 超过该接口最近耗时的p95时发出对冲请求，样本不足或p95已接近超时则不对冲
+            hedge_delay = None
+            if self.hedger is not None:
+                hedge_delay = self.latency.percentile(self._latency_key(endpoint), 0.95)
+                if hedge_delay is not None and hedge_delay >= attempt_timeout / 2:
+                    hedge_delay = None
+            
+            if hedge_delay is not None:
+                success, result = self.hedger.call(self._post_completion, hedge_delay, endpoint, data, attempt_timeout)
+            else:
+                success, result = self._post_completion(endpoint, data, attempt_timeout)
+            
+            # 如果成功，返回结果
+            if success:
+                # 计算耗时
+                elapsed_time = time.time() - start_time
+                logger.info(f"API响应成功，模型: {endpoint.name}，耗时: {elapsed_time:.2f}秒")
+                return True, result
+            
+            logger.warning(f"{result}, 模型: {endpoint.name}, 第{retry_count+1}次重试")
+            
+            # 增加重试计数
+            retry_count += 1
+            
+            # 如果已经达到最大重试次数，跳出循环
+            if retry_count > self.max_retries:
+                break
+            
+            if not self._wait_before_retry(route, retry_count, cancel):
+                break
+        
+        # 所有重试都失败了
+        return False, "API请求失败，无法获取回复"
+
+    def _post_completion(self, endpoint, data, timeout):
+        """
+        向指定接口发送一次非流式请求，记录结果和耗时
+        :param endpoint: 模型接口
+        :param data: 请求数据
+        :param timeout: 超时时间
+        :return: (成功标志, 回复内容或错误信息)
+        """
+        if not endpoint.breaker.allow():
+            return False, "上游服务熔断中"
+        
+        start_time = time.time()
+        try:
+            # 发送请求
+            response = self.http.post(
+                endpoint.url,
+                headers={
+                    "Content-Type": "application/json",
+                    "Authorization": f"Bearer {endpoint.api_key}"
+                },
+                json=data,
+                timeout=timeout
+            )
+            
+            # 状态码不是200，返回错误由调用方重试
+            if response.status_code != 200:
+                endpoint.record_status(response.status_code)
+                return False, f"API请求失败: HTTP {response.status_code}, {response.text}"
+            
+            result = response.json()
+            reply_content = result["choices"][0]["message"]["content"].strip()
+            self.latency.record(self._latency_key(endpoint), time.time() - start_time)
+            endpoint.record_success()
+            return True, reply_content
+            
+        except requests.exceptions.Timeout:
+            endpoint.record_failure()
+            return False, "请求超时"
+            
+        except Exception as e:
+            endpoint.record_failure()
+            return False, f"请求异常: {str(e)}"
+
+    def _post_unrecorded(self, endpoint, data, timeout):
+        """
+        发送一次非流式的后台请求，不占用熔断器的半开试探名额，也不记录结果和耗时
+        :param endpoint: 模型接口
+        :param data: 请求数据
+        :param timeout: 超时时间
+        :return: (成功标志, 回复内容或错误信息)
+        """
+        if endpoint.breaker.is_open():
+            return False, "上游服务熔断中"
+        try:
+            response = self.http.post(
+                endpoint.url,
+                headers={
+                    "Content-Type": "application/json",
+                    "Authorization": f"Bearer {endpoint.api_key}"
+                },
+                json=data,
+                timeout=timeout
+            )
+            if response.status_code != 200:
+                return False, f"API请求失败: HTTP {response.status_code}, {response.text}"
+            return True, response.json()["choices"][0]["message"]["content"].strip()
+        except requests.exceptions.Timeout:
+            return False, "请求超时"
+        except Exception as e:
+            return False, f"请求异常: {str(e)}"
+
+    def send_to_api_stream(self, messages, timeout, on_segment, cancel=None):
+        """
+        以流式(SSE)方式发送请求，段落生成完成后立即通过on_segment交付
+        :param messages: 会话消息(Message)列表，在这里转换为API格式
+        :param timeout: 超时时间，流式模式下为两次数据之间的最长等待时间
+        :param on_segment: 段落回调函数，参数为段落内容
+        :param cancel: 取消标记(CancelToken)，取消后关闭连接，上游停止生成
+        :return: (成功标志, 完整回复或错误信息, 尚未交付的剩余内容)
+        """
+        route = self.router.route(self._prompt_chars(messages), stream=True)
+        if not route:
+            return False, "上游服务熔断中", None
+        
+        # 记录开始时间
+        start_time = time.time()
+        
+        # 重试逻辑
+        retry_count = 0
+        delivered = 0
+        
+        while retry_count <= self.max_retries:
+            # 回复已被新消息取代，不再发出请求（包括第一次请求）
+            if cancel is not None and cancel.cancelled:
+                logger.info("回复已被新消息取代，不再请求API")
+                return False, "回复已被新消息取代", None
+            
+            endpoint, attempt_timeout = self._next_attempt(route, retry_count, timeout)
+            data = self._build_request(endpoint, messages, stream=True)
+            segmenter = StreamSegmenter(min_length=self.stream_segment_min_chars)
+            content_parts = []
+            attempt_start = time.time()
+            
+            if not endpoint.breaker.allow():
+                error_msg = "上游服务熔断中"
+                logger.warning(f"{error_msg}, 模型: {endpoint.name}, 第{retry_count+1}次重试")
+            else:
+                try:
+                    with self.http.post(
+                        endpoint.url,
+                        headers={
+                            "Content-Type": "application/json",
+                            "Accept": "text/event-stream",
+                            "Authorization": f"Bearer {endpoint.api_key}"
+                        },
+                        json=data,
+                        timeout=attempt_timeout,
+                        stream=True
+                    ) as response:
+                        if response.status_code == 200:
+                            # SSE响应通常不声明字符集，需显式按UTF-8解码
+                            response.encoding = "utf-8"
+                            for line in response.iter_lines(decode_unicode=True):
+                                # 回复已被新消息取代，关闭连接，不再接收剩余内容
+                                if cancel is not None and cancel.cancelled:
+                                    endpoint.record_success()
+                                    self._count_supersede("streams_aborted")
+                                    logger.info(f"回复已被新消息取代，停止接收，模型: {endpoint.name}")
+                                    return False, "回复已被新消息取代", None
+                                if not line or not line.startswith("data:"):
+                                    continue
+                                payload = line[5:].strip()
+                                if payload == "[DONE]":
+                                    break
+                                
+                                chunk = json.loads(payload)
+                                choices = chunk.get("choices") or []
+                                if not choices:
+                                    continue
+                                text = (choices[0].get("delta") or {}).get("content")
+                                if not text:
+                                    continue
+                                
+                                if not content_parts:
+                                    self.latency.record(self._latency_key(endpoint, stream=True), time.time() - attempt_start)
+                                content_parts.append(text)
+                                for segment in segmenter.feed(text):
+                                    if delivered == 0:
+                                        logger.info(f"首段回复已生成，耗时: {time.time() - start_time:.2f}秒")
+                                    on_segment(segment)
+                                    delivered += 1
+                            
+                            endpoint.record_success()
+                            reply_content = "".join(content_parts).strip()
+                            elapsed_time = time.time() - start_time
+                            logger.info(f"API流式响应成功，模型: {endpoint.name}，耗时: {elapsed_time:.2f}秒，提前发送{delivered}段")
+                            return True, reply_content, segmenter.flush()
+                        
+                        # 状态码不是200，记录错误继续重试
+                        endpoint.record_status(response.status_code)
+                        error_msg = f"API请求失败: HTTP {response.status_code}, {response.text}"
+                        logger.warning(f"{error_msg}, 模型: {endpoint.name}, 第{retry_count+1}次重试")
                     
-                    # 计算耗时
-                    elapsed_time = time.time() - start_time
-                    logger.info(f"API响应成功，耗时: {elapsed_time:.2f}秒")
+                except requests.exceptions.Timeout:
+                    endpoint.record_failure()
+                    error_msg = "请求超时"
+                    logger.warning(f"{error_msg}, 模型: {endpoint.name}, 第{retry_count+1}次重试")
                     
-                    return True, reply_content
-                
-                # 状态码不是200，记录错误继续重试
-                error_msg = f"API请求失败: HTTP {response.status_code}, {response.text}"
-                logger.warning(f"{error_msg}, 第{retry_count+1}次重试")
-                
-            except requests.exceptions.Timeout:
-                # 超时后增加重试计数
-                error_msg = "请求超时"
-                logger.warning(f"{error_msg}, 第{retry_count+1}次重试")
-                
-            except Exception as e:
-                # 其他异常
-                error_msg = f"请求异常: {str(e)}"
-                logger.error(f"{error_msg}, 第{retry_count+1}次重试")
+                except Exception as e:
+                    endpoint.record_failure()
+                    error_msg = f"请求异常: {str(e)}"
+                    logger.error(f"{error_msg}, 模型: {endpoint.name}, 第{retry_count+1}次重试")
+            
+            # 已有段落发送给用户，重试会导致内容重复，直接失败
+            if delivered > 0:
+                logger.error(f"流式回复中断，已发送{delivered}段")
+                return False, "回复中断", None
             
             # 增加重试计数
             retry_count += 1
@@ -227,20 +683,21 @@ class DeepSeekBot:
             if retry_count > self.max_retries:
                 break
             
-            # 退避策略：每次等待时间加倍
-            wait_time = retry_count * 2
-            logger.info(f"等待{wait_time}秒后重试")
-            time.sleep(wait_time)
+            if not self._wait_before_retry(route, retry_count, cancel):
+                break
         
         # 所有重试都失败了
-        return False, "API请求失败，无法获取回复"
+        return False, "API请求失败，无法获取回复", None
 
-    def reply(self, session_id, message):
+    def reply(self, session_id, message, on_segment=None, cancel=None, submitted_at=None):
         """
         同步回复消息
         :param session_id: 会话ID
         :param message: 用户消息
-        :return: 回复内容
+        :param on_segment: 段落回调函数，启用流式模式时长回复的前几段会提前通过它发送
+        :param cancel: 取消标记(CancelToken)，同一会话的新消息到达时被取消
+        :param submitted_at: 消息的提交时间，之后会话被清除时不再处理，None表示不检查
+        :return: 回复内容；流式模式下只返回尚未通过on_segment发送的剩余内容；已被新消息取代或会话已被清除时返回None
         """
         request_id = generate_request_id()
         logger.info(f"API请求: [{request_id}] {message}")
@@ -253,37 +710,168 @@ class DeepSeekBot:
         # 获取会话
         session = self.get_session(session_id)
         
-        # 添加用户消息到会话
-        self.add_message(session_id, {"role": "user", "content": message})
+        # 同一会话的请求由调度器按会话串行执行，保证历史记录按顺序写入；
+        # 会话锁只在读写历史时持有，请求API期间不持有，不影响会话的淘汰、压缩和持久化
+        with session.lock:
+            # 排队期间会话被清除：清除前的消息不再处理
+            reset_at = self.session_resets.get(session_id)
+            if session.cleared or (submitted_at is not None and reset_at is not None and reset_at >= submitted_at):
+                logger.info(f"会话已清除，丢弃清除前的消息: [{request_id}]")
+                return None
+            
+            # 排队期间已被新消息取代：不再调用API，用户消息仍写入历史，作为新消息的上下文
+            if cancel is not None and cancel.cancelled:
+                self._count_supersede("calls_avoided")
+                self._count_supersede("tokens_avoided", session.total_tokens + self.tokenizer(message))
+                self._append(session, "user", message)
+                logger.info(f"消息已被新消息取代，跳过API请求: [{request_id}]")
+                return None
+            
+            # 流式模式，百炼应用不支持
+            use_stream = on_segment is not None and self.stream_enabled and self.model != "bailian-app"
+            
+            # 首轮对话（历史中只有人设）可以使用回复缓存和请求合并
+            cache_key = None
+            if (self.response_cache is not None or self.singleflight is not None) and self._is_first_turn(session):
+                cache_key = self._build_cache_key(message, use_stream)
+            
+            if cache_key is not None and self.response_cache is not None:
+                cached_reply = self.response_cache.get(cache_key)
+                if cached_reply is not None:
+                    logger.info(f"命中回复缓存: [{request_id}]")
+                    self._append(session, "user", message)
+                    self._append(session, "assistant", cached_reply)
+                    return cached_reply
+            
+            # 上游熔断中直接回复提示，不写入历史，也不占用工作线程等待
+            if self.router.is_open():
+                logger.warning(f"上游服务熔断中，快速失败: [{request_id}]")
+                return self.circuit_open_msg
+            
+            # 添加用户消息到会话
+            self._append(session, "user", message)
+            
+            # 准备请求数据（新列表，请求期间会话的变化不影响它）
+            messages = session.messages
         
-        # 准备请求数据
-        messages = session["messages"].copy()
+        if use_stream:
+            send_segment = on_segment
+            
+            # 会话被清除后不再发送剩余的段落
+            def on_segment(segment):
+                if not session.cleared:
+                    send_segment(segment)
         
         # 计算动态超时时间
-        dynamic_timeout = self.calculate_timeout(message)
+        dynamic_timeout = self.calculate_timeout(message, stream=use_stream)
+        
+        # 合并的请求由多个会话共享，不能因为其中一个会话被取代而中断
+        call_cancel = cancel if cache_key is None or self.singleflight is None else None
+        
+        def call_api():
+            if use_stream:
+                return self.send_to_api_stream(messages, dynamic_timeout, on_segment, call_cancel)
+            if call_cancel is not None:
+                # 在单独的线程中请求，被取代时立即停止等待
+                finished, outcome = run_cancellable(
+                    self.api_call_scheduler, call_cancel, self.send_to_api, messages, dynamic_timeout, call_cancel
+                )
+                if not finished:
+                    return False, "回复已被新消息取代", None
+                success, result = outcome
+            else:
+                success, result = self.send_to_api(messages, dynamic_timeout)
+            return success, result, result
         
         # 发送请求到API
-        success, result = self.send_to_api(messages, dynamic_timeout)
+        if cache_key is not None and self.singleflight is not None:
+            (success, result, remainder), shared = self.singleflight.do(cache_key, call_api)
+            if shared:
+                # 共享其他会话的结果时，本会话没有收到任何流式段落，需要完整回复
+                logger.info(f"合并相同请求，共享回复: [{request_id}]")
+                remainder = result
+        else:
+            success, result, remainder = call_api()
+        
+        # 请求期间已被新消息取代，丢弃结果，不写入历史
+        if cancel is not None and cancel.cancelled:
+            self._count_supersede("results_discarded")
+            logger.info(f"回复已被新消息取代，丢弃结果: [{request_id}]")
+            return None
+        
+        # 请求期间会话被清除，丢弃结果
+        if session.cleared:
+            logger.info(f"会话已清除，丢弃回复: [{request_id}]")
+            return None
         
         if success:
+            # 请求期间会话可能因容量或空闲被淘汰，放回存储；已有同ID的新会话时写入新会话
+            current = self.conversations.reattach(session)
+            if current is not session:
+                logger.info(f"会话已在请求期间重建，回复写入新会话: [{request_id}]")
+                self._append(current, "user", message)
             # 添加助手回复到会话
-            self.add_message(session_id, {"role": "assistant", "content": result})
-            return result
+            self._append(current, "assistant", result)
+            if cache_key is not None and self.response_cache is not None and result:
+                self.response_cache.set(cache_key, result)
+            return remainder
         else:
             logger.error(f"API请求失败: {result}")
+            if self.router.is_open():
+                return self.circuit_open_msg
             return f"很抱歉，无法获取回复。错误: {result}"
 
-    def reply_async(self, session_id, message, callback=None):
+    def reply_async(self, session_id, message, callback=None, on_segment=None):
         """
         异步回复，立即返回，后台处理
         :param session_id: 会话ID
         :param message: 用户消息
-        :param callback: 回调函数，处理完成后调用
+        :param callback: 回调函数，处理完成后调用，参数为(会话ID, 回复内容)，回复内容为None表示已被新消息取代或合并，不需要发送
+        :param on_segment: 段落回调函数，流式模式下提前发送已完成的段落
         :return: 状态信息
         """
+        if self.debouncer is not None:
+            self.debouncer.add(session_id, (message, callback, on_segment))
+        else:
+            self._submit_reply(session_id, message, callback, on_segment)
+        
+        return {
+            "success": True,
+            "message": "正在处理中"
+        }
+
+    def _flush_debounced(self, session_id, items):
+        """
+        防抖窗口结束，把合并的消息作为一条用户消息提交，回复交给最后一条消息的回调
+        :param session_id: 会话ID
+        :param items: (消息, 回调函数, 段落回调函数)列表
+        """
+        message = "\n".join(item[0] for item in items)
+        _, callback, on_segment = items[-1]
+        if len(items) > 1:
+            logger.info(f"合并{len(items)}条连续消息: {session_id}")
+        self._submit_reply(session_id, message, callback, on_segment)
+
+    def _release_merged(self, session_id, item):
+        """消息已合并到后续消息中，通知它的回调不需要回复"""
+        callback = item[1]
+        if callback:
+            callback(session_id, None)
+
+    def _submit_reply(self, session_id, message, callback, on_segment):
+        """
+        把一条消息提交到后台任务调度器
+        :param session_id: 会话ID
+        :param message: 用户消息
+        :param callback: 回调函数
+        :param on_segment: 段落回调函数
+        """
+        cancel = self._supersede(session_id) if self.supersede_enabled else None
+        submitted_at = time.time()
+        
         def process_async_reply():
             try:
-                reply = self.reply(session_id, message)
+                reply = self.reply(session_id, message, on_segment=on_segment, cancel=cancel, submitted_at=submitted_at)
                 # 如果有回调函数，调用它
                 if callback:
                     callback(session_id, reply)
@@ -295,11 +883,64 @@ class DeepSeekBot:
                 if callback:
                     callback(session_id, f"处理请求时发生错误: {str(e)}")
                 return None
+            finally:
+                self._release_token(session_id, cancel)
         
-        # 启动异步线程
-        async_run(process_async_reply)
+        # 任务队列已满时直接回复繁忙提示，不再排队等待
+        def reject_async_reply():
+            logger.warning(f"后台任务队列已满或排队消息过多，回复繁忙提示: {session_id}")
+            self._release_token(session_id, cancel)
+            if callback:
+                callback(session_id, self.busy_msg)
         
-        return {
-            "success": True,
-            "message": "正在处理中"
-        }
\ No newline at end of file
+        # 提交到后台任务调度器，同一会话的消息按到达顺序串行处理；
+        # 不同用户之间按消息长度公平轮转，短消息优先
+        user_id = session_id.split(":", 1)[1] if ":" in session_id else session_id
+        async_run(
+            process_async_reply,
+            key=session_id,
+            on_reject=reject_async_reply,
+            user=user_id,
+            cost=len(message),
+            priority=len(message) <= self.short_prompt_chars
+        )
+
+    def _supersede(self, session_id):
+        """
+        为会话的新消息创建取消标记，并取消该会话尚未完成的上一条消息
+        :param session_id: 会话ID
+        :return: 新消息的取消标记
+        """
+        token = CancelToken()
+        with self.supersede_lock:
+            previous = self.reply_tokens.get(session_id)
+            self.reply_tokens[session_id] = token
+        if previous is not None and previous.cancel():
+            self._count_supersede("superseded")
+            logger.info(f"新消息取代了未完成的回复: {session_id}")
+        return token
+
+    def _release_token(self, session_id, token):
+        """消息处理结束，移除仍属于它的取消标记"""
+        if token is None:
+            return
+        with self.supersede_lock:
+            if self.reply_tokens.get(session_id) is token:
+                del self.reply_tokens[session_id]
+
+    def _count_supersede(self, key, amount=1):
+        """累加取代统计"""
+        with self.supersede_lock:
+            self.supersede_stats[key] += amount
+
+    def get_supersede_stats(self):
+        """
+        获取取代统计：superseded为被新消息取代的消息数，calls_avoided为因此省去的API请求数，
+        tokens_avoided为省去请求的估算输入token数，streams_aborted为中途关闭的流式请求数，
+        results_discarded为已发出请求但丢弃结果的消息数
+        :return: 统计字典
+        """
+        with self.supersede_lock:
+            stats = dict(self.supersede_stats)
+            stats["pending"] = len(self.reply_tokens)
+        return stats
\ No newline at end of file
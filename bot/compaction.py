@@ -0,0 +1,135 @@
+import threading
+from common.log import logger
+from common.scheduler import JobScheduler
+
+SUMMARY_PREFIX = "以下是之前对话的摘要：\n"
+
+class SessionCompactor:
+    """
+    对话压缩：会话token数超过高水位时，由后台低优先级任务把最早的几轮对话总结为一条摘要消息
+    - 使用单独的调度器和少量工作线程，不占用生成回复的工作线程
+    - 调用模型总结时不持有会话锁，只在替换消息时短暂加锁，不阻塞正在进行的回复
+    - 替换前确认被总结的消息仍在会话开头，期间被裁剪或修改、或摘要没有更短时放弃本次结果
+    """
+    def __init__(self, summarize, high_water, keep_messages=4, workers=1, queue_size=100, on_compacted=None):
+        """
+        初始化
+        :param summarize: 总结函数，参数为消息列表，返回(成功标志, 摘要或错误信息)
+        :param high_water: 触发压缩的token数
+        :param keep_messages: 保留不总结的最近消息数量
+        :param workers: 压缩任务的工作线程数
+        :param queue_size: 压缩任务的队列容量，已满时跳过本次压缩，由硬性裁剪兜底
+        :param on_compacted: 压缩完成后的回调，参数为会话
+        """
+        self.summarize = summarize
+        self.high_water = high_water
+        self.keep_messages = keep_messages
+        self.on_compacted = on_compacted
+        self.scheduler = JobScheduler(workers=workers, queue_size=queue_size, overflow_policy="reject", name="compaction")
+        self.lock = threading.Lock()
+        self.scheduled = 0
+        self.compacted = 0
+        self.discarded = 0
+        self.failed = 0
+        self.tokens_saved = 0
+
+    def maybe_schedule(self, session):
+        """
+        会话超过高水位时提交压缩任务，调用方需持有会话锁
+        :param session: 会话
+        :return: 是否提交了任务
+        """
+        if session.compacting or session.total_tokens <= self.high_water:
+            return False
+        if session.is_cold or len(session.history) <= self.keep_messages + 1:
+            return False
+        session.compacting = True
+        with self.lock:
+            self.scheduled += 1
+
+        def reject():
+            session.compacting = False
+
+        return self.scheduler.submit(self._compact, session, key=session.session_id, on_reject=reject)
+
+    def _compact(self, session):
+        """后台压缩任务"""
+        try:
+            # 会话锁只在读写历史时短暂持有，复制时加锁不会等待API请求
+            with session.lock:
+                history = session.history
+                if isinstance(history, bytes):
+                    return
+                messages = tuple(history)
+            old_messages = messages[:len(messages) - self.keep_messages]
+            # 从完整的一轮对话处截断，保留的消息以用户消息开头
+            while old_messages and old_messages[-1].role == "user":
+                old_messages = old_messages[:-1]
+            if len(old_messages) < 2:
+                return
+
+            success, summary = self.summarize(old_messages)
+            if not success or not summary:
+                with self.lock:
+                    self.failed += 1
+                logger.warning(f"会话压缩失败: {session.session_id}, {summary}")
+                return
+
+            content = SUMMARY_PREFIX + summary
+            old_tokens = sum(message.tokens for message in old_messages)
+            if session.tokenizer(content) >= old_tokens:
+                with self.lock:
+                    self.discarded += 1
+                logger.debug(f"摘要没有比原消息更短，放弃本次压缩: {session.session_id}")
+                return
+
+            with session.lock:
+                before = session.total_tokens
+                if not session.replace_oldest(old_messages, "system", content):
+                    with self.lock:
+                        self.discarded += 1
+                    logger.debug(f"会话在压缩期间已变化，放弃摘要: {session.session_id}")
+                    return
+                saved = before - session.total_tokens
+                if self.on_compacted:
+                    self.on_compacted(session)
+
+            with self.lock:
+                self.compacted += 1
+                self.tokens_saved += saved
+            logger.info(f"会话已压缩: {session.session_id}，{len(old_messages)}条消息合并为摘要，节省约{saved}个token")
+        finally:
+            session.compacting = False
+
+    def get_stats(self):
+        """
+        获取压缩统计信息
+        :return: 统计字典
+        """
+        queue_stats = self.scheduler.get_stats()
+        with self.lock:
+            return {
+                "high_water": self.high_water,
+                "scheduled": self.scheduled,
+                "compacted": self.compacted,
+                "discarded": self.discarded,
+                "failed": self.failed,
+                "tokens_saved": self.tokens_saved,
+                "queued": queue_stats["queued"],
+                "rejected": queue_stats["rejected"]
+            }
+
+def format_transcript(messages):
+    """
+    把消息转换为供模型总结的对话文本
+    :param messages: 消息列表
+    :return: 文本
+    """
+    names = {"user": "用户", "assistant": "助手", "system": "摘要"}
+    lines = []
+    for message in messages:
+        content = message.content
+        if message.role == "system" and content.startswith(SUMMARY_PREFIX):
+            content = content[len(SUMMARY_PREFIX):]
+        lines.append(f"{names.get(message.role, message.role)}: {content}")
+    return "\n".join(lines)
@@ -0,0 +1,231 @@
+import time
+import threading
+from collections import deque
+from common.log import logger
+from common.circuit_breaker import CircuitBreaker
+
+class ModelEndpoint:
+    """
+    一个可用的模型接口：模型名、接口地址、密钥，以及该接口的熔断器和最近请求结果
+    """
+    def __init__(self, name, model, api_base, api_key, priority=0, latency_budget=0,
+                 min_prompt_chars=0, max_prompt_chars=0, breaker=None, error_window=50, error_ttl=60):
+        """
+        初始化
+        :param name: 名称，用于日志和统计，同时作为耗时统计键
+        :param model: 请求中的模型名
+        :param api_base: 接口地址
+        :param api_key: 接口密钥
+        :param priority: 优先级，数值越小越优先，相同优先级按最近耗时排序
+        :param latency_budget: 耗时预算(秒)，有备选接口时单次请求超过预算即视为失败并改用备选接口，0表示不限制
+        :param min_prompt_chars: 只处理不少于该长度的用户消息，0表示不限制
+        :param max_prompt_chars: 只处理不超过该长度的用户消息，0表示不限制
+        :param breaker: 熔断器
+        :param error_window: 计算错误率的最近请求数量
+        :param error_ttl: 请求结果参与计算错误率的时长(秒)，过期后不健康的接口会重新获得请求
+        """
+        self.name = name
+        self.model = model
+        self.api_base = api_base
+        self.api_key = api_key
+        self.priority = priority
+        self.latency_budget = latency_budget
+        self.min_prompt_chars = min_prompt_chars
+        self.max_prompt_chars = max_prompt_chars
+        self.breaker = breaker or CircuitBreaker(name)
+        self.error_ttl = error_ttl
+        # 最近请求的(时间, 是否成功)
+        self.outcomes = deque(maxlen=error_window)
+        self.lock = threading.Lock()
+        self.selected = 0
+        self.fallbacks = 0
+        self.successes = 0
+        self.failures = 0
+
+    @property
+    def url(self):
+        """对话补全接口地址"""
+        return f"{self.api_base}/chat/completions"
+
+    def accepts(self, prompt_chars):
+        """用户消息长度是否符合该接口的长度规则"""
+        if self.min_prompt_chars and prompt_chars < self.min_prompt_chars:
+            return False
+        if self.max_prompt_chars and prompt_chars > self.max_prompt_chars:
+            return False
+        return True
+
+    def error_rate(self):
+        """最近error_ttl秒内请求的失败比例"""
+        deadline = time.time() - self.error_ttl
+        with self.lock:
+            while self.outcomes and self.outcomes[0][0] < deadline:
+                self.outcomes.popleft()
+            if not self.outcomes:
+                return 0.0
+            return sum(1 for _, ok in self.outcomes if not ok) / len(self.outcomes)
+
+    def record_success(self):
+        """记录一次成功"""
+        self.breaker.record_success()
+        with self.lock:
+            self.successes += 1
+            self.outcomes.append((time.time(), True))
+
+    def record_failure(self):
+        """记录一次失败"""
+        self.breaker.record_failure()
+        with self.lock:
+            self.failures += 1
+            self.outcomes.append((time.time(), False))
+
+    def record_status(self, status_code):
+        """
+        按HTTP状态码记录结果：5xx和429说明接口不可用，其他状态码说明接口正常响应了请求
+        :param status_code: HTTP状态码
+        """
+        if status_code >= 500 or status_code == 429:
+            self.record_failure()
+        else:
+            self.record_success()
+
+class ModelRouter:
+    """
+    多模型路由
+    每个请求按以下规则排出候选接口顺序，第一个为首选，其余依次作为失败或超出耗时预算时的备选：
+    - 不符合长度规则的接口不参与（全部不符合时忽略长度规则），熔断中的接口不参与
+    - 健康的接口在前：最近错误率（包括超出耗时预算的请求）不超过max_error_rate
+    - 同组内按优先级排序，优先级相同时最近耗时p50较低的在前
+    """
+    def __init__(self, endpoints, latency, max_error_rate=0.5):
+        """
+        初始化
+        :param endpoints: 接口列表(ModelEndpoint)，顺序即默认优先级
+        :param latency: 耗时统计(LatencyTracker)，以接口名称为键
+        :param max_error_rate: 错误率超过该值的接口视为不健康
+        """
+        self.endpoints = endpoints
+        self.primary = endpoints[0]
+        self.latency = latency
+        self.max_error_rate = max_error_rate
+
+    def _is_healthy(self, endpoint):
+        """接口最近的错误率是否在允许范围内"""
+        return endpoint.error_rate() <= self.max_error_rate
+
+    def route(self, prompt_chars, stream=False):
+        """
+        为一次请求排出候选接口
+        :param prompt_chars: 用户消息长度
+        :param stream: 是否为流式请求，百炼应用接口不支持流式
+        :return: 候选接口列表，全部熔断时为空列表
+        """
+        candidates = self._candidates(prompt_chars, stream)
+        if candidates:
+            with candidates[0].lock:
+                candidates[0].selected += 1
+        return candidates
+
+    def preferred(self, prompt_chars, stream=False):
+        """
+        当前会被选为首选的接口，不计入选择次数，用于按实际模型区分回复缓存
+        :param prompt_chars: 用户消息长度
+        :param stream: 是否为流式请求
+        :return: 接口，全部熔断时返回None
+        """
+        candidates = self._candidates(prompt_chars, stream)
+        return candidates[0] if candidates else None
+
+    def _candidates(self, prompt_chars, stream):
+        """按路由规则过滤并排序候选接口"""
+        candidates = [e for e in self.endpoints if not (stream and e.model == "bailian-app")]
+        matched = [e for e in candidates if e.accepts(prompt_chars)]
+        if matched:
+            candidates = matched
+        candidates = [e for e in candidates if not e.breaker.is_open()]
+
+        def sort_key(endpoint):
+            p50 = self.latency.percentile(endpoint.name, 0.5)
+            return (not self._is_healthy(endpoint), endpoint.priority, p50 if p50 is not None else 0.0)
+
+        candidates.sort(key=sort_key)
+        return candidates
+
+    def mark_fallback(self, endpoint):
+        """记录一次改用备选接口"""
+        with endpoint.lock:
+            endpoint.fallbacks += 1
+        logger.info(f"改用备选模型接口: {endpoint.name}")
+
+    def is_open(self):
+        """所有接口都在熔断中"""
+        return all(endpoint.breaker.is_open() for endpoint in self.endpoints)
+
+    def get_breaker_stats(self):
+        """
+        获取各接口的熔断器状态
+        :return: 统计字典，键为接口名称
+        """
+        return {endpoint.name: endpoint.breaker.get_stats() for endpoint in self.endpoints}
+
+    def get_stats(self):
+        """
+        获取各接口的选择次数、结果和最近耗时
+        :return: 统计字典，键为接口名称
+        """
+        stats = {}
+        for endpoint in self.endpoints:
+            p50 = self.latency.percentile(endpoint.name, 0.5)
+            p95 = self.latency.percentile(endpoint.name, 0.95)
+            error_rate = endpoint.error_rate()
+            with endpoint.lock:
+                stats[endpoint.name] = {
+                    "model": endpoint.model,
+                    "selected": endpoint.selected,
+                    "fallbacks": endpoint.fallbacks,
+                    "successes": endpoint.successes,
+                    "failures": endpoint.failures,
+                    "error_rate": round(error_rate, 3),
+                    "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+                    "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                    "healthy": error_rate <= self.max_error_rate,
+                    "breaker": endpoint.breaker.state
+                }
+        return stats
+
+def create_model_router(entries, defaults, latency, breaker_options=None, error_window=50, error_ttl=60, max_error_rate=0.5):
+    """
+    根据配置创建多模型路由
+    :param entries: 接口配置列表，每项可包含name、model、api_base、api_key、priority、
+                    latency_budget、min_prompt_chars、max_prompt_chars，未配置的api_base、api_key使用默认值
+    :param defaults: 默认接口配置，包含model、api_base、api_key，entries为空时作为唯一接口
+    :param latency: 耗时统计(LatencyTracker)
+    :param breaker_options: 熔断器参数，传给CircuitBreaker
+    :param error_window: 计算错误率的最近请求数量
+    :param error_ttl: 请求结果参与计算错误率的时长(秒)
+    :param max_error_rate: 错误率超过该值的接口视为不健康
+    :return: ModelRouter
+    """
+    breaker_options = breaker_options or {}
+    endpoints = []
+    for index, entry in enumerate(entries or [defaults]):
+        model = entry.get("model") or defaults["model"]
+        name = entry.get("name") or model
+        if any(endpoint.name == name for endpoint in endpoints):
+            name = f"{name}#{index}"
+        endpoints.append(ModelEndpoint(
+            name,
+            model,
+            entry.get("api_base") or defaults["api_base"],
+            entry.get("api_key") or defaults["api_key"],
+            priority=entry.get("priority", index),
+            latency_budget=entry.get("latency_budget", 0),
+            min_prompt_chars=entry.get("min_prompt_chars", 0),
+            max_prompt_chars=entry.get("max_prompt_chars", 0),
+            breaker=CircuitBreaker(name, **breaker_options),
+            error_window=error_window,
+            error_ttl=error_ttl
+        ))
+    if len(endpoints) > 1:
+        logger.info(f"已配置多模型路由: {', '.join(endpoint.name for endpoint in endpoints)}")
+    return ModelRouter(endpoints, latency, max_error_rate=max_error_rate)
@@ -0,0 +1,205 @@
+import sys
+import json
+import time
+import zlib
+import threading
+from collections import deque
+
+class Message:
+    """
+    会话中的一条消息
+    使用__slots__保存，比字典节省内存；只在发送给API时转换为字典
+    """
+    __slots__ = ("role", "content", "tokens")
+
+    def __init__(self, role, content, tokens=0):
+        """
+        :param role: 角色，system、user或assistant
+        :param content: 消息内容
+        :param tokens: 估算的token数量
+        """
+        self.role = sys.intern(role)
+        self.content = content
+        self.tokens = tokens
+
+    def to_dict(self):
+        """转换为API需要的消息格式"""
+        return {"role": self.role, "content": self.content}
+
+# 热数据中每条消息除正文外的内存开销
+MESSAGE_OVERHEAD = sys.getsizeof(Message("user", ""))
+
+def message_size(message):
+    """估算一条热数据消息占用的内存字节数"""
+    return MESSAGE_OVERHEAD + sys.getsizeof(message.content)
+
+class Session:
+    """
+    对话会话
+    系统消息(人设)单独保存，所有会话引用同一个对象，其余消息按顺序保存在双端队列中，
+    每条消息的token数在写入时计算一次，会话维护累计token数，裁剪时从队首弹出
+    长时间空闲的会话可以压缩为冷数据：history替换为zlib压缩的数据块，下次访问时自动解压
+    """
+    def __init__(self, session_id, tokenizer, system_message=None):
+        """
+        初始化会话
+        :param session_id: 会话ID
+        :param tokenizer: 分词函数，接收文本返回token数量
+        :param system_message: 系统消息(Message)，None表示没有人设
+        """
+        self.session_id = session_id
+        self.tokenizer = tokenizer
+        self.system_message = system_message
+        self.system_tokens = system_message.tokens if system_message else 0
+        # 热数据为Message的双端队列，冷数据为压缩后的bytes
+        # 冷热切换只替换这一个属性，不持有锁的读取方也不会读到中间状态
+        self.history = deque()
+        self.history_tokens = 0
+        self.history_bytes = 0
+        self.lock = threading.RLock()
+        # 最近一次访问时间，由会话存储更新
+        self.last_active = time.time()
+        # 是否已从持久化后端加载历史
+        self.loaded = True
+        # 是否有正在进行的压缩任务
+        self.compacting = False
+        # 是否已被清除（重置对话），清除后进行中的回复不再写入
+        self.cleared = False
+
+    @property
+    def is_cold(self):
+        """历史是否处于压缩状态"""
+        return isinstance(self.history, bytes)
+
+    @property
+    def messages(self):
+        """
+        完整消息列表，包括系统消息（新列表，修改不影响会话）
+        """
+        self.inflate()
+        messages = list(self.history)
+        if self.system_message:
+            messages.insert(0, self.system_message)
+        return messages
+
+    @property
+    def total_tokens(self):
+        """会话当前的估算token总数，包括系统消息"""
+        return self.system_tokens + self.history_tokens
+
+    def is_first_turn(self):
+        """历史中是否只有系统消息"""
+        return not self.history
+
+    def append(self, role, content):
+        """
+        追加一条消息
+        :param role: 角色
+        :param content: 消息内容
+        :return: 消息对象
+        """
+        self.inflate()
+        message = Message(role, content, self.tokenizer(content))
+        self.history.append(message)
+        self.history_tokens += message.tokens
+        self.history_bytes += message_size(message)
+        return message
+
+    def popleft(self):
+        """
+        弹出最早的一条消息
+        :return: 消息对象
+        """
+        self.inflate()
+        message = self.history.popleft()
+        self.history_tokens -= message.tokens
+        self.history_bytes -= message_size(message)
+        return message
+
+    def trim(self, max_tokens, min_messages=4):
+        """
+        裁剪历史，使token总数不超过上限
+        每次删除最早的一轮对话（用户消息和紧随其后的助手回复），至少保留min_messages条消息
+        :param max_tokens: token上限
+        :param min_messages: 至少保留的非系统消息数量
+        :return: 删除的消息数量
+        """
+        self.inflate()
+        removed = 0
+        while self.total_tokens > max_tokens and len(self.history) > min_messages:
+            self.popleft()
+            removed += 1
+            if self.history and self.history[0].role == "assistant":
+                self.popleft()
+                removed += 1
+        return removed
+
+    def replace_oldest(self, old_messages, role, content):
+        """
+        用一条消息替换会话开头的若干条消息，调用方需持有会话锁
+        :param old_messages: 要替换的消息，必须仍是会话开头的同一批消息对象
+        :param role: 新消息的角色
+        :param content: 新消息的内容
+        :return: 是否替换成功，会话开头已变化时返回False
+        """
+        history = self.history
+        if isinstance(history, bytes) or len(history) < len(old_messages):
+            return False
+        for current, old in zip(history, old_messages):
+            if current is not old:
+                return False
+        for _ in old_messages:
+            self.popleft()
+        message = Message(role, content, self.tokenizer(content))
+        self.history.appendleft(message)
+        self.history_tokens += message.tokens
+        self.history_bytes += message_size(message)
+        return True
+
+    def snapshot(self):
+        """
+        复制历史消息（不含系统消息），冷数据不会被解压到会话中
+        会话锁只在读写历史时短暂持有，这里加锁等待不会被API请求阻塞
+        :return: 消息字典列表
+        """
+        with self.lock:
+            history = self.history
+            if isinstance(history, bytes):
+                return [{"role": role, "content": content} for role, content, _ in _unpack(history)]
+            return [message.to_dict() for message in history]
+
+    def compress(self):
+        """
+        把历史压缩为冷数据，系统消息是共享引用，不写入数据块，调用方需持有会话锁
+        :return: 压缩后的字节数，没有历史或已压缩时返回0
+        """
+        if self.is_cold or not self.history:
+            return 0
+        data = [[message.role, message.content, message.tokens] for message in self.history]
+        self.history = zlib.compress(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        return len(self.history)
+
+    def inflate(self):
+        """
+        解压冷数据，恢复为热数据，调用方需持有会话锁
+        :return: 是否执行了解压
+        """
+        history = self.history
+        if not isinstance(history, bytes):
+            return False
+        self.history = deque(Message(role, content, tokens) for role, content, tokens in _unpack(history))
+        return True
+
+    def memory_usage(self):
+        """
+        估算历史占用的内存
+        :return: (是否为冷数据, 字节数)
+        """
+        history = self.history
+        if isinstance(history, bytes):
+            return True, len(history)
+        return False, self.history_bytes
+
+def _unpack(blob):
+    """解压冷数据块，返回[role, content, tokens]列表"""
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import atexit
+import sqlite3
+import threading
+from common.log import logger
+
+class SqliteSessionBackend:
+    """
+    基于SQLite(WAL模式)的会话持久化后端
+    每个会话一行，保存除人设外的对话历史(JSON)：
+    - 写入采用write-behind：写消息时只把会话标记为待写入，由后台线程定期批量写入一个事务，
+      回复流程不会等待磁盘
+    - 读取使用每个线程独立的只读连接，WAL模式下读写互不阻塞
+    - 待写入或正在写入的会话被重新加载时，直接使用内存中的数据
+    - 删除会话同样只在待写入集合中记录删除标记，由后台线程在同一批事务中执行
+    - 多进程模式下各工作进程共用同一个数据库文件：每个会话只由一个进程写入，
+      写事务之间由SQLite的文件锁串行化，等待锁超时的批次会放回待写入集合重试
+    """
+    # 等待其他进程释放写锁的最长时间(秒)
+    BUSY_TIMEOUT = 30
+
+    def __init__(self, path, flush_interval=1.0, batch_size=500, retention=0):
+        """
+        初始化后端
+        :param path: 数据库文件路径
+        :param flush_interval: 批量写入间隔(秒)
+        :param batch_size: 待写入会话达到该数量时立即写入
+        :param retention: 会话超过多少秒未更新后从数据库删除，0表示永久保存
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.retention = retention
+        # 待写入的会话，以及正在写入的一批会话；值为None表示该会话待删除
+        self.dirty = {}
+        self.flushing = {}
+        self.condition = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.local = threading.local()
+        self.closed = False
+        self.loads = 0
+        self.load_hits = 0
+        self.written = 0
+        self.deleted = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_flush_ms = 0.0
+        self.last_cleanup = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.writer = self._connect()
+        self.writer.execute("PRAGMA journal_mode=WAL")
+        self.writer.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, history TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.writer.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions(updated_at)")
+        self.writer.commit()
+
+        self.writer_thread = threading.Thread(target=self._write_loop, name="session-writer")
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
+        atexit.register(self.close)
+
+    def _connect(self):
+        """创建数据库连接，WAL模式下NORMAL同步级别只在检查点时落盘"""
+        connection = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT, check_same_thread=False)
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _reader(self):
+        """获取当前线程的只读连接"""
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self._connect()
+            self.local.connection = connection
+        return connection
+
+    def load(self, session_id):
+        """
+        加载会话历史
+        :param session_id: 会话ID
+        :return: 消息列表，数据库中没有时返回None
+        """
+        with self.condition:
+            self.loads += 1
+            if session_id in self.dirty:
+                session = self.dirty[session_id]
+            elif session_id in self.flushing:
+                session = self.flushing[session_id]
+            else:
+                session = False
+            if session is None:
+                # 已删除，数据库中的旧数据尚未删除
+                return None
+        if session:
+            with self.condition:
+                self.load_hits += 1
+            return session.snapshot()
+
+        row = self._reader().execute(
+            "SELECT history FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        with self.condition:
+            self.load_hits += 1
+        return json.loads(row[0])
+
+    def mark_dirty(self, session):
+        """
+        标记会话需要写入，只在内存中记录，不访问磁盘
+        :param session: 会话对象
+        """
+        with self.condition:
+            self.dirty[session.session_id] = session
+            if len(self.dirty) >= self.batch_size:
+                self.condition.notify()
+
+    def delete(self, session_id):
+        """
+        删除会话，只在内存中记录删除标记，不访问磁盘；之后重新写入的会话会覆盖删除标记
+        :param session_id: 会话ID
+        """
+        with self.condition:
+            self.dirty[session_id] = None
+            if len(self.dirty) >= self.batch_size:
+                self.condition.notify()
+
+    def _write_loop(self):
+        """后台写入线程"""
+        while True:
+            with self.condition:
+                if self.closed:
+                    return
+                if len(self.dirty) < self.batch_size:
+                    self.condition.wait(self.flush_interval)
+            try:
+                self.flush()
+                self._cleanup()
+            except Exception as e:
+                with self.condition:
+                    self.errors += 1
+                logger.error(f"会话写入数据库失败: {str(e)}")
+
+    def flush(self):
+        """
+        把所有待写入的会话写入数据库并执行待删除的会话，磁盘操作期间不持有待写入集合的锁
+        :return: 写入和删除的会话数量
+        """
+        with self.write_lock:
+            with self.condition:
+                if not self.dirty:
+                    return 0
+                batch = self.dirty
+                self.dirty = {}
+                self.flushing = batch
+
+            start_time = time.time()
+            try:
+                deletes = [(session_id,) for session_id, session in batch.items() if session is None]
+                rows = [
+                    (session_id, json.dumps(session.snapshot(), ensure_ascii=False), start_time)
+                    for session_id, session in batch.items() if session is not None
+                ]
+                if deletes:
+                    self.writer.executemany("DELETE FROM sessions WHERE session_id = ?", deletes)
+                self.writer.executemany(
+                    "INSERT OR REPLACE INTO sessions (session_id, history, updated_at) VALUES (?, ?, ?)",
+                    rows
+                )
+                self.writer.commit()
+            except Exception:
+                # 写入失败时回滚并放回待写入集合，下次重试
+                self.writer.rollback()
+                with self.condition:
+                    for session_id, session in batch.items():
+                        self.dirty.setdefault(session_id, session)
+                raise
+            finally:
+                with self.condition:
+                    self.flushing = {}
+
+            with self.condition:
+                self.written += len(rows)
+                self.deleted += len(deletes)
+                self.batches += 1
+                self.last_flush_ms = round((time.time() - start_time) * 1000, 2)
+            return len(rows) + len(deletes)
+
+    def _cleanup(self):
+        """删除超过保留期的会话，每小时最多执行一次"""
+        if not self.retention or time.time() - self.last_cleanup < 3600:
+            return
+        self.last_cleanup = time.time()
+        with self.write_lock:
+            cursor = self.writer.execute(
+                "DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.retention,)
+            )
+            self.writer.commit()
+        if cursor.rowcount:
+            logger.info(f"从数据库删除过期会话: {cursor.rowcount}")
+
+    def close(self):
+        """写入剩余的会话并关闭后台线程"""
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify()
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"关闭时写入会话失败: {str(e)}")
+
+    def get_stats(self):
+        """
+        获取持久化统计信息
+        :return: 统计字典
+        """
+        with self.condition:
+            return {
+                "path": self.path,
+                "pending": len(self.dirty),
+                "written": self.written,
+                "deleted": self.deleted,
+                "batches": self.batches,
+                "avg_batch": round(self.written / self.batches, 2) if self.batches else 0.0,
+                "last_flush_ms": self.last_flush_ms,
+                "loads": self.loads,
+                "load_hits": self.load_hits,
+                "errors": self.errors
+            }
+
+def create_session_backend(name, path, **kwargs):
+    """
+    根据配置创建会话持久化后端
+    :param name: 后端名称，空字符串表示不持久化
+    :param path: 数据文件路径
+    :return: 后端对象或None
+    """
+    if not name:
+        return None
+    if name == "sqlite":
+        return SqliteSessionBackend(path, **kwargs)
+    logger.error(f"未知的会话持久化后端: {name}，会话将只保存在内存中")
+    return None
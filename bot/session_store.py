@@ -0,0 +1,227 @@
+import time
+import threading
+from collections import OrderedDict
+from common.log import logger
+
+class SessionStore:
+    """
+    有界会话存储
+    会话按最近访问时间排序（OrderedDict，访问时移到末尾）：
+    - 会话数超过上限时淘汰最久未访问的会话
+    - 空闲超过idle_ttl秒的会话由后台线程定期清理，从头部开始扫描，遇到未过期的会话即停止
+    - 空闲超过cold_after秒的会话压缩为冷数据，下次访问时自动解压
+    正在读写历史（会话锁被持有）的会话不会被淘汰或压缩；请求API期间被淘汰的会话由reattach放回
+    """
+    def __init__(self, factory, max_sessions=100000, idle_ttl=86400, cold_after=0):
+        """
+        初始化会话存储
+        :param factory: 创建会话的函数，参数为会话ID
+        :param max_sessions: 最多保存的会话数量，0表示不限制
+        :param idle_ttl: 会话空闲多少秒后清理，0表示不清理
+        :param cold_after: 会话空闲多少秒后压缩，0表示不压缩
+        """
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.cold_after = cold_after
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.sweeper_thread = None
+        self.hits = 0
+        self.created = 0
+        self.evicted = 0
+        self.expired = 0
+        self.compressed = 0
+        self.reactivated = 0
+
+    def get_or_create(self, session_id):
+        """
+        获取会话，不存在时创建
+        :param session_id: 会话ID
+        :return: 会话对象
+        """
+        now = time.time()
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is not None:
+                self.sessions.move_to_end(session_id)
+                self.hits += 1
+                if session.is_cold:
+                    self.reactivated += 1
+            else:
+                session = self.factory(session_id)
+                self.sessions[session_id] = session
+                self.created += 1
+                self._evict_overflow()
+            session.last_active = now
+            return session
+
+    def get(self, session_id):
+        """
+        获取已存在的会话，不更新访问时间
+        :param session_id: 会话ID
+        :return: 会话对象，不存在时返回None
+        """
+        with self.lock:
+            return self.sessions.get(session_id)
+
+    def pop(self, session_id):
+        """
+        删除会话
+        :param session_id: 会话ID
+        :return: 被删除的会话，不存在时返回None
+        """
+        with self.lock:
+            return self.sessions.pop(session_id, None)
+
+    def reattach(self, session):
+        """
+        把会话放回存储：会话仍在存储中或已被淘汰时放回并更新访问时间，已有同ID的其他会话时不替换
+        :param session: 会话对象
+        :return: 存储中该ID对应的会话
+        """
+        with self.lock:
+            current = self.sessions.get(session.session_id)
+            if current is None:
+                current = self.sessions[session.session_id] = session
+                self._evict_overflow()
+            else:
+                self.sessions.move_to_end(session.session_id)
+            current.last_active = time.time()
+            return current
+
+    def __contains__(self, session_id):
+        with self.lock:
+            return session_id in self.sessions
+
+    def __len__(self):
+        with self.lock:
+            return len(self.sessions)
+
+    def _is_busy(self, session):
+        """会话锁被其他线程持有，说明正在读写历史"""
+        if session.lock.acquire(blocking=False):
+            session.lock.release()
+            return False
+        return True
+
+    def _evict_overflow(self):
+        """淘汰超出容量的会话，调用方需持有锁"""
+        if not self.max_sessions:
+            return
+        # 最多检查一遍，全部繁忙时暂时超出容量
+        attempts = len(self.sessions)
+        while len(self.sessions) > self.max_sessions and attempts > 0:
+            attempts -= 1
+            session_id, session = next(iter(self.sessions.items()))
+            if self._is_busy(session):
+                self.sessions.move_to_end(session_id)
+                continue
+            del self.sessions[session_id]
+            self.evicted += 1
+
+    def sweep(self):
+        """
+        清理空闲超时的会话，并把空闲超过cold_after秒的会话压缩为冷数据
+        压缩在释放存储锁之后进行，不阻塞其他会话的查找
+        :return: (清理的会话数量, 压缩的会话数量)
+        """
+        now = time.time()
+        removed = 0
+        candidates = []
+        cold_deadline = now - self.cold_after
+        with self.lock:
+            if self.idle_ttl:
+                deadline = now - self.idle_ttl
+                while self.sessions:
+                    session_id, session = next(iter(self.sessions.items()))
+                    if session.last_active > deadline:
+                        break
+                    if self._is_busy(session):
+                        session.last_active = now
+                        self.sessions.move_to_end(session_id)
+                        continue
+                    del self.sessions[session_id]
+                    removed += 1
+                self.expired += removed
+
+            if self.cold_after:
+                for session in self.sessions.values():
+                    if session.last_active > cold_deadline:
+                        break
+                    if not session.is_cold:
+                        candidates.append(session)
+
+        compressed = 0
+        for session in candidates:
+            if not session.lock.acquire(blocking=False):
+                continue
+            try:
+                # 收集候选后会话可能又被访问过
+                if session.last_active <= cold_deadline and session.compress():
+                    compressed += 1
+            finally:
+                session.lock.release()
+
+        if compressed:
+            with self.lock:
+                self.compressed += compressed
+        return removed, compressed
+
+    def start_sweeper(self, interval=60):
+        """
+        启动后台清理线程
+        :param interval: 清理间隔(秒)
+        """
+        if self.sweeper_thread is not None or not (self.idle_ttl or self.cold_after) or interval <= 0:
+            return
+
+        def sweep_loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    removed, compressed = self.sweep()
+                    if removed or compressed:
+                        logger.debug(f"清理空闲会话: {removed}，压缩冷会话: {compressed}")
+                except Exception as e:
+                    logger.error(f"清理空闲会话失败: {str(e)}")
+
+        self.sweeper_thread = threading.Thread(target=sweep_loop, name="session-sweeper")
+        self.sweeper_thread.daemon = True
+        self.sweeper_thread.start()
+
+    def get_stats(self):
+        """
+        获取会话存储统计信息，包括冷热会话的数量和历史占用的字节数
+        :return: 统计字典
+        """
+        with self.lock:
+            sessions = list(self.sessions.values())
+            stats = {
+                "size": len(sessions),
+                "max_sessions": self.max_sessions,
+                "idle_ttl": self.idle_ttl,
+                "hits": self.hits,
+                "created": self.created,
+                "evicted": self.evicted,
+                "expired": self.expired,
+                "compressed": self.compressed,
+                "reactivated": self.reactivated
+            }
+
+        hot = cold = hot_bytes = cold_bytes = 0
+        for session in sessions:
+            is_cold, size = session.memory_usage()
+            if is_cold:
+                cold += 1
+                cold_bytes += size
+            else:
+                hot += 1
+                hot_bytes += size
+        stats.update({
+            "hot": hot,
+            "cold": cold,
+            "hot_bytes": hot_bytes,
+            "cold_bytes": cold_bytes
+        })
+        return stats
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import socket
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from common.log import logger
+
+# 请求头最大长度
+MAX_HEADER_SIZE = 64 * 1024
+# 请求体最大长度，微信推送的XML通常只有几KB
+MAX_BODY_SIZE = 1024 * 1024
+
+HTTP_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    500: "Internal Server Error"
+}
+
+class WechatMpAsyncServer:
+    """
+    基于asyncio事件循环的微信公众号HTTP服务器
+    连接的读写由事件循环处理，空闲的长连接只占用一个协程；
+    消息处理仍然调用WechatMpChannel中的同步方法，在有界线程池中执行
+    接口与WechatMpServer保持一致：serve_forever / shutdown / server_close / get_stats
+    """
+    def __init__(self, server_address, channel, max_workers=16, backlog=100, client_timeout=10, keep_alive_timeout=75):
+        """
+        初始化服务器并绑定监听端口
+        :param server_address: 监听地址
+        :param channel: 通道实例
+        :param max_workers: 执行消息处理的线程数量
+        :param backlog: 监听队列长度
+        :param client_timeout: 读取单个请求的超时时间(秒)
+        :param keep_alive_timeout: 长连接空闲超时时间(秒)
+        """
+        self.channel = channel
+        self.max_workers = max_workers
+        self.backlog = backlog
+        self.client_timeout = client_timeout
+        self.keep_alive_timeout = keep_alive_timeout
+
+        # 在构造时绑定端口，端口被占用时与WechatMpServer一样抛出socket.error
+        self.socket = socket.create_server(server_address, backlog=backlog)
+        self.server_address = self.socket.getsockname()[:2]
+
+        self.loop = None
+        self.executor = None
+        self.tasks = set()
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.peak_connections = 0
+        self.requests = 0
+        self.busy = 0
+        self.errors = 0
+
+    def serve_forever(self):
+        """
+        在当前线程运行事件循环，直到调用shutdown
+        """
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="wechat-mp-async")
+        try:
+            server = self.loop.run_until_complete(
+                asyncio.start_server(self._handle_connection, sock=self.socket, limit=MAX_HEADER_SIZE)
+            )
+            self.loop.run_forever()
+            server.close()
+            # 关闭仍在等待中的长连接
+            for task in list(self.tasks):
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*self.tasks, return_exceptions=True))
+            self.loop.run_until_complete(server.wait_closed())
+        finally:
+            self.executor.shutdown(wait=False)
+            self.loop.close()
+            self.stopped.set()
+
+    def shutdown(self):
+        """
+        停止事件循环，等待serve_forever退出
+        """
+        if self.loop is None or self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.stopped.wait()
+
+    def server_close(self):
+        """关闭监听端口"""
+        try:
+            self.socket.close()
+        except OSError:
+            pass
+
+    def get_stats(self):
+        """
+        获取服务器统计信息
+        :return: 统计字典
+        """
+        with self.lock:
+            return {
+                "mode": "asyncio",
+                "workers": self.max_workers,
+                "busy": self.busy,
+                "connections": self.connections,
+                "peak_connections": self.peak_connections,
+                "requests": self.requests,
+                "errors": self.errors,
+                "backlog": self.backlog
+            }
+
+    async def _handle_connection(self, reader, writer):
+        """
+        处理单个TCP连接，支持HTTP/1.1长连接
+        """
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        with self.lock:
+            self.connections += 1
+            self.peak_connections = max(self.peak_connections, self.connections)
+
+        try:
+            first_request = True
+            while True:
+                # 首个请求按读超时等待，之后按长连接空闲超时等待
+                idle_timeout = self.client_timeout if first_request else self.keep_alive_timeout
+                first_request = False
+
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), idle_timeout)
+                except asyncio.IncompleteReadError:
+                    # 客户端关闭了连接
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._write_response(writer, 400, b"", keep_alive=False)
+                    break
+
+                request = self._parse_head(head)
+                if request is None:
+                    await self._write_response(writer, 400, b"", keep_alive=False)
+                    break
+
+                method, target, version, headers = request
+                keep_alive = self._want_keep_alive(version, headers)
+
+                body = b""
+                if "transfer-encoding" in headers:
+                    # 微信推送不会使用分块传输，这里不做支持
+                    await self._write_response(writer, 411, b"", keep_alive=False)
+                    break
+                content_length = headers.get("content-length")
+                if content_length:
+                    try:
+                        length = int(content_length)
+                    except ValueError:
+                        await self._write_response(writer, 400, b"", keep_alive=False)
+                        break
+                    if length > MAX_BODY_SIZE:
+                        await self._write_response(writer, 413, b"", keep_alive=False)
+                        break
+                    body = await asyncio.wait_for(reader.readexactly(length), self.client_timeout)
+
+                status, content_type, payload = await self._dispatch(method, target, body)
+                await self._write_response(writer, status, payload, content_type, keep_alive)
+
+                if not keep_alive:
+                    break
+
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            # 超时或客户端断开，静默处理
+            pass
+        except Exception as e:
+            logger.error(f"处理HTTP连接时发生异常: {str(e)}")
+        finally:
+            self.tasks.discard(task)
+            with self.lock:
+                self.connections -= 1
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+    def _parse_head(self, head):
+        """
+        解析请求行和请求头
+        :param head: 原始请求头字节串
+        :return: (method, target, version, headers)，格式错误返回None
+        """
+        try:
+            lines = head.decode("latin-1").split("\r\n")
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            return None
+
+        headers = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, sep, value = line.partition(":")
+            if not sep:
+                return None
+            headers[name.strip().lower()] = value.strip()
+        return method.upper(), target, version.strip().upper(), headers
+
+    def _want_keep_alive(self, version, headers):
+        """
+        根据协议版本和Connection头判断是否保持连接
+        """
+        connection = headers.get("connection", "").lower()
+        if version == "HTTP/1.1":
+            return connection != "close"
+        return connection == "keep-alive"
+
+    async def _dispatch(self, method, target, body):
+        """
+        将请求交给通道处理
+        :return: (状态码, Content-Type, 响应体)
+        """
+        if method == "GET":
+            query = urlsplit(target).query
+            return await self._run_in_executor(self._handle_get, query)
+        if method == "POST":
+            return await self._run_in_executor(self._handle_post, body)
+        return 405, "text/plain", b""
+
+    async def _run_in_executor(self, func, arg):
+        """在线程池中执行同步处理函数"""
+        with self.lock:
+            self.requests += 1
+            self.busy += 1
+        try:
+            return await self.loop.run_in_executor(self.executor, func, arg)
+        finally:
+            with self.lock:
+                self.busy -= 1
+
+    def _handle_get(self, query):
+        """处理GET请求（公众号验证）"""
+        try:
+            echostr = self.channel.handle_verify(query)
+            return 200, "text/plain", echostr.encode("utf-8")
+        except Exception as e:
+            logger.error(f"处理微信验证请求异常: {str(e)}")
+            with self.lock:
+                self.errors += 1
+            return 500, "text/plain", b""
+
+    def _handle_post(self, body):
+        """处理POST请求（接收微信消息）"""
+        try:
+            response = self.channel.handle_post(body.decode("utf-8"))
+            if response is None:
+                return 400, "text/plain", b""
+            return 200, "application/xml", response.encode("utf-8")
+        except Exception as e:
+            logger.error(f"处理POST请求异常: {str(e)}", exc_info=True)
+            with self.lock:
+                self.errors += 1
+            return 500, "text/plain", b""
+
+    async def _write_response(self, writer, status, payload, content_type="text/plain", keep_alive=True):
+        """
+        写入HTTP响应
+        """
+        reason = HTTP_REASONS.get(status, "")
+        head = (
+            f"HTTP/1.1 {status} {reason}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            "\r\n"
+        )
+        writer.write(head.encode("latin-1") + payload)
+        await writer.drain()
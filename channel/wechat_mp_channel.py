@@ -3,20 +3,28 @@
 
 import socket
 import time
+import queue
 import threading
-import re
 import sys
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from urllib.parse import parse_qs, urlparse
 
+from channel.wechat_mp_message import parse_message
 from common.log import logger
-from common.utils import generate_request_id, async_run
+from common.utils import generate_request_id, async_run, message_id_manager
+from common.stats import stats_registry
+from common.keyword_matcher import KeywordRules
 from config import get_value
 
 class WechatMpRequestHandler(BaseHTTPRequestHandler):
     """
     微信公众号请求处理器
     """
+    def setup(self):
+        """设置连接读写超时，避免慢客户端长期占用工作线程"""
+        self.timeout = self.server.client_timeout
+        super().setup()
+
     def log_message(self, format, *args):
         """重写日志方法，不输出常规HTTP请求日志"""
         # 完全禁止HTTP请求日志输出
@@ -67,24 +75,13 @@ class WechatMpRequestHandler(BaseHTTPRequestHandler):
     def do_GET(self):
         """处理GET请求（公众号验证）"""
         try:
-            parsed_url = urlparse(self.path)
-            params = parse_qs(parsed_url.query)
-            
-            # 获取参数
-            signature = params.get("signature", [""])[0]
-            timestamp = params.get("timestamp", [""])[0]
-            nonce = params.get("nonce", [""])[0]
-            echostr = params.get("echostr", [""])[0]
-            
-            # 不再记录验证请求日志
+            echostr = self.server.channel.handle_verify(urlparse(self.path).query)
             
             # 直接返回echostr，验证成功
             self.send_response(200)
             self.send_header("Content-type", "text/plain")
             self.end_headers()
             self.wfile.write(echostr.encode("utf-8"))
-            
-            # 不记录验证成功日志
         
         except Exception as e:
             # 只记录严重错误
@@ -98,80 +95,14 @@ class WechatMpRequestHandler(BaseHTTPRequestHandler):
             content_length = int(self.headers['Content-Length'])
             request_data = self.rfile.read(content_length)
             
-            # 不再记录完整的XML请求内容
-            # logger.debug(f"收到POST请求:\n{request_data.decode('utf-8')}")
-            
             # 解析XML数据
             xml_data = request_data.decode('utf-8')
             
-            # 从XML中提取必要信息
-            from_user_match = re.search(r'<FromUserName><!\[CDATA\[(.*?)\]\]></FromUserName>', xml_data)
-            to_user_match = re.search(r'<ToUserName><!\[CDATA\[(.*?)\]\]></ToUserName>', xml_data)
-            msg_type_match = re.search(r'<MsgType><!\[CDATA\[(.*?)\]\]></MsgType>', xml_data)
-            
-            if not (from_user_match and to_user_match and msg_type_match):
-                logger.error("无法解析XML消息")
+            response = self.server.channel.handle_post(xml_data)
+            if response is None:
                 self.send_error(400, "无法解析消息")
                 return
             
-            from_user = from_user_match.group(1)
-            to_user = to_user_match.group(1)
-            msg_type = msg_type_match.group(1)
-            
-            # 解析更多字段
-            message = self.server.channel._parse_xml_to_dict(xml_data)
-            
-            # 记录消息内容 - 只在这里记录一次
-            if msg_type == 'text':
-                # 文本消息只记录内容
-                content = message.get('Content', '')
-                logger.info(f"[用户请求] {content}")
-            elif msg_type == 'event':
-                event = message.get('Event', '').lower()
-                if event == 'subscribe':
-                    logger.info("收到用户关注事件")
-                else:
-                    logger.info(f"收到事件: {event}")
-            elif msg_type == 'voice':
-                recognition = message.get("Recognition", "")
-                if recognition:
-                    logger.info(f"[语音识别] {recognition}")
-            else:
-                logger.info(f"收到消息类型: {msg_type}")
-            
-            # 根据消息类型处理
-            response = None
-            
-            # 事件消息
-            if msg_type == 'event':
-                event = message.get('Event', '').lower()
-                
-                if event == 'subscribe':
-                    # 处理关注事件
-                    logger.info(f"用户关注事件: {from_user}")
-                    response = self.server.channel.handle_subscribe_event(from_user, to_user)
-                else:
-                    logger.info(f"其他事件: {event}")
-                    # 不处理的事件，返回空消息
-                    response = self.server.channel.reply_empty(message)
-            # 文本消息
-            elif msg_type == 'text':
-                content = message.get('Content', '')
-                # 不再重复记录消息内容
-                response = self.server.channel.handle_text_message(message)
-            # 语音消息
-            elif msg_type == 'voice':
-                recognition = message.get("Recognition", "")
-                if recognition:
-                    logger.info(f"[语音识别] {recognition}")
-                    response = self.server.channel.handle_text_message(message)
-                else:
-                    response = self.server.channel.reply_text(message, "抱歉，我无法识别您的语音")
-            # 其他消息类型
-            else:
-                logger.info(f"未处理消息类型: {msg_type}")
-                response = self.server.channel.reply_text(message, "抱歉，我目前只支持文本消息")
-            
             # 发送响应
             self.send_response(200)
             self.send_header('Content-type', 'application/xml')
@@ -183,19 +114,176 @@ class WechatMpRequestHandler(BaseHTTPRequestHandler):
             self.send_error(500, "Internal Server Error")
 
 
+class RequestWorkerPool:
+    """
+    有界HTTP请求工作线程池
+    固定数量的工作线程从有界队列中取出连接处理，队列满时拒绝新连接
+    """
+    # 饱和告警的最小间隔(秒)
+    SATURATION_LOG_INTERVAL = 10
+
+    def __init__(self, server, max_workers, queue_size):
+        """
+        初始化工作线程池
+        :param server: HTTP服务器实例
+        :param max_workers: 工作线程数量
+        :param queue_size: 等待队列长度
+        """
+        self.server = server
+        self.max_workers = max_workers
+        self.queue_size = queue_size
+        self.requests = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.busy = 0
+        self.peak_busy = 0
+        self.handled = 0
+        self.rejected = 0
+        self.saturated = 0
+        self.last_saturation_log = 0
+        self.threads = []
+
+        for i in range(max_workers):
+            thread = threading.Thread(target=self._worker, name=f"wechat-mp-worker-{i}")
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, request, client_address):
+        """
+        提交连接到工作队列
+        :param request: 客户端连接
+        :param client_address: 客户端地址
+        :return: 成功入队返回True，队列已满返回False
+        """
+        try:
+            self.requests.put_nowait((request, client_address))
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+            self._log_saturation(f"HTTP工作线程池已满，拒绝来自 {client_address[0]} 的连接")
+            return False
+
+        with self.lock:
+            saturated = self.busy >= self.max_workers
+            if saturated:
+                self.saturated += 1
+        if saturated:
+            self._log_saturation("HTTP工作线程池已饱和，请求进入等待队列")
+        return True
+
+    def _log_saturation(self, message):
+        """限频输出线程池饱和告警"""
+        now = time.time()
+        with self.lock:
+            if now - self.last_saturation_log < self.SATURATION_LOG_INTERVAL:
+                return
+            self.last_saturation_log = now
+        stats = self.get_stats()
+        logger.warning(f"{message} - 忙碌: {stats['busy']}/{stats['workers']}, 排队: {stats['queued']}/{stats['queue_size']}, 累计拒绝: {stats['rejected']}")
+
+    def _worker(self):
+        """工作线程主循环"""
+        while True:
+            item = self.requests.get()
+            if item is None:
+                break
+
+            request, client_address = item
+            with self.lock:
+                self.busy += 1
+                self.peak_busy = max(self.peak_busy, self.busy)
+
+            try:
+                self.server.finish_request(request, client_address)
+            except Exception:
+                self.server.handle_error(request, client_address)
+            finally:
+                self.server.shutdown_request(request)
+                with self.lock:
+                    self.busy -= 1
+                    self.handled += 1
+
+    def shutdown(self):
+        """停止所有工作线程"""
+        for _ in self.threads:
+            try:
+                self.requests.put_nowait(None)
+            except queue.Full:
+                break
+
+    def get_stats(self):
+        """
+        获取线程池统计信息
+        :return: 统计字典
+        """
+        with self.lock:
+            return {
+                "workers": self.max_workers,
+                "busy": self.busy,
+                "peak_busy": self.peak_busy,
+                "queued": self.requests.qsize(),
+                "queue_size": self.queue_size,
+                "handled": self.handled,
+                "rejected": self.rejected,
+                "saturated": self.saturated
+            }
+
+
 class WechatMpServer(HTTPServer):
     """
     微信公众号HTTP服务器
     """
-    def __init__(self, server_address, channel):
+    def __init__(self, server_address, channel, max_workers=0, queue_size=64, backlog=10, client_timeout=10):
+        """
+        初始化服务器
+        :param server_address: 监听地址
+        :param channel: 通道实例
+        :param max_workers: 工作线程数量，0表示在服务线程中逐个处理请求
+        :param queue_size: 工作线程池等待队列长度
+        :param backlog: 监听队列长度
+        :param client_timeout: 客户端连接读写超时(秒)
+        """
         # 增加允许地址重用选项，避免重启时出现"地址已在使用"错误
         self.allow_reuse_address = True
         # 设置请求队列大小
-        self.request_queue_size = 10
+        self.request_queue_size = backlog
         # 设置超时时间
         self.timeout = 20
+        self.client_timeout = client_timeout
         super().__init__(server_address, WechatMpRequestHandler)
         self.channel = channel
+        self.pool = None
+        if max_workers > 0:
+            self.pool = RequestWorkerPool(self, max_workers, max(1, queue_size))
+
+    def process_request(self, request, client_address):
+        """
+        分发请求，启用线程池时交给工作线程处理
+        """
+        if self.pool is None:
+            super().process_request(request, client_address)
+            return
+
+        if not self.pool.submit(request, client_address):
+            # 队列已满，直接关闭连接，微信服务器会稍后重试
+            self.shutdown_request(request)
+
+    def server_close(self):
+        """关闭服务器并停止工作线程"""
+        super().server_close()
+        if self.pool:
+            self.pool.shutdown()
+
+    def get_stats(self):
+        """
+        获取服务器统计信息
+        :return: 统计字典
+        """
+        if self.pool is None:
+            return {"workers": 0, "backlog": self.request_queue_size}
+        stats = self.pool.get_stats()
+        stats["backlog"] = self.request_queue_size
+        return stats
     
     def handle_error(self, request, client_address):
         """
@@ -215,16 +303,86 @@ class WechatMpServer(HTTPServer):
         logger.error(f"处理来自 {client_ip} 的请求时发生异常: {exc_type.__name__}: {exc_value}")
 
 
+class PendingReply:
+    """
+    等待中的被动回复
+    消息处理线程在时间预算内等待模型回复，回调线程通过offer交付结果；
+    两者通过锁保证同一条回复只会以被动回复或客服消息中的一种方式发送
+    """
+    def __init__(self, max_bytes):
+        """
+        :param max_bytes: 被动回复允许的最大字节数
+        """
+        self.max_bytes = max_bytes
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.waiting = True
+        self.timed_out = False
+        self.superseded = False
+        self.streamed = False
+        self.content = None
+
+    def offer(self, content):
+        """
+        尝试以被动回复交付内容
+        :param content: 回复内容
+        :return: 被动回复接收返回True，调用方需改用客服消息发送时返回False
+        """
+        with self.lock:
+            if not self.waiting:
+                return False
+            self.waiting = False
+            if len(content.encode("utf-8")) <= self.max_bytes:
+                self.content = content
+        # 内容过长时也立即唤醒等待线程，不必等到预算耗尽
+        self.event.set()
+        return self.content is not None
+
+    def cancel(self):
+        """回复已被同一会话的新消息取代，立即唤醒等待线程"""
+        with self.lock:
+            self.waiting = False
+            self.superseded = True
+        self.event.set()
+
+    def stream(self):
+        """
+        流式模式下已有段落通过客服消息发送，之后的内容需按顺序跟在段落后面，不再被动回复
+        :return: 是否是第一次调用
+        """
+        with self.lock:
+            if self.streamed:
+                return False
+            self.waiting = False
+            self.streamed = True
+        self.event.set()
+        return True
+
+    def wait(self, timeout):
+        """
+        等待回复
+        :param timeout: 等待时间(秒)
+        :return: 可被动回复的内容，超时或内容过长返回None
+        """
+        signaled = self.event.wait(timeout)
+        with self.lock:
+            self.waiting = False
+            self.timed_out = not signaled and self.content is None
+            return self.content
+
+
 class WechatMpChannel:
     """
     微信公众号通道
     """
-    def __init__(self, bot):
+    def __init__(self, bot, server_mode="threaded"):
         """
         初始化微信公众号通道
         :param bot: 机器人实例
+        :param server_mode: HTTP服务器类型，threaded为http.server，asyncio为事件循环服务器
         """
         self.bot = bot
+        self.server_mode = server_mode
         self.token = get_value("wechat_mp_token")
         self.app_id = get_value("wechat_mp_app_id")
         self.app_secret = get_value("wechat_mp_app_secret")
@@ -233,10 +391,27 @@ class WechatMpChannel:
         self.address = get_value("wechat_mp_address", "0.0.0.0")
         self.auth_mode = get_value("wechat_mp_auth_mode", "plain")
         self.async_timeout = get_value("async_process_timeout", 5)
+        self.max_workers = get_value("wechat_mp_workers", 0)
+        self.worker_queue_size = get_value("wechat_mp_worker_queue_size", 64)
+        self.backlog = get_value("wechat_mp_backlog", 10)
+        self.client_timeout = get_value("wechat_mp_client_timeout", 10)
+        self.keep_alive_timeout = get_value("wechat_mp_keep_alive_timeout", 75)
         self.running = False
         self.subscribe_msg = get_value("subscribe_msg", "感谢关注！")
         self.server = None
         self.server_thread = None
+        # 被动回复等待预算，需低于微信5秒的响应时限，0表示总是通过客服消息发送
+        self.passive_reply_budget = get_value("passive_reply_budget", 0)
+        self.passive_reply_max_bytes = get_value("passive_reply_max_bytes", 2000)
+        self.reply_stats = {"passive": 0, "active": 0, "segments": 0, "too_long": 0, "timeout": 0, "superseded": 0, "keyword": 0}
+        self.reply_stats_lock = threading.Lock()
+        stats_registry.register("message_dedup", message_id_manager.get_stats)
+        stats_registry.register("replies", self.get_reply_stats)
+        
+        # 关键词规则：帮助、问候、清除记忆等固定指令直接回复，不调用模型
+        self.keyword_rules = KeywordRules(get_value("keyword_rules", []))
+        if self.keyword_rules.rules:
+            stats_registry.register("keyword_rules", self.keyword_rules.get_stats)
         
         # 验证配置
         if not self.token or self.token == "YOUR_WECHAT_TOKEN":
@@ -253,10 +428,19 @@ class WechatMpChannel:
         server_address = (self.address, self.port)
         
         try:
-            self.server = WechatMpServer(server_address, self)
+            self.server = self._create_server(server_address)
+            stats_registry.register("http_server", self.server.get_stats)
             
             # 改为使用日志，不直接打印到终端
             logger.info(f"微信公众号服务启动，监听地址: {self.address}:{self.port}")
+            if self.server_mode == "asyncio":
+                logger.info(f"使用asyncio事件循环服务器 - 处理线程: {self.server.max_workers}, 长连接超时: {self.keep_alive_timeout}秒")
+            elif self.max_workers > 0:
+                logger.info(f"并发处理已启用 - 工作线程: {self.max_workers}, 等待队列: {self.worker_queue_size}, 监听队列: {self.backlog}")
+            elif self.passive_reply_budget > 0:
+                # 等待被动回复期间占用处理请求的线程，没有工作线程池时整个服务会串行等待
+                logger.warning("passive_reply_budget需要配合wechat_mp_workers使用，未配置工作线程池，已关闭被动回复等待")
+                self.passive_reply_budget = 0
             logger.debug(f"认证模式: {self.auth_mode}")
             logger.debug(f"Token配置: {self.token[:4]}..." if self.token else "未配置")
             
@@ -288,6 +472,125 @@ class WechatMpChannel:
             print(f"\n[错误] 启动服务失败: {str(e)}\n")
             return False
     
+    def _create_server(self, server_address):
+        """
+        根据服务器类型创建HTTP服务器
+        :param server_address: 监听地址
+        :return: 服务器实例
+        """
+        if self.server_mode == "asyncio":
+            from channel.wechat_mp_async_server import WechatMpAsyncServer
+            return WechatMpAsyncServer(
+                server_address,
+                self,
+                max_workers=self.max_workers or 16,
+                backlog=self.backlog,
+                client_timeout=self.client_timeout,
+                keep_alive_timeout=self.keep_alive_timeout
+            )
+        
+        return WechatMpServer(
+            server_address,
+            self,
+            max_workers=self.max_workers,
+            queue_size=self.worker_queue_size,
+            backlog=self.backlog,
+            client_timeout=self.client_timeout
+        )
+    
+    def handle_verify(self, query):
+        """
+        处理公众号接入验证
+        :param query: URL查询字符串
+        :return: 需要原样返回的echostr
+        """
+        params = parse_qs(query)
+        
+        # 获取参数
+        signature = params.get("signature", [""])[0]
+        timestamp = params.get("timestamp", [""])[0]
+        nonce = params.get("nonce", [""])[0]
+        echostr = params.get("echostr", [""])[0]
+        
+        # 不再记录验证请求日志
+        return echostr
+    
+    def handle_post(self, xml_data):
+        """
+        处理微信服务器推送的消息，供各类HTTP服务器共用
+        :param xml_data: XML字符串
+        :return: 回复的XML，无法解析时返回None
+        """
+        # 一次扫描解析所有字段
+        message = parse_message(xml_data)
+        
+        from_user = message.get('FromUserName')
+        to_user = message.get('ToUserName')
+        msg_type = message.get('MsgType')
+        
+        if not (from_user and to_user and msg_type):
+            logger.error("无法解析XML消息")
+            return None
+        
+        # 微信服务器在5秒内未收到响应会重试，同一消息只处理一次
+        dedup_key = self._build_dedup_key(message)
+        if not message_id_manager.add_message_id(dedup_key):
+            logger.info(f"忽略重复推送: {dedup_key}")
+            return "success"
+        
+        # 记录消息内容 - 只在这里记录一次
+        if msg_type == 'text':
+            # 文本消息只记录内容
+            content = message.get('Content', '')
+            logger.info(f"[用户请求] {content}")
+        elif msg_type == 'event':
+            event = message.get('Event', '').lower()
+            if event == 'subscribe':
+                logger.info("收到用户关注事件")
+            else:
+                logger.info(f"收到事件: {event}")
+        elif msg_type == 'voice':
+            recognition = message.get("Recognition", "")
+            if recognition:
+                logger.info(f"[语音识别] {recognition}")
+        else:
+            logger.info(f"收到消息类型: {msg_type}")
+        
+        # 根据消息类型处理
+        response = None
+        
+        # 事件消息
+        if msg_type == 'event':
+            event = message.get('Event', '').lower()
+            
+            if event == 'subscribe':
+                # 处理关注事件
+                logger.info(f"用户关注事件: {from_user}")
+                response = self.handle_subscribe_event(from_user, to_user)
+            else:
+                logger.info(f"其他事件: {event}")
+                # 不处理的事件，返回空消息
+                response = self.reply_empty(message)
+        # 文本消息
+        elif msg_type == 'text':
+            content = message.get('Content', '')
+            # 不再重复记录消息内容
+            response = self.handle_text_message(message)
+        # 语音消息
+        elif msg_type == 'voice':
+            recognition = message.get("Recognition", "")
+            if recognition:
+                logger.info(f"[语音识别] {recognition}")
+                response = self.handle_text_message(message)
+            else:
+                response = self.reply_text(message, "抱歉，我无法识别您的语音")
+        # 其他消息类型
+        else:
+            logger.info(f"未处理消息类型: {msg_type}")
+            response = self.reply_text(message, "抱歉，我目前只支持文本消息")
+        
+        return response
+    
     def handle_message(self, message):
         """
         处理微信消息
@@ -359,25 +662,93 @@ class WechatMpChannel:
         # 构建会话ID
         session_id = self._build_session_id(message)
         
+        # 命中关键词规则时直接被动回复，不进入模型请求队列
+        rule = self.keyword_rules.match(content)
+        if rule is not None:
+            return self.handle_keyword_rule(message, session_id, rule)
+        
+        pending = PendingReply(self.passive_reply_max_bytes) if self.passive_reply_budget > 0 else None
+        
         # 定义回调函数，用于发送消息给用户
         def send_reply_callback(session_id, reply_content):
-            # 从会话ID中提取用户ID
-            if ":" in session_id:
-                openid = session_id.split(":", 1)[1]
-            else:
-                openid = session_id
-            # 发送消息给用户
-            self.send_text_to_user(openid, reply_content)
+            # 回复已被同一会话的新消息取代，或消息已合并到后续消息中，没有内容需要发送
+            if reply_content is None:
+                if pending is not None:
+                    pending.cancel()
+                return
+            # 仍在等待时间预算内且内容足够短，直接作为被动回复返回
+            if pending is not None and pending.offer(reply_content):
+                return
+            # 发送消息给用户，排在已提交的段落之后
+            self._count_reply("active")
+            self.send_in_order(session_id, reply_content)
+        
+        # 流式模式下已完成的段落提交到会话的发送队列，不阻塞读取模型输出
+        def send_segment_callback(segment):
+            # 段落已通过客服消息发送，剩余内容不能再抢先被动回复，立即结束等待
+            if pending is not None:
+                pending.stream()
+            self._count_reply("segments")
+            self.send_in_order(session_id, segment)
         
         # 异步回复，传递回调函数
-        result = self.bot.reply_async(session_id, content, callback=send_reply_callback)
+        result = self.bot.reply_async(session_id, content, callback=send_reply_callback, on_segment=send_segment_callback)
         
         if result.get("success"):
+            if pending is not None:
+                start_time = time.time()
+                reply_content = pending.wait(self.passive_reply_budget)
+                if reply_content is not None:
+                    self._count_reply("passive")
+                    logger.info(f"[AI回复] {reply_content}")
+                    logger.debug(f"被动回复，耗时: {time.time() - start_time:.2f}秒")
+                    return self.reply_text(message, reply_content)
+                if pending.superseded:
+                    self._count_reply("superseded")
+                elif not pending.streamed:
+                    self._count_reply("timeout" if pending.timed_out else "too_long")
             # 返回空消息，不显示"收到消息，正在思考中..."
             return self.reply_empty(message)
         else:
             return self.reply_text(message, f"处理消息失败: {result.get('message', '未知错误')}")
     
+    def handle_keyword_rule(self, message, session_id, rule):
+        """
+        执行命中的关键词规则
+        :param message: 消息字典
+        :param session_id: 会话ID
+        :param rule: 规则配置
+        :return: 回复消息
+        """
+        action = rule.get("action")
+        if action == "reset_session":
+            self.bot.clear_session(session_id)
+        elif action:
+            logger.warning(f"未知的关键词规则动作: {action}")
+        
+        self._count_reply("keyword")
+        reply_content = rule.get("reply")
+        if not reply_content:
+            return self.reply_empty(message)
+        logger.info(f"[关键词回复] {reply_content}")
+        return self.reply_text(message, reply_content)
+    
+    def _count_reply(self, key):
+        """累加回复方式计数"""
+        with self.reply_stats_lock:
+            self.reply_stats[key] += 1
+    
+    def get_reply_stats(self):
+        """
+        获取回复方式统计：passive为被动回复数量，active为客服消息数量，
+        segments为流式模式下提前发送的段落数量，
+        too_long和timeout为未能被动回复而转为客服消息的原因，superseded为被新消息取代或合并而不需要回复的消息数量，
+        keyword为命中关键词规则直接回复的消息数量
+        :return: 统计字典
+        """
+        with self.reply_stats_lock:
+            return dict(self.reply_stats)
+    
     def handle_voice_message(self, message):
         """
         处理语音消息
@@ -404,7 +775,7 @@ class WechatMpChannel:
 <FromUserName><![CDATA[{message['ToUserName']}]]></FromUserName>
 <CreateTime>{int(time.time())}</CreateTime>
 <MsgType><![CDATA[text]]></MsgType>
-<Content><![CDATA[{content}]]></Content>
+<Content><![CDATA[{content.replace("]]>", "]]]]><![CDATA[>")}]]></Content>
 </xml>"""
         return response
     
@@ -423,6 +794,22 @@ class WechatMpChannel:
 </xml>"""
         return response
     
+    def send_in_order(self, session_id, content):
+        """
+        通过后台任务发送客服消息，同一会话的消息按提交顺序逐条发送
+        发送失败重试时只占用后台工作线程，不阻塞调用方（如读取流式输出的线程）
+        :param session_id: 会话ID
+        :param content: 文本内容
+        """
+        openid = self._get_openid(session_id)
+        # 任务队列已满时在当前线程发送，避免丢失内容
+        async_run(
+            self.send_text_to_user, openid, content,
+            key=f"send:{session_id}",
+            on_reject=lambda: self.send_text_to_user(openid, content),
+            priority=True
+        )
+
     def send_text_to_user(self, openid, content):
         """
         主动发送文本消息给用户
@@ -446,6 +833,16 @@ class WechatMpChannel:
             logger.error(f"发送消息给用户失败: {str(e)}")
             return False
 
+    def _get_openid(self, session_id):
+        """
+        从会话ID中提取用户openid
+        :param session_id: 会话ID
+        :return: openid
+        """
+        if ":" in session_id:
+            return session_id.split(":", 1)[1]
+        return session_id
+
     def _build_session_id(self, message):
         """
         构建会话ID
@@ -455,29 +852,21 @@ class WechatMpChannel:
         from_user = message.get('FromUserName', '')
         return f"wechat_mp:{from_user}"
 
+    def _build_dedup_key(self, message):
+        """
+        构建消息去重键，普通消息使用MsgId，事件消息使用FromUserName+CreateTime
+        :param message: 消息字典
+        :return: 去重键
+        """
+        msg_id = message.get('MsgId')
+        if msg_id:
+            return msg_id
+        return f"{message.get('FromUserName', '')}:{message.get('CreateTime', '')}"
+
     def _parse_xml_to_dict(self, xml_string):
         """
         解析XML字符串为字典
         :param xml_string: XML字符串
         :return: 字典
         """
-        message = {}
-        
-        # 提取常见字段
-        pattern_map = {
-            'ToUserName': r'<ToUserName><!\[CDATA\[(.*?)\]\]></ToUserName>',
-            'FromUserName': r'<FromUserName><!\[CDATA\[(.*?)\]\]></FromUserName>',
-            'CreateTime': r'<CreateTime>(.*?)</CreateTime>',
-            'MsgType': r'<MsgType><!\[CDATA\[(.*?)\]\]></MsgType>',
-            'Content': r'<Content><!\[CDATA\[(.*?)\]\]></Content>',
-            'MsgId': r'<MsgId>(.*?)</MsgId>',
-            'Event': r'<Event><!\[CDATA\[(.*?)\]\]></Event>',
-            'Recognition': r'<Recognition><!\[CDATA\[(.*?)\]\]></Recognition>'
-        }
-        
-        for key, pattern in pattern_map.items():
-            match = re.search(pattern, xml_string)
-            if match:
-                message[key] = match.group(1)
-        
-        return message 
\ No newline at end of file
+        return parse_message(xml_string)
\ No newline at end of file
@@ -4,8 +4,14 @@ import requests
 import threading
 import traceback
 from common.log import logger
+from common.segmenter import MESSAGE_SEPARATORS
 from config import get_value, config
 
+# access_token无效或已过期的错误码，重新获取后可以重试
+TOKEN_ERROR_CODES = (40001, 40014, 42001)
+# 等待主进程下发access_token的最长时间(秒)
+TOKEN_WAIT_TIMEOUT = 10
+
 class WechatMpClient:
     """
     微信公众号客服消息接口客户端
@@ -25,6 +31,10 @@ class WechatMpClient:
         self.access_token = None
         self.token_expire_time = 0
         self.lock = threading.RLock()
+        self.token_condition = threading.Condition(self.lock)
+        # 多进程模式下由主进程统一获取access_token，工作进程通过该函数请求刷新，参数为已失效的token
+        self.request_token = None
+        self.stale_token = None
         self.proxy = get_value("proxy", "")
         
         # 微信单条消息最大长度
@@ -35,6 +45,51 @@ class WechatMpClient:
         if not self.enabled:
             logger.warning("微信公众号客服消息接口未配置或配置无效，消息发送将不可用")
     
+    def use_shared_token(self, request_token):
+        """
+        使用主进程下发的access_token，不再自行获取
+        微信每次获取新token都会使旧token失效，多个进程各自获取时只有最后一个进程的token有效
+        :param request_token: 请求主进程刷新token的函数，参数为已失效的token（没有时为None）
+        """
+        with self.lock:
+            self.request_token = request_token
+
+    def set_access_token(self, access_token, expire_time):
+        """
+        设置主进程下发的access_token，唤醒等待token的线程
+        :param access_token: access_token
+        :param expire_time: 过期时间戳
+        """
+        with self.token_condition:
+            self.access_token = access_token
+            self.token_expire_time = expire_time
+            self.token_condition.notify_all()
+
+    def invalidate_token(self, access_token):
+        """
+        接口返回token无效时丢弃缓存的token，下次使用时重新获取
+        :param access_token: 失效的token，与当前token不同时说明已经刷新过，不再处理
+        """
+        with self.lock:
+            if access_token != self.access_token:
+                return
+            logger.warning(f"微信access_token已失效，重新获取: {access_token[:10]}...")
+            self.access_token = None
+            self.token_expire_time = 0
+            self.stale_token = access_token
+
+    def _wait_shared_token(self):
+        """等待主进程下发有效的access_token，调用方需持有锁"""
+        self.request_token(self.stale_token)
+        deadline = time.time() + TOKEN_WAIT_TIMEOUT
+        while not (self.access_token and time.time() < self.token_expire_time - 60):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                logger.error("等待主进程下发微信access_token超时")
+                return None
+            self.token_condition.wait(remaining)
+        return self.access_token
+
     def get_access_token(self):
         """
         获取微信接口调用的access_token
@@ -48,6 +103,9 @@ class WechatMpClient:
             if self.access_token and time.time() < self.token_expire_time - 60:
                 return self.access_token
             
+            if self.request_token is not None:
+                return self._wait_shared_token()
+            
             # 获取新token
             try:
                 url = f"https://api.weixin.qq.com/cgi-bin/token?grant_type=client_credential&appid={self.app_id}&secret={self.app_secret}"
@@ -99,19 +157,7 @@ class WechatMpClient:
         remaining = content
         
         # 段落分隔符优先级
-        separators = [
-            "\n\n",  # 段落分隔符，优先级最高
-            "\n",    # 换行符
-            "。",    # 句号
-            "！",    # 感叹号
-            "？",    # 问号
-            "；",    # 分号
-            "，",    # 逗号
-            " ",     # 空格
-            ".",     # 英文句号
-            ";",     # 英文分号
-            ","      # 英文逗号
-        ]
+        separators = MESSAGE_SEPARATORS
         
         while remaining:
             if len(remaining) <= max_length:
@@ -193,6 +239,7 @@ class WechatMpClient:
             # 使用重试机制
             max_retries = 3  # 增加重试次数
             retry_count = 0
+            token_refreshed = False
             
             while retry_count <= max_retries:
                 try:
@@ -208,7 +255,17 @@ class WechatMpClient:
                             logger.warning(f"发送微信客服消息失败: 错误码={err_code}, 错误信息={err_msg}")
                             
                             # 针对特定错误码处理
-                            if err_code == 45015:  # 回复时间超过限制
+                            if err_code in TOKEN_ERROR_CODES and not token_refreshed:
+                                # token已失效（例如被其他进程重新获取），丢弃后重新获取一次并立即重试
+                                token_refreshed = True
+                                self.invalidate_token(access_token)
+                                access_token = self.get_access_token()
+                                if not access_token:
+                                    logger.error("重新获取access_token失败，无法发送客服消息")
+                                    return False
+                                url = f"https://api.weixin.qq.com/cgi-bin/message/custom/send?access_token={access_token}"
+                                continue
+                            elif err_code == 45015:  # 回复时间超过限制
                                 logger.error("发送失败：回复超时，无法继续发送")
                                 return False  # 这种情况不再重试
                             elif err_code == 45002:  # 消息长度超过限制
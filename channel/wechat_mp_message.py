@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import re
+import html
+
+# 匹配XML中的叶子节点，值为CDATA或普通文本
+# 嵌套节点（如<xml>、<ScanCodeInfo>）本身不会匹配，其子节点会被展开到同一层
+ELEMENT_PATTERN = re.compile(
+    r'<(\w+)>(?:<!\[CDATA\[(.*?)\]\]>|([^<]*))</\1>',
+    re.DOTALL
+)
+
+def parse_message(xml_string):
+    """
+    一次扫描解析微信推送的XML消息
+    所有标准字段（Content、PicUrl、MediaId、EventKey、Location_X、ScanCodeInfo下的ScanType等）
+    都会以原始字段名作为键返回；同名字段出现多次时保留第一个
+    :param xml_string: XML字符串
+    :return: 消息字典，值均为字符串
+    """
+    message = {}
+    for key, cdata, text in ELEMENT_PATTERN.findall(xml_string):
+        if key in message:
+            continue
+        if cdata:
+            message[key] = cdata
+        else:
+            # 空CDATA时text也为空字符串，结果一致
+            text = text.strip()
+            message[key] = html.unescape(text) if "&" in text else text
+    return message
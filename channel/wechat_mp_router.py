@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+from channel.wechat_mp_channel import WechatMpChannel
+from channel.wechat_mp_message import parse_message
+from common.log import logger
+from common.hash_ring import ConsistentHashRing
+from common.stats import stats_registry
+from common.utils import generate_request_id
+from config import get_value
+
+# 被动回复需要在主进程的等待超时之前完成，预留给进程间通信的时间(秒)
+PASSIVE_REPLY_MARGIN = 0.5
+# 主进程检查access_token是否需要刷新的间隔(秒)
+TOKEN_REFRESH_INTERVAL = 60
+
+def _passive_reply_limit():
+    """多进程模式下被动回复等待预算的上限"""
+    return max(0, get_value("worker_response_timeout", 4.5) - PASSIVE_REPLY_MARGIN)
+
+def _worker_main(index, request_queue, response_queue):
+    """
+    工作进程入口：加载配置，创建独立的机器人和通道，处理父进程转发的消息
+    :param index: 工作进程序号
+    :param request_queue: 请求队列，元素为(request_id, xml_data)；request_id为None时是主进程下发的(access_token, 过期时间)
+    :param response_queue: 响应队列，元素为(request_id, response)；request_id为None时是请求刷新access_token的(序号, 失效的token)
+    """
+    from config import load_config
+    from common.log import init_logger
+
+    load_config()
+    log_dir = get_value("log_dir", "logs")
+    init_logger(os.path.join(log_dir, f"worker-{index}"), get_value("log_level", "info"))
+
+    stats_log_interval = get_value("stats_log_interval", 0)
+    if stats_log_interval and stats_log_interval > 0:
+        stats_registry.start_reporter(stats_log_interval)
+
+    # access_token由主进程统一获取，各进程自行获取会使其他进程的token失效
+    from channel.wechat_mp_client import mp_client
+    mp_client.use_shared_token(lambda stale: response_queue.put((None, (index, stale))))
+
+    from bot.bot import DeepSeekBot
+    bot = DeepSeekBot()
+    channel = WechatMpChannel(bot)
+    # 超过主进程等待时间的被动回复会被丢弃：主进程已经返回空消息，回复也不会再通过客服消息发送
+    if channel.passive_reply_budget > _passive_reply_limit():
+        channel.passive_reply_budget = _passive_reply_limit()
+        logger.warning(f"passive_reply_budget需低于worker_response_timeout，已调整为{channel.passive_reply_budget}秒")
+    executor = ThreadPoolExecutor(max_workers=get_value("wechat_mp_workers", 0) or 16)
+    logger.info(f"工作进程 {index} 已启动，PID: {os.getpid()}")
+
+    def handle(request_id, xml_data):
+        try:
+            response = channel.handle_post(xml_data)
+        except Exception as e:
+            logger.error(f"工作进程处理消息异常: {str(e)}", exc_info=True)
+            response = None
+        response_queue.put((request_id, response))
+
+    while True:
+        item = request_queue.get()
+        if item is None:
+            break
+        if item[0] is None:
+            mp_client.set_access_token(*item[1])
+            continue
+        executor.submit(handle, *item)
+
+    executor.shutdown(wait=True)
+    logger.info(f"工作进程 {index} 已退出")
+
+
+class WechatMpRouterChannel(WechatMpChannel):
+    """
+    多进程微信公众号通道
+    父进程只负责接收HTTP请求，按用户openid一致性哈希转发到固定的工作进程；
+    每个工作进程拥有独立的机器人实例和会话，同一用户的消息总是由同一个进程处理
+    """
+    # 工作进程存活检查间隔(秒)
+    MONITOR_INTERVAL = 1
+
+    def __init__(self, worker_count, server_mode="threaded"):
+        """
+        初始化多进程通道
+        :param worker_count: 工作进程数量
+        :param server_mode: HTTP服务器类型
+        """
+        super().__init__(None, server_mode=server_mode)
+        # 消息去重和回复统计在工作进程中进行
+        stats_registry.unregister("message_dedup")
+        stats_registry.unregister("replies")
+        self.worker_count = worker_count
+        # 需低于微信的5秒时限，并为进程间通信留出余量
+        self.worker_timeout = get_value("worker_response_timeout", 4.5)
+        self.ring = ConsistentHashRing(range(worker_count))
+        self.context = multiprocessing.get_context("spawn")
+        self.response_queue = self.context.Queue()
+        self.workers = [None] * worker_count
+        self.request_queues = [None] * worker_count
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.routed = [0] * worker_count
+        self.restarts = [0] * worker_count
+        self.timeouts = 0
+        # 工作进程的access_token刷新请求，以及最近下发的(access_token, 过期时间)
+        self.token_requests = queue.Queue()
+        self.shared_token = None
+        if get_value("passive_reply_budget", 0) > _passive_reply_limit():
+            logger.warning(f"passive_reply_budget需低于worker_response_timeout，工作进程中将调整为{_passive_reply_limit()}秒")
+
+    def startup(self):
+        """
+        启动工作进程后再启动HTTP服务
+        """
+        for index in range(self.worker_count):
+            self._start_worker(index)
+
+        threading.Thread(target=self._dispatch_responses, daemon=True).start()
+        threading.Thread(target=self._monitor_workers, daemon=True).start()
+        threading.Thread(target=self._refresh_tokens, daemon=True).start()
+        stats_registry.register("workers", self.get_stats)
+        logger.info(f"多进程模式已启用，工作进程数量: {self.worker_count}")
+
+        return super().startup()
+
+    def _start_worker(self, index):
+        """
+        启动(或重启)指定序号的工作进程，序号不变，因此路由关系保持不变
+        :param index: 工作进程序号
+        """
+        request_queue = self.context.Queue()
+        process = self.context.Process(
+            target=_worker_main,
+            args=(index, request_queue, self.response_queue),
+            name=f"wechat-worker-{index}"
+        )
+        process.daemon = True
+        process.start()
+        with self.lock:
+            self.request_queues[index] = request_queue
+            self.workers[index] = process
+            if self.shared_token is not None:
+                request_queue.put((None, self.shared_token))
+
+    def _refresh_tokens(self):
+        """
+        统一获取微信access_token并下发给所有工作进程
+        定期检查是否临近过期；工作进程报告token失效时，只在失效的正是当前token时重新获取，避免重复刷新
+        """
+        from channel.wechat_mp_client import mp_client
+        if not mp_client.enabled:
+            return
+        while True:
+            try:
+                index, stale = self.token_requests.get(timeout=TOKEN_REFRESH_INTERVAL)
+            except queue.Empty:
+                index, stale = None, None
+            try:
+                if stale:
+                    mp_client.invalidate_token(stale)
+                access_token = mp_client.get_access_token()
+                if not access_token:
+                    continue
+                token = (access_token, mp_client.token_expire_time)
+                with self.lock:
+                    if token != self.shared_token:
+                        self.shared_token = token
+                        targets = list(self.request_queues)
+                    elif index is not None:
+                        targets = [self.request_queues[index]]
+                    else:
+                        targets = []
+                for request_queue in targets:
+                    if request_queue is not None:
+                        request_queue.put((None, token))
+            except Exception as e:
+                logger.error(f"下发微信access_token失败: {str(e)}")
+
+    def _monitor_workers(self):
+        """定期检查工作进程，异常退出时自动重启"""
+        while True:
+            time.sleep(self.MONITOR_INTERVAL)
+            for index, process in enumerate(self.workers):
+                if process is None or process.is_alive():
+                    continue
+                logger.error(f"工作进程 {index} 异常退出(退出码: {process.exitcode})，正在重启")
+                with self.lock:
+                    self.restarts[index] += 1
+                try:
+                    self._start_worker(index)
+                except Exception as e:
+                    logger.error(f"重启工作进程 {index} 失败: {str(e)}")
+
+    def _dispatch_responses(self):
+        """把工作进程的响应交给等待中的请求线程"""
+        while True:
+            try:
+                request_id, response = self.response_queue.get()
+            except Exception as e:
+                logger.error(f"读取工作进程响应失败: {str(e)}")
+                continue
+            if request_id is None:
+                self.token_requests.put(response)
+                continue
+            with self.lock:
+                waiter = self.pending.get(request_id)
+            if waiter:
+                waiter["response"] = response
+                waiter["event"].set()
+
+    def handle_post(self, xml_data):
+        """
+        将消息转发给用户所属的工作进程，并等待其返回回复XML
+        :param xml_data: XML字符串
+        :return: 回复的XML，无法解析时返回None
+        """
+        message = parse_message(xml_data)
+        from_user = message.get("FromUserName")
+        if not (from_user and message.get("ToUserName")):
+            logger.error("无法解析XML消息")
+            return None
+
+        index = self.ring.get_node(from_user)
+        request_id = generate_request_id()
+        waiter = {"event": threading.Event(), "response": None}
+
+        with self.lock:
+            self.pending[request_id] = waiter
+            self.routed[index] += 1
+            request_queue = self.request_queues[index]
+
+        try:
+            request_queue.put((request_id, xml_data))
+            if waiter["event"].wait(self.worker_timeout):
+                return waiter["response"]
+        finally:
+            with self.lock:
+                self.pending.pop(request_id, None)
+
+        with self.lock:
+            self.timeouts += 1
+        # 工作进程仍会继续处理，回复稍后通过客服消息发送，这里只返回空消息，避免用户先收到繁忙提示再收到回复
+        logger.warning(f"工作进程 {index} 处理超时，用户: {from_user[:8]}...")
+        return self.reply_empty(message)
+
+    def get_stats(self):
+        """
+        获取工作进程统计信息
+        :return: 统计字典
+        """
+        with self.lock:
+            return {
+                "count": self.worker_count,
+                "alive": sum(1 for process in self.workers if process is not None and process.is_alive()),
+                "routed": list(self.routed),
+                "restarts": list(self.restarts),
+                "pending": len(self.pending),
+                "timeouts": self.timeouts
+            }
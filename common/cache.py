@@ -0,0 +1,141 @@
+import time
+import threading
+from collections import OrderedDict
+
+class TTLCache:
+    """
+    带过期时间的LRU缓存
+    基于OrderedDict实现，读写和淘汰均为O(1)：
+    - 新写入的条目放在末尾，命中时移动到末尾
+    - 超过容量时从头部淘汰最久未使用的条目
+    - 条目在写入ttl秒后过期，读取时惰性清理，写入时顺带清理头部已过期的条目
+    """
+    def __init__(self, max_size=1000, ttl=0):
+        """
+        初始化缓存
+        :param max_size: 最大条目数量
+        :param ttl: 过期时间(秒)，0表示不过期
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expired(self, expire_at, now):
+        return expire_at is not None and expire_at <= now
+
+    def get(self, key, default=None):
+        """
+        读取缓存
+        :param key: 键
+        :param default: 未命中时的返回值
+        :return: 缓存值
+        """
+        now = time.time()
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expire_at = item
+            if self._expired(expire_at, now):
+                del self.data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """
+        写入缓存，会覆盖已有的值并重新计算过期时间
+        :param key: 键
+        :param value: 值
+        """
+        now = time.time()
+        with self.lock:
+            self._set(key, value, now)
+
+    def add(self, key, value=True):
+        """
+        仅当键不存在(或已过期)时写入
+        :param key: 键
+        :param value: 值
+        :return: 写入成功返回True，键已存在返回False
+        """
+        now = time.time()
+        with self.lock:
+            item = self.data.get(key)
+            if item is not None and not self._expired(item[1], now):
+                self.data.move_to_end(key)
+                self.hits += 1
+                return False
+            self.misses += 1
+            self._set(key, value, now)
+            return True
+
+    def _set(self, key, value, now):
+        """写入条目并执行淘汰，调用方需持有锁"""
+        expire_at = now + self.ttl if self.ttl else None
+        self.data[key] = (value, expire_at)
+        self.data.move_to_end(key)
+
+        # 清理头部已过期的条目
+        while self.data:
+            oldest_key, (_, oldest_expire_at) = next(iter(self.data.items()))
+            if not self._expired(oldest_expire_at, now):
+                break
+            self.data.popitem(last=False)
+            self.expirations += 1
+
+        # 超出容量时淘汰最久未使用的条目
+        while len(self.data) > self.max_size:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        """
+        删除并返回缓存值
+        :param key: 键
+        :param default: 键不存在时的返回值
+        """
+        with self.lock:
+            item = self.data.pop(key, None)
+            return default if item is None else item[0]
+
+    def __contains__(self, key):
+        now = time.time()
+        with self.lock:
+            item = self.data.get(key)
+            return item is not None and not self._expired(item[1], now)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.data)
+
+    def clear(self):
+        """清空缓存"""
+        with self.lock:
+            self.data.clear()
+
+    def get_stats(self):
+        """
+        获取缓存统计信息
+        :return: 统计字典
+        """
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self.data),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
@@ -0,0 +1,78 @@
+import threading
+
+class CancelToken:
+    """
+    取消标记
+    由其他线程调用cancel设置，执行中的任务在检查点查看cancelled，或通过add_callback在取消时被唤醒
+    """
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.callbacks = []
+
+    @property
+    def cancelled(self):
+        """是否已取消"""
+        return self.event.is_set()
+
+    def cancel(self):
+        """
+        取消，并调用已注册的回调
+        :return: 本次调用是否完成了取消，已经取消过时返回False
+        """
+        with self.lock:
+            if self.event.is_set():
+                return False
+            self.event.set()
+            callbacks = self.callbacks
+            self.callbacks = []
+        for callback in callbacks:
+            callback()
+        return True
+
+    def add_callback(self, callback):
+        """
+        注册取消时调用的无参函数，已经取消时立即调用
+        :param callback: 回调函数
+        """
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return
+        callback()
+
+def run_cancellable(scheduler, token, func, *args):
+    """
+    在调度器的工作线程中执行函数，调用线程等待执行完成或被取消
+    取消后调用线程立即返回，函数继续执行到结束，结果被丢弃；调度器已满时在调用线程中执行，无法中途取消
+    :param scheduler: 执行函数的调度器(JobScheduler)
+    :param token: 取消标记
+    :param func: 要执行的函数
+    :param args: 函数参数
+    :return: (是否执行完成, 函数返回值)，被取消时返回(False, None)
+    """
+    # 已经取消时不再提交
+    if token.cancelled:
+        return False, None
+
+    done = threading.Event()
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = func(*args)
+        except Exception as e:
+            outcome["error"] = e
+        finally:
+            done.set()
+
+    if not scheduler.submit(run):
+        return True, func(*args)
+
+    token.add_callback(done.set)
+    done.wait()
+    if "error" in outcome:
+        raise outcome["error"]
+    if "result" not in outcome:
+        return False, None
+    return True, outcome["result"]
@@ -0,0 +1,118 @@
+import time
+import threading
+from common.log import logger
+
+# 熔断器状态
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+    """
+    熔断器
+    - closed: 正常放行，连续失败达到阈值后进入open
+    - open: 直接拒绝请求，经过recovery_timeout秒后进入half_open
+    - half_open: 最多放行half_open_max_calls个试探请求，成功则恢复closed，失败则重新open
+    每个放行的请求结束后必须调用record_success或record_failure
+    """
+    def __init__(self, name, failure_threshold=5, recovery_timeout=30, half_open_max_calls=1):
+        """
+        初始化熔断器
+        :param name: 名称，用于日志
+        :param failure_threshold: 触发熔断的连续失败次数，0表示不熔断
+        :param recovery_timeout: 熔断后多少秒开始试探恢复
+        :param half_open_max_calls: 试探阶段同时放行的请求数量
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0
+        self.trials = 0
+        self.lock = threading.Lock()
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.opened = 0
+        self.last_change = time.time()
+
+    def _transition(self, state):
+        """切换状态并记录日志，调用方需持有锁"""
+        previous = self.state
+        self.state = state
+        self.last_change = time.time()
+        if state == STATE_OPEN:
+            self.opened_at = self.last_change
+            self.opened += 1
+            logger.warning(f"熔断器[{self.name}]: {previous} -> open，连续失败{self.consecutive_failures}次，{self.recovery_timeout}秒后试探恢复")
+        elif state == STATE_CLOSED:
+            logger.info(f"熔断器[{self.name}]: {previous} -> closed，上游已恢复")
+        else:
+            logger.info(f"熔断器[{self.name}]: {previous} -> half_open，开始试探请求")
+
+    def allow(self):
+        """
+        判断是否放行一次请求
+        :return: 放行返回True，熔断中返回False
+        """
+        with self.lock:
+            if self.state == STATE_OPEN:
+                if time.time() - self.opened_at < self.recovery_timeout:
+                    self.rejected += 1
+                    return False
+                self.trials = 0
+                self._transition(STATE_HALF_OPEN)
+            if self.state == STATE_HALF_OPEN:
+                if self.trials >= self.half_open_max_calls:
+                    self.rejected += 1
+                    return False
+                self.trials += 1
+            return True
+
+    def is_open(self):
+        """
+        是否处于熔断状态（不放行新请求），不占用试探名额
+        :return: 熔断中返回True
+        """
+        with self.lock:
+            if self.state == STATE_OPEN:
+                return time.time() - self.opened_at < self.recovery_timeout
+            if self.state == STATE_HALF_OPEN:
+                return self.trials >= self.half_open_max_calls
+            return False
+
+    def record_success(self):
+        """记录一次成功"""
+        with self.lock:
+            self.successes += 1
+            self.consecutive_failures = 0
+            if self.state == STATE_HALF_OPEN:
+                self._transition(STATE_CLOSED)
+
+    def record_failure(self):
+        """记录一次失败"""
+        with self.lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.state == STATE_HALF_OPEN:
+                self._transition(STATE_OPEN)
+            elif self.state == STATE_CLOSED and self.failure_threshold and self.consecutive_failures >= self.failure_threshold:
+                self._transition(STATE_OPEN)
+
+    def get_stats(self):
+        """
+        获取熔断器统计信息
+        :return: 统计字典
+        """
+        with self.lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "successes": self.successes,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "opened": self.opened,
+                "state_age": round(time.time() - self.last_change, 1)
+            }
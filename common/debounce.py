@@ -0,0 +1,117 @@
+import time
+import threading
+from common.log import logger
+
+class Batch:
+    """一个键在防抖窗口内收到的消息"""
+    __slots__ = ("items", "first_at", "deadline")
+
+    def __init__(self, item, now, deadline):
+        self.items = [item]
+        self.first_at = now
+        self.deadline = deadline
+
+class Debouncer:
+    """
+    按键防抖合并
+    同一个键的消息在window秒内连续到达时合并为一批，最后一条消息之后window秒内没有新消息时交给flush处理；
+    一批消息从第一条起最多等待max_wait秒，持续发送也不会无限推迟
+    所有键共用一个后台线程，按最早的截止时间等待
+    """
+    def __init__(self, flush, window=1.5, max_wait=5, max_items=10, on_merge=None, name="debounce"):
+        """
+        初始化
+        :param flush: 处理函数，参数为(键, 消息列表)，在后台线程中调用，应尽快返回
+        :param on_merge: 新消息合并到已有批次时调用，参数为(键, 被合并的上一条消息)
+        :param window: 防抖窗口(秒)
+        :param max_wait: 一批消息从第一条起的最长等待时间(秒)
+        :param max_items: 一批消息的最大数量，达到后立即处理
+        :param name: 线程名
+        """
+        self.flush = flush
+        self.on_merge = on_merge
+        self.window = window
+        self.max_wait = max(max_wait, window)
+        self.max_items = max_items
+        self.batches = {}
+        self.condition = threading.Condition()
+        self.batched = 0
+        self.merged = 0
+        self.thread = threading.Thread(target=self._flush_loop, name=name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, key, item):
+        """
+        加入一条消息
+        :param key: 键，如会话ID
+        :param item: 消息
+        :return: 是否合并到了已有的一批中
+        """
+        full = None
+        with self.condition:
+            now = time.time()
+            batch = self.batches.get(key)
+            if batch is None:
+                self.batches[key] = Batch(item, now, now + self.window)
+                self.condition.notify()
+                return False
+            previous = batch.items[-1]
+            batch.items.append(item)
+            batch.deadline = min(now + self.window, batch.first_at + self.max_wait)
+            self.merged += 1
+            if self.max_items and len(batch.items) >= self.max_items:
+                full = self.batches.pop(key)
+                self.batched += 1
+        if self.on_merge is not None:
+            self.on_merge(key, previous)
+        if full is not None:
+            self._flush(key, full.items)
+        return True
+
+    def discard(self, key):
+        """
+        丢弃一个键尚未处理的消息
+        :param key: 键
+        :return: 被丢弃的消息列表
+        """
+        with self.condition:
+            batch = self.batches.pop(key, None)
+        return batch.items if batch is not None else []
+
+    def _flush(self, key, items):
+        """调用处理函数，异常只记录日志"""
+        try:
+            self.flush(key, items)
+        except Exception as e:
+            logger.error(f"处理合并消息失败: {key}, {str(e)}")
+
+    def _flush_loop(self):
+        """后台线程：等待到最早的截止时间，处理到期的各批消息"""
+        while True:
+            with self.condition:
+                while True:
+                    now = time.time()
+                    due = [key for key, batch in self.batches.items() if batch.deadline <= now]
+                    if due:
+                        break
+                    if self.batches:
+                        self.condition.wait(min(batch.deadline for batch in self.batches.values()) - now)
+                    else:
+                        self.condition.wait()
+                ready = [(key, self.batches.pop(key).items) for key in due]
+                self.batched += len(ready)
+            for key, items in ready:
+                self._flush(key, items)
+
+    def get_stats(self):
+        """
+        获取防抖统计：batched为处理的批数，merged为合并到已有批次中的消息数（即省去的请求数）
+        :return: 统计字典
+        """
+        with self.condition:
+            return {
+                "pending": len(self.batches),
+                "batched": self.batched,
+                "merged": self.merged
+            }
@@ -0,0 +1,59 @@
+import bisect
+import hashlib
+
+class ConsistentHashRing:
+    """
+    一致性哈希环，用于把同一个用户的请求固定路由到同一个节点
+    每个节点在环上放置多个虚拟节点，使负载分布更均匀
+    """
+    def __init__(self, nodes=None, replicas=100):
+        """
+        初始化哈希环
+        :param nodes: 节点列表
+        :param replicas: 每个节点的虚拟节点数量
+        """
+        self.replicas = replicas
+        self.keys = []
+        self.ring = {}
+        for node in nodes or []:
+            self.add_node(node)
+
+    def _hash(self, key):
+        """计算键在环上的位置"""
+        digest = hashlib.md5(str(key).encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big")
+
+    def add_node(self, node):
+        """
+        添加节点
+        :param node: 节点标识
+        """
+        for i in range(self.replicas):
+            position = self._hash(f"{node}#{i}")
+            if position in self.ring:
+                continue
+            self.ring[position] = node
+            bisect.insort(self.keys, position)
+
+    def remove_node(self, node):
+        """
+        移除节点
+        :param node: 节点标识
+        """
+        for i in range(self.replicas):
+            position = self._hash(f"{node}#{i}")
+            if self.ring.get(position) == node:
+                del self.ring[position]
+                index = bisect.bisect_left(self.keys, position)
+                del self.keys[index]
+
+    def get_node(self, key):
+        """
+        获取键所属的节点
+        :param key: 路由键，例如用户openid
+        :return: 节点标识，环为空时返回None
+        """
+        if not self.keys:
+            return None
+        index = bisect.bisect(self.keys, self._hash(key)) % len(self.keys)
+        return self.ring[self.keys[index]]
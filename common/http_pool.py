@@ -0,0 +1,96 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+class PooledSession:
+    """
+    长连接HTTP会话
+    所有请求共用一个requests.Session和urllib3连接池，复用TCP/TLS连接；
+    代理只在创建时设置一次
+    """
+    def __init__(self, pool_size=10, keep_alive=True, proxy="", pool_block=False):
+        """
+        初始化连接池
+        :param pool_size: 每个目标主机保留的最大连接数
+        :param keep_alive: 是否保持长连接，False时每次请求后关闭连接
+        :param proxy: 代理地址
+        :param pool_block: 连接全部被占用时是否等待空闲连接，False时临时新建连接
+        """
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=pool_block)
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+        if proxy:
+            self.session.proxies = {
+                "http": proxy,
+                "https": proxy
+            }
+        if not keep_alive:
+            self.session.headers["Connection"] = "close"
+
+    def request(self, method, url, **kwargs):
+        """
+        发送请求，参数与requests.request一致
+        """
+        with self.lock:
+            self.requests += 1
+        try:
+            return self.session.request(method, url, **kwargs)
+        except Exception:
+            with self.lock:
+                self.errors += 1
+            raise
+
+    def post(self, url, **kwargs):
+        """发送POST请求"""
+        return self.request("POST", url, **kwargs)
+
+    def get(self, url, **kwargs):
+        """发送GET请求"""
+        return self.request("GET", url, **kwargs)
+
+    def _iter_pools(self):
+        """遍历直连和代理连接池"""
+        managers = [self.adapter.poolmanager] + list(self.adapter.proxy_manager.values())
+        for manager in managers:
+            for key in list(manager.pools.keys()):
+                pool = manager.pools.get(key)
+                if pool is not None:
+                    yield pool
+
+    def get_stats(self):
+        """
+        获取连接池统计信息
+        misses为新建连接次数，hits为复用已有连接的请求数
+        :return: 统计字典
+        """
+        created = 0
+        pooled_requests = 0
+        hosts = 0
+        for pool in self._iter_pools():
+            hosts += 1
+            created += pool.num_connections
+            pooled_requests += pool.num_requests
+
+        with self.lock:
+            requests_sent = self.requests
+            errors = self.errors
+
+        hits = max(0, pooled_requests - created)
+        return {
+            "pool_size": self.pool_size,
+            "keep_alive": self.keep_alive,
+            "hosts": hosts,
+            "requests": requests_sent,
+            "errors": errors,
+            "hits": hits,
+            "misses": created,
+            "hit_rate": round(hits / pooled_requests, 4) if pooled_requests else 0.0
+        }
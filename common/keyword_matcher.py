@@ -0,0 +1,146 @@
+import threading
+from collections import deque
+from common.log import logger
+from common.utils import normalize_text
+
+# 匹配方式
+MATCH_EXACT = "exact"
+MATCH_CONTAINS = "contains"
+
+class KeywordMatcher:
+    """
+    多模式关键词匹配（Aho-Corasick自动机）
+    所有关键词编译为一个自动机，扫描一遍文本即可找出全部命中，耗时与关键词数量无关
+    """
+    def __init__(self):
+        # 每个状态的转移表、失败指针和命中的(关键词长度, 值)列表，状态0为根
+        self.transitions = [{}]
+        self.fail = [0]
+        self.outputs = [[]]
+        self.built = False
+
+    def add(self, keyword, value):
+        """
+        添加关键词，添加完成后需要调用build
+        :param keyword: 关键词
+        :param value: 命中时返回的值
+        """
+        if not keyword:
+            return
+        state = 0
+        for char in keyword:
+            next_state = self.transitions[state].get(char)
+            if next_state is None:
+                next_state = len(self.transitions)
+                self.transitions.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+                self.transitions[state][char] = next_state
+            state = next_state
+        self.outputs[state].append((len(keyword), value))
+        self.built = False
+
+    def build(self):
+        """按广度优先顺序计算失败指针，并把失败链上的命中合并到每个状态"""
+        queue = deque(self.transitions[0].values())
+        for state in queue:
+            self.fail[state] = 0
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.transitions[state].items():
+                fallback = self.fail[state]
+                while fallback and char not in self.transitions[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.transitions[fallback].get(char, 0)
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fail[next_state]]
+                queue.append(next_state)
+        self.built = True
+
+    def search(self, text):
+        """
+        查找文本中的所有关键词
+        :param text: 文本
+        :return: (起始位置, 结束位置, 值)列表
+        """
+        if not self.built:
+            self.build()
+        hits = []
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in self.transitions[state]:
+                state = self.fail[state]
+            state = self.transitions[state].get(char, 0)
+            for length, value in self.outputs[state]:
+                hits.append((index + 1 - length, index + 1, value))
+        return hits
+
+class KeywordRules:
+    """
+    关键词规则表
+    每条规则包含name（名称，用于统计，默认为第一个关键词）、keywords（关键词列表）、
+    match（exact为整条消息等于关键词，contains为消息包含关键词）、
+    max_chars（contains规则只匹配不超过该长度的消息，0表示不限制）、reply（回复内容）和action（内置动作），
+    消息和关键词都先归一化（全角转半角、英文转小写、去掉首尾标点），多条规则命中时取配置中靠前的规则
+    """
+    def __init__(self, rules):
+        """
+        编译规则
+        :param rules: 规则配置列表
+        """
+        self.rules = []
+        self.names = []
+        self.hits = {}
+        self.lock = threading.Lock()
+        self.matcher = KeywordMatcher()
+        for rule in rules or []:
+            keywords = [normalize_text(keyword) for keyword in rule.get("keywords", [])]
+            keywords = [keyword for keyword in keywords if keyword]
+            if not keywords or not (rule.get("reply") or rule.get("action")):
+                logger.warning(f"忽略无效的关键词规则: {rule}")
+                continue
+            if rule.get("match", MATCH_EXACT) not in (MATCH_EXACT, MATCH_CONTAINS):
+                logger.warning(f"未知的关键词匹配方式: {rule.get('match')}，使用exact")
+            index = len(self.rules)
+            self.rules.append(rule)
+            self.names.append(rule.get("name") or keywords[0])
+            for keyword in keywords:
+                self.matcher.add(keyword, index)
+        self.matcher.build()
+        if self.rules:
+            logger.info(f"已加载关键词规则: {len(self.rules)}条")
+
+    def match(self, text):
+        """
+        匹配消息
+        :param text: 用户消息
+        :return: 命中的规则，未命中返回None
+        """
+        if not self.rules:
+            return None
+        text = normalize_text(text)
+        best = None
+        for start, end, index in self.matcher.search(text):
+            if best is not None and index >= best:
+                continue
+            rule = self.rules[index]
+            if rule.get("match") == MATCH_CONTAINS:
+                max_chars = rule.get("max_chars", 0)
+                if max_chars and len(text) > max_chars:
+                    continue
+            elif start != 0 or end != len(text):
+                continue
+            best = index
+        if best is None:
+            return None
+        with self.lock:
+            name = self.names[best]
+            self.hits[name] = self.hits.get(name, 0) + 1
+        return self.rules[best]
+
+    def get_stats(self):
+        """
+        获取各规则的命中次数
+        :return: 统计字典，键为规则名称
+        """
+        with self.lock:
+            return dict(self.hits)
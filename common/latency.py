@@ -0,0 +1,163 @@
+import math
+import threading
+from collections import deque
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from common.scheduler import JobScheduler
+
+class LatencyTracker:
+    """
+    滚动延迟统计
+    每个key（如模型名）保存最近window次成功请求的耗时，按需计算分位数，样本不足时不给出结果
+    """
+    def __init__(self, window=200, min_samples=20):
+        """
+        初始化
+        :param window: 每个key保留的最近样本数量
+        :param min_samples: 计算分位数所需的最少样本数量
+        """
+        self.window = window
+        self.min_samples = min_samples
+        self.samples = {}
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def record(self, key, seconds):
+        """
+        记录一次耗时
+        :param key: 统计键
+        :param seconds: 耗时(秒)
+        """
+        with self.lock:
+            samples = self.samples.get(key)
+            if samples is None:
+                samples = self.samples[key] = deque(maxlen=self.window)
+            samples.append(seconds)
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def percentile(self, key, q):
+        """
+        计算最近样本的分位数
+        :param key: 统计键
+        :param q: 分位(0-1)，如0.95
+        :return: 耗时(秒)，样本不足时返回None
+        """
+        with self.lock:
+            samples = self.samples.get(key)
+            if samples is None or len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)]
+
+    def get_stats(self):
+        """
+        获取各key的延迟分位数
+        :return: 统计字典，耗时单位为毫秒
+        """
+        with self.lock:
+            keys = list(self.samples)
+        stats = {}
+        for key in keys:
+            item = {"count": self.counts.get(key, 0)}
+            for name, q in (("p50_ms", 0.5), ("p95_ms", 0.95), ("p99_ms", 0.99)):
+                value = self.percentile(key, q)
+                item[name] = round(value * 1000, 1) if value is not None else None
+            stats[key] = item
+        return stats
+
+class Hedger:
+    """
+    对冲请求
+    在单独的工作线程中执行请求，超过等待阈值仍未返回时再发出一个相同的请求，采用先成功返回的结果
+    只在有空闲工作线程时使用线程池，任务从不排队：没有空闲线程时请求直接在调用线程中执行、不再对冲，
+    对冲请求没有空闲线程时不发出；落后的请求继续执行到结束，结果被丢弃
+    """
+    def __init__(self, workers=16, name="hedge"):
+        """
+        初始化
+        :param workers: 执行请求的工作线程数量
+        :param name: 线程名前缀
+        """
+        self.scheduler = JobScheduler(workers=workers, queue_size=workers, overflow_policy="reject", name=name)
+        # 空闲工作线程名额，提交前先占用，保证提交的任务立即有线程执行
+        self.slots = threading.Semaphore(workers)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.fired = 0
+        self.won = 0
+        self.skipped = 0
+
+    def _submit(self, func, args):
+        """
+        在空闲的工作线程中执行函数
+        :return: Future，没有空闲工作线程时返回None
+        """
+        if not self.slots.acquire(blocking=False):
+            return None
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self.slots.release()
+
+        if not self.scheduler.submit(run):
+            self.slots.release()
+            return None
+        return future
+
+    def call(self, func, delay, *args):
+        """
+        执行请求，超过delay秒未返回时发出对冲请求
+        :param func: 请求函数，返回(成功标志, 结果)
+        :param delay: 发出对冲请求前的等待时间(秒)
+        :param args: 请求函数的参数
+        :return: 先成功返回的结果，都失败时返回最后一个失败结果
+        """
+        with self.lock:
+            self.calls += 1
+        primary = self._submit(func, args)
+        if primary is None:
+            with self.lock:
+                self.skipped += 1
+            return func(*args)
+
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        hedge = self._submit(func, args)
+        if hedge is None:
+            with self.lock:
+                self.skipped += 1
+            return primary.result()
+        with self.lock:
+            self.fired += 1
+
+        pending = {primary, hedge}
+        result = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if result[0]:
+                    if future is hedge:
+                        with self.lock:
+                            self.won += 1
+                    return result
+        return result
+
+    def get_stats(self):
+        """
+        获取对冲统计信息
+        :return: 统计字典
+        """
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "fired": self.fired,
+                "won": self.won,
+                "skipped": self.skipped
+            }
@@ -0,0 +1,390 @@
+import time
+import threading
+from collections import deque, OrderedDict
+from common.log import logger
+from common.stats import stats_registry
+from config import get_value
+
+# 队列满时的处理策略
+OVERFLOW_REJECT = "reject"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+
+# 普通任务等待时，最多连续执行多少个优先任务
+PRIORITY_BURST = 4
+# 保留排队等待统计的最多用户数
+USER_STATS_SIZE = 1000
+
+class Job:
+    """排队中的后台任务"""
+    __slots__ = ("func", "args", "kwargs", "key", "on_reject", "submit_time", "user", "cost", "priority")
+
+    def __init__(self, func, args, kwargs, key, on_reject, user=None, cost=1, priority=False):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        self.on_reject = on_reject
+        self.submit_time = time.time()
+        self.user = user
+        self.cost = max(1, cost)
+        self.priority = priority
+
+class Flow:
+    """一个用户在某个优先级下可执行的任务，以及该用户的赤字计数(DRR)"""
+    __slots__ = ("jobs", "deficit")
+
+    def __init__(self):
+        self.jobs = deque()
+        self.deficit = 0
+
+class JobScheduler:
+    """
+    后台任务调度器
+    固定数量的工作线程从有界队列中取任务执行，队列满时按策略处理：
+    - reject: 拒绝新任务，调用新任务的on_reject
+    - drop_oldest: 丢弃队列中等待最久的任务，调用被丢弃任务的on_reject，新任务入队
+    带key的任务按key串行：同一个key的任务按提交顺序逐个执行，不同key的任务并行执行
+    带user的任务在用户之间公平调度(DRR)：
+    - 各用户轮流执行，每轮累加quantum的额度，任务按cost扣减，长消息需要更多轮次，发送大量消息的用户不会占满工作线程
+    - 每个用户排队的任务数不超过user_queue_limit；同时执行的任务数由key串行限制（回复任务的key为会话，与用户一一对应）
+    - 优先任务（如短消息）先于普通任务执行，普通任务等待时最多连续执行PRIORITY_BURST个优先任务
+    工作线程在第一次提交任务时才创建
+    """
+    def __init__(self, workers=None, queue_size=None, overflow_policy=None, name="job",
+                 user_queue_limit=None, quantum=None):
+        """
+        初始化调度器，未指定的参数在启动时从配置读取
+        :param workers: 工作线程数量
+        :param queue_size: 等待队列容量
+        :param overflow_policy: 队列满时的策略，reject或drop_oldest
+        :param name: 线程名前缀
+        :param user_queue_limit: 每个用户最多排队的任务数，0表示只受队列容量限制
+        :param quantum: 每轮调度给每个用户增加的额度，与任务的cost同一单位
+        """
+        self.workers = workers
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.name = name
+        self.user_queue_limit = user_queue_limit
+        self.quantum = quantum
+        # 可执行的任务：[优先, 普通]两个轮转队列，用户 -> Flow，按轮转顺序排列
+        self.rings = (OrderedDict(), OrderedDict())
+        self.runnable = 0
+        # 正在执行或排队的key -> 该key后续等待的任务
+        self.keys = {}
+        self.waiting = 0
+        # 用户 -> 正在执行的任务数 / 排队中的任务数
+        self.in_flight = {}
+        self.user_queued = {}
+        self.priority_streak = 0
+        self.condition = threading.Condition()
+        self.threads = []
+        self.started = False
+        self.busy = 0
+        self.peak_queued = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.prioritized = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        # 用户 -> [任务数, 累计等待, 最长等待]，只保留最近的USER_STATS_SIZE个用户
+        self.user_waits = OrderedDict()
+        self.last_warning = 0
+
+    def _start(self):
+        """读取配置并创建工作线程，调用方需持有锁"""
+        if self.workers is None:
+            self.workers = get_value("scheduler_workers", 32)
+        if self.queue_size is None:
+            self.queue_size = get_value("scheduler_queue_size", 1000)
+        if self.overflow_policy is None:
+            self.overflow_policy = get_value("scheduler_overflow_policy", OVERFLOW_REJECT)
+        if self.overflow_policy not in (OVERFLOW_REJECT, OVERFLOW_DROP_OLDEST):
+            logger.warning(f"未知的任务队列溢出策略: {self.overflow_policy}，使用reject")
+            self.overflow_policy = OVERFLOW_REJECT
+        if self.user_queue_limit is None:
+            self.user_queue_limit = get_value("scheduler_user_queue_limit", 0)
+        if self.quantum is None:
+            self.quantum = get_value("scheduler_quantum", 500)
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"{self.name}-worker-{i}")
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        self.started = True
+        logger.info(f"后台任务调度器已启动，工作线程: {self.workers}，队列容量: {self.queue_size}，溢出策略: {self.overflow_policy}")
+
+    def submit(self, func, *args, key=None, on_reject=None, user=None, cost=1, priority=False, **kwargs):
+        """
+        提交后台任务
+        :param func: 要执行的函数
+        :param args: 位置参数
+        :param key: 串行键，同一个key的任务按提交顺序逐个执行，None表示不限制
+        :param on_reject: 任务被拒绝或丢弃时调用的无参函数
+        :param user: 公平调度的用户，None表示不参与用户间的公平调度和并发限制
+        :param cost: 任务的调度开销，如消息长度
+        :param priority: 是否优先执行
+        :param kwargs: 关键字参数
+        :return: 新任务是否已入队
+        """
+        job = Job(func, args, kwargs, key, on_reject, user, cost, priority)
+        rejected_job = None
+        with self.condition:
+            if not self.started:
+                self._start()
+            self.submitted += 1
+            if (user is not None and self.user_queue_limit
+                    and self.user_queued.get(user, 0) >= self.user_queue_limit):
+                # 单个用户排队过多时只拒绝该用户的新任务，不影响其他用户
+                rejected_job = job
+                self.rejected += 1
+            elif self.runnable + self.waiting >= self.queue_size:
+                if self.overflow_policy == OVERFLOW_DROP_OLDEST and (self.runnable or self.waiting):
+                    rejected_job = self._pop_oldest()
+                    self.dropped += 1
+                else:
+                    rejected_job = job
+                    self.rejected += 1
+                self._warn_overflow()
+            if rejected_job is not job:
+                self._enqueue(job)
+
+        if rejected_job is not None:
+            self._reject(rejected_job)
+        return rejected_job is not job
+
+    def _enqueue(self, job):
+        """任务入队，同一个key已有任务时排在该key之后，调用方需持有锁"""
+        if job.user is not None:
+            self.user_queued[job.user] = self.user_queued.get(job.user, 0) + 1
+        if job.key is not None:
+            waiting = self.keys.get(job.key)
+            if waiting is not None:
+                waiting.append(job)
+                self.waiting += 1
+                self.peak_queued = max(self.peak_queued, self.runnable + self.waiting)
+                return
+            self.keys[job.key] = deque()
+        self._push_runnable(job)
+        self.peak_queued = max(self.peak_queued, self.runnable + self.waiting)
+
+    def _push_runnable(self, job):
+        """任务加入所属用户的轮转队列，调用方需持有锁"""
+        ring = self.rings[0 if job.priority else 1]
+        flow = ring.get(job.user)
+        if flow is None:
+            flow = ring[job.user] = Flow()
+        flow.jobs.append(job)
+        self.runnable += 1
+        self.condition.notify()
+
+    def _dequeued(self, job):
+        """任务离开队列（开始执行或被丢弃），调用方需持有锁"""
+        if job.user is None:
+            return
+        count = self.user_queued.get(job.user, 0) - 1
+        if count > 0:
+            self.user_queued[job.user] = count
+        else:
+            self.user_queued.pop(job.user, None)
+
+    def _pick(self, ring):
+        """
+        按DRR从一个轮转队列中取出任务，调用方需持有锁
+        轮到的用户增加quantum的额度，额度足够支付队首任务的cost时执行，执行后移到队尾
+        :return: 任务，没有可执行的任务时返回None
+        """
+        while ring:
+            user, flow = next(iter(ring.items()))
+            job = flow.jobs[0]
+            if flow.deficit < job.cost:
+                flow.deficit += self.quantum
+                ring.move_to_end(user)
+                continue
+            flow.deficit -= job.cost
+            flow.jobs.popleft()
+            if flow.jobs:
+                ring.move_to_end(user)
+            else:
+                # 没有排队任务的用户不保留额度
+                del ring[user]
+            return job
+        return None
+
+    def _next_job(self):
+        """选出下一个要执行的任务，调用方需持有锁"""
+        priority, normal = self.rings
+        job = None
+        if priority and not (normal and self.priority_streak >= PRIORITY_BURST):
+            job = self._pick(priority)
+        if job is None:
+            job = self._pick(normal)
+            if job is None and priority:
+                job = self._pick(priority)
+        if job is None:
+            return None
+        if job.priority:
+            self.priority_streak += 1
+            self.prioritized += 1
+        else:
+            self.priority_streak = 0
+        self.runnable -= 1
+        self._dequeued(job)
+        return job
+
+    def _pop_oldest(self):
+        """取出等待最久的任务，包括排在同key任务之后的任务，调用方需持有锁"""
+        oldest = None
+        oldest_queue = None
+        for ring in self.rings:
+            for flow in ring.values():
+                if oldest is None or flow.jobs[0].submit_time < oldest.submit_time:
+                    oldest = flow.jobs[0]
+                    oldest_queue = flow.jobs
+        oldest_waiting = None
+        for waiting in self.keys.values():
+            if waiting and (oldest is None or waiting[0].submit_time < oldest.submit_time):
+                oldest = waiting[0]
+                oldest_waiting = waiting
+
+        self._dequeued(oldest)
+        if oldest_waiting is not None:
+            self.waiting -= 1
+            return oldest_waiting.popleft()
+        oldest_queue.popleft()
+        self.runnable -= 1
+        ring = self.rings[0 if oldest.priority else 1]
+        if not ring[oldest.user].jobs:
+            del ring[oldest.user]
+        if oldest.key is not None:
+            self._release_key(oldest.key)
+        return oldest
+
+    def _release_key(self, key):
+        """某个key的任务结束，放行该key的下一个任务，调用方需持有锁"""
+        waiting = self.keys.get(key)
+        if waiting:
+            self.waiting -= 1
+            self._push_runnable(waiting.popleft())
+        else:
+            self.keys.pop(key, None)
+
+    def _record_wait(self, job, wait_time):
+        """记录排队等待时间，调用方需持有锁"""
+        self.total_wait += wait_time
+        self.max_wait = max(self.max_wait, wait_time)
+        if job.user is None:
+            return
+        record = self.user_waits.get(job.user)
+        if record is None:
+            record = self.user_waits[job.user] = [0, 0.0, 0.0]
+            if len(self.user_waits) > USER_STATS_SIZE:
+                self.user_waits.popitem(last=False)
+        else:
+            self.user_waits.move_to_end(job.user)
+        record[0] += 1
+        record[1] += wait_time
+        record[2] = max(record[2], wait_time)
+
+    def _warn_overflow(self):
+        """队列满时输出告警，每10秒最多一次，调用方需持有锁"""
+        now = time.time()
+        if now - self.last_warning >= 10:
+            self.last_warning = now
+            logger.warning(f"后台任务队列已满({self.queue_size})，已拒绝: {self.rejected}，已丢弃: {self.dropped}")
+
+    def _reject(self, job):
+        """调用被拒绝任务的回调"""
+        if job.on_reject is None:
+            return
+        try:
+            job.on_reject()
+        except Exception as e:
+            logger.error(f"任务拒绝回调异常: {str(e)}")
+
+    def _worker(self):
+        """工作线程，循环取出任务执行"""
+        while True:
+            with self.condition:
+                job = self._next_job()
+                while job is None:
+                    self.condition.wait()
+                    job = self._next_job()
+                self._record_wait(job, time.time() - job.submit_time)
+                self.busy += 1
+                if job.user is not None:
+                    self.in_flight[job.user] = self.in_flight.get(job.user, 0) + 1
+
+            try:
+                job.func(*job.args, **job.kwargs)
+                failed = False
+            except Exception as e:
+                logger.error(f"后台任务执行异常: {str(e)}")
+                failed = True
+
+            with self.condition:
+                self.busy -= 1
+                self.completed += 1
+                if failed:
+                    self.failed += 1
+                if job.user is not None:
+                    count = self.in_flight[job.user] - 1
+                    if count:
+                        self.in_flight[job.user] = count
+                    else:
+                        del self.in_flight[job.user]
+                if job.key is not None:
+                    self._release_key(job.key)
+
+    def get_stats(self):
+        """
+        获取调度器统计信息，等待时间单位为毫秒
+        user_wait为平均等待时间最长的几个用户
+        :return: 统计字典
+        """
+        with self.condition:
+            started = self.completed + self.busy
+            user_waits = [
+                (user, count, total, longest)
+                for user, (count, total, longest) in self.user_waits.items()
+            ]
+            stats = {
+                "workers": self.workers or 0,
+                "busy": self.busy,
+                "queued": self.runnable + self.waiting,
+                "serialized": self.waiting,
+                "active_keys": len(self.keys),
+                "active_users": len(self.in_flight),
+                "queued_users": len(self.user_queued),
+                "peak_queued": self.peak_queued,
+                "queue_size": self.queue_size or 0,
+                "overflow_policy": self.overflow_policy,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "dropped": self.dropped,
+                "prioritized": self.prioritized,
+                "avg_wait_ms": round(self.total_wait / started * 1000, 2) if started else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 2)
+            }
+
+        user_waits.sort(key=lambda item: item[2] / item[1], reverse=True)
+        stats["user_wait"] = [
+            {
+                "user": user,
+                "jobs": count,
+                "avg_wait_ms": round(total / count * 1000, 2),
+                "max_wait_ms": round(longest * 1000, 2)
+            }
+            for user, count, total, longest in user_waits[:5]
+        ]
+        return stats
+
+# 全局后台任务调度器
+job_scheduler = JobScheduler()
+stats_registry.register("scheduler", job_scheduler.get_stats)
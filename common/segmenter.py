@@ -0,0 +1,79 @@
+# 拆分消息时的分隔符，按优先级排列
+MESSAGE_SEPARATORS = [
+    "\n\n",  # 段落分隔符，优先级最高
+    "\n",    # 换行符
+    "。",    # 句号
+    "！",    # 感叹号
+    "？",    # 问号
+    "；",    # 分号
+    "，",    # 逗号
+    " ",     # 空格
+    ".",     # 英文句号
+    ";",     # 英文分号
+    ","      # 英文逗号
+]
+
+class StreamSegmenter:
+    """
+    流式回复分段器
+    逐段接收模型输出，累计内容达到min_length后在段落分隔处切出完整段落；
+    超过max_length仍没有段落分隔时，按split_message相同的分隔符优先级切分。
+    最后一段始终保留到flush，保证结束时总有剩余内容
+    """
+    def __init__(self, min_length=100, max_length=1800):
+        """
+        :param min_length: 切出段落的最小长度，避免发送过多短消息
+        :param max_length: 单条消息最大长度
+        """
+        self.min_length = min_length
+        self.max_length = max_length
+        self.buffer = ""
+
+    def feed(self, text):
+        """
+        追加模型输出
+        :param text: 新增内容
+        :return: 已完成的段落列表
+        """
+        self.buffer += text
+        segments = []
+        while True:
+            cut_index = self._find_cut()
+            if cut_index <= 0:
+                break
+            segment = self.buffer[:cut_index].strip()
+            self.buffer = self.buffer[cut_index:]
+            if segment:
+                segments.append(segment)
+        return segments
+
+    def _find_cut(self):
+        """
+        查找切分位置，切分点之后必须还有非空内容
+        :return: 切分位置，不需要切分时返回-1
+        """
+        window = self.buffer[:self.max_length]
+        if len(self.buffer) >= self.min_length:
+            pos = window.rfind("\n\n")
+            if pos >= self.min_length or (pos > 0 and len(self.buffer) > self.max_length):
+                cut_index = pos + 2
+                if self.buffer[cut_index:].strip():
+                    return cut_index
+
+        if len(self.buffer) > self.max_length:
+            for separator in MESSAGE_SEPARATORS:
+                pos = window.rfind(separator)
+                if pos > 0:
+                    return pos + len(separator)
+            return self.max_length
+
+        return -1
+
+    def flush(self):
+        """
+        取出剩余内容
+        :return: 剩余内容
+        """
+        remaining = self.buffer.strip()
+        self.buffer = ""
+        return remaining
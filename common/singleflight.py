@@ -0,0 +1,66 @@
+import threading
+
+class _Call:
+    """一次正在进行中的调用"""
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    请求合并(single-flight)
+    同一个键同时只执行一次函数，期间到达的相同请求等待并共享这次执行的结果
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, func):
+        """
+        执行函数，相同键的并发调用只执行一次
+        :param key: 合并键
+        :param func: 无参函数
+        :return: (函数返回值, 是否共享了其他调用的结果)
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self.calls[key] = call
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+                self.executed += 1
+            call.event.set()
+        return call.result, False
+
+    def get_stats(self):
+        """
+        获取合并统计信息：executed为实际执行次数，coalesced为被合并(节省)的调用次数
+        :return: 统计字典
+        """
+        with self.lock:
+            return {
+                "in_flight": len(self.calls),
+                "executed": self.executed,
+                "coalesced": self.coalesced
+            }
@@ -0,0 +1,69 @@
+import json
+import time
+import threading
+from common.log import logger
+
+class StatsRegistry:
+    """
+    运行指标注册表，汇总各组件的统计信息并定期输出到日志
+    """
+    def __init__(self):
+        self.providers = {}
+        self.lock = threading.Lock()
+        self.reporter_thread = None
+
+    def register(self, name, provider):
+        """
+        注册指标提供者
+        :param name: 指标名称
+        :param provider: 无参函数，返回统计字典
+        """
+        with self.lock:
+            self.providers[name] = provider
+
+    def unregister(self, name):
+        """
+        注销指标提供者
+        :param name: 指标名称
+        """
+        with self.lock:
+            self.providers.pop(name, None)
+
+    def snapshot(self):
+        """
+        获取所有组件的当前统计信息
+        :return: {名称: 统计字典}
+        """
+        with self.lock:
+            providers = list(self.providers.items())
+
+        result = {}
+        for name, provider in providers:
+            try:
+                result[name] = provider()
+            except Exception as e:
+                logger.error(f"获取运行指标失败: {name}, {str(e)}")
+        return result
+
+    def start_reporter(self, interval):
+        """
+        启动后台线程，定期将运行指标写入日志
+        :param interval: 输出间隔(秒)
+        """
+        if self.reporter_thread is not None:
+            return
+
+        def report_loop():
+            while True:
+                time.sleep(interval)
+                snapshot = self.snapshot()
+                if snapshot:
+                    logger.info(f"[运行指标] {json.dumps(snapshot, ensure_ascii=False)}")
+
+        self.reporter_thread = threading.Thread(target=report_loop)
+        self.reporter_thread.daemon = True
+        self.reporter_thread.start()
+        logger.info(f"运行指标输出已启用，间隔: {interval}秒")
+
+# 全局运行指标注册表
+stats_registry = StatsRegistry()
@@ -0,0 +1,61 @@
+import re
+import math
+import importlib
+import threading
+from common.log import logger
+from config import get_value
+
+# 中日韩文字及全角标点，大多数中文模型的分词器中约每字0.6个token
+_CJK_PATTERN = re.compile(
+    "[\u2e80-\u2fdf\u3000-\u303f\u3040-\u30ff\u3100-\u312f\u3200-\u32ff"
+    "\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]"
+)
+CJK_TOKENS_PER_CHAR = 0.6
+# 英文、数字、半角符号等，约每字符0.3个token
+OTHER_TOKENS_PER_CHAR = 0.3
+
+def estimate_tokens(text):
+    """
+    快速估算文本的token数量，区分中日韩文字和其他字符
+    :param text: 文本
+    :return: 估算的token数量
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return math.ceil(cjk * CJK_TOKENS_PER_CHAR + (len(text) - cjk) * OTHER_TOKENS_PER_CHAR)
+
+def load_tokenizer(spec):
+    """
+    加载自定义分词函数
+    :param spec: "模块:函数"，函数接收文本并返回token数量
+    :return: 分词函数
+    """
+    module_name, _, func_name = spec.partition(":")
+    if not module_name or not func_name:
+        raise ValueError(f"分词函数格式应为 模块:函数，实际为: {spec}")
+    module = importlib.import_module(module_name)
+    return getattr(module, func_name)
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+def get_tokenizer():
+    """
+    获取配置的分词函数，未配置或加载失败时使用内置估算
+    :return: 接收文本、返回token数量的函数
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                spec = get_value("tokenizer", "")
+                tokenizer = estimate_tokens
+                if spec:
+                    try:
+                        tokenizer = load_tokenizer(spec)
+                        logger.info(f"已加载自定义分词函数: {spec}")
+                    except Exception as e:
+                        logger.error(f"加载分词函数失败: {str(e)}，使用内置估算")
+                _tokenizer = tokenizer
+    return _tokenizer
@@ -1,8 +1,14 @@
+import re
 import time
+import random
 import uuid
 import json
 import threading
+import unicodedata
 from common.log import logger
+from common.cache import TTLCache
+from common.scheduler import job_scheduler
+from config import get_value
 
 def generate_request_id():
     """
@@ -11,46 +17,85 @@ def generate_request_id():
     """
     return f"{int(time.time() * 1000)}-{str(uuid.uuid4())[:8]}"
 
-def async_run(func, *args, **kwargs):
+# 归一化时忽略的首尾标点和空白
+_TRIM_CHARS = " \t\r\n?？!！。.~～…,，、;；:：\"'“”‘’"
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+def normalize_text(text):
+    """
+    归一化用户输入，用于判断两条消息是否是同一个问题
+    全角转半角、英文转小写、合并连续空白、去掉首尾标点
+    :param text: 原始文本
+    :return: 归一化后的文本
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = _WHITESPACE_PATTERN.sub(" ", text)
+    return text.strip(_TRIM_CHARS)
+
+def backoff_delay(attempt, base=1.0, max_delay=30.0):
+    """
+    计算重试前的等待时间：指数退避加全抖动，避免大量请求在同一时刻集中重试
+    :param attempt: 第几次重试，从1开始
+    :param base: 第一次重试的等待时间上限(秒)
+    :param max_delay: 等待时间上限(秒)
+    :return: 等待时间(秒)，在0到min(max_delay, base * 2^(attempt-1))之间均匀分布
+    """
+    return random.uniform(0, min(max_delay, base * 2 ** (attempt - 1)))
+
+def async_run(func, *args, key=None, on_reject=None, user=None, cost=1, priority=False, **kwargs):
     """
-    异步执行函数
+    异步执行函数，提交到全局后台任务调度器，由固定数量的工作线程执行
     :param func: 要执行的函数
     :param args: 位置参数
+    :param key: 串行键，同一个key的任务按提交顺序逐个执行
+    :param on_reject: 任务队列已满被拒绝(或被丢弃)时调用的无参函数
+    :param user: 公平调度的用户，不同用户的任务轮流执行
+    :param cost: 任务的调度开销，如消息长度
+    :param priority: 是否优先执行
     :param kwargs: 关键字参数
-    :return: 线程对象
+    :return: 任务是否已入队
     """
-    thread = threading.Thread(target=func, args=args, kwargs=kwargs)
-    thread.daemon = True
-    thread.start()
-    return thread
+    return job_scheduler.submit(
+        func, *args, key=key, on_reject=on_reject, user=user, cost=cost, priority=priority, **kwargs
+    )
 
-# 简单的消息ID管理
+# 消息ID管理
 class MessageIdManager:
     """
-    简单的消息ID管理器，用于检查消息是否处理过
+    消息ID管理器，用于识别微信服务器的重试推送
+    基于带过期时间的LRU缓存，记录和淘汰均为O(1)，超出容量时淘汰最早的记录
+    缓存在第一次使用时才按配置创建，多进程模式下工作进程先导入本模块、后加载配置
     """
-    def __init__(self, max_size=1000):
-        self.message_ids = set()
+    def __init__(self, max_size=None, ttl=None):
+        """
+        初始化消息ID管理器
+        :param max_size: 最多记录的消息ID数量，None表示使用配置
+        :param ttl: 消息ID的保留时间(秒)，微信最多在15秒内重试3次，None表示使用配置
+        """
         self.max_size = max_size
+        self.ttl = ttl
+        self.cache = None
         self.lock = threading.Lock()
     
+    def _get_cache(self):
+        """获取缓存，第一次调用时读取配置并创建"""
+        if self.cache is None:
+            with self.lock:
+                if self.cache is None:
+                    if self.max_size is None:
+                        self.max_size = get_value("message_dedup_size", 10000)
+                    if self.ttl is None:
+                        self.ttl = get_value("message_dedup_ttl", 60)
+                    self.cache = TTLCache(max_size=self.max_size, ttl=self.ttl)
+        return self.cache
+    
     def add_message_id(self, message_id):
         """
         添加消息ID
         :param message_id: 消息ID
         :return: 如果是新消息ID返回True，否则返回False
         """
-        with self.lock:
-            if message_id in self.message_ids:
-                return False
-                
-            self.message_ids.add(message_id)
-            
-            # 如果超出最大容量，清理一半
-            if len(self.message_ids) > self.max_size:
-                self.message_ids = set(list(self.message_ids)[-(self.max_size // 2):])
-                
-            return True
+        return self._get_cache().add(message_id)
     
     def has_message_id(self, message_id):
         """
@@ -58,8 +103,14 @@ class MessageIdManager:
         :param message_id: 消息ID
         :return: 存在返回True，否则返回False
         """
-        with self.lock:
-            return message_id in self.message_ids
+        return message_id in self._get_cache()
+    
+    def get_stats(self):
+        """
+        获取去重统计信息，hits即识别出的重复消息数量
+        :return: 统计字典
+        """
+        return self._get_cache().get_stats()
 
 # 全局消息ID管理器
-message_id_manager = MessageIdManager()
\ No newline at end of file
+message_id_manager = MessageIdManager()
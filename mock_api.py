@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模拟的OpenAI兼容模型API，用于离线调试和基准测试
+支持普通响应和流式(SSE)响应，可模拟首字延迟、长尾延迟、生成速度和错误率
+
+用法:
+    python mock_api.py [--port 8900] [--delay 1] [--chunk-delay 0.05] [--paragraphs 5]
+然后将config.json中的open_ai_api_base设置为 http://127.0.0.1:8900/v1
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+class MockApiHandler(BaseHTTPRequestHandler):
+    """模拟 /chat/completions 接口"""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid json"}})
+            return
+
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        options = self.server.options
+        with self.server.lock:
+            self.server.requests += 1
+
+        if options.error_rate and random.random() < options.error_rate:
+            time.sleep(options.delay)
+            self._send_json(500, {"error": {"message": "mock upstream error"}})
+            return
+
+        reply = self.server.build_reply(request)
+        delay = options.delay
+        if options.slow_rate and random.random() < options.slow_rate:
+            delay = options.slow_delay
+        time.sleep(delay)
+
+        if request.get("stream"):
+            self._send_stream(request, reply)
+        else:
+            time.sleep(options.chunk_delay * (len(reply) / options.chunk_size))
+            self._send_json(200, {
+                "id": "mock",
+                "object": "chat.completion",
+                "model": request.get("model", "mock"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}]
+            })
+
+    def _send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        """以HTTP分块编码写出数据"""
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_stream(self, request, reply):
+        options = self.server.options
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        for i in range(0, len(reply), options.chunk_size):
+            chunk = {
+                "id": "mock",
+                "object": "chat.completion.chunk",
+                "model": request.get("model", "mock"),
+                "choices": [{"index": 0, "delta": {"content": reply[i:i + options.chunk_size]}, "finish_reason": None}]
+            }
+            self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            time.sleep(options.chunk_delay)
+
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+
+class MockApiServer(ThreadingMixIn, HTTPServer):
+    """多线程模拟API服务器"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address, options):
+        super().__init__(server_address, MockApiHandler)
+        self.options = options
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def handle_error(self, request, client_address):
+        """客户端断开连接属于正常情况，不输出异常"""
+        if sys.exc_info()[0] in (ConnectionResetError, BrokenPipeError, ConnectionAbortedError):
+            return
+        super().handle_error(request, client_address)
+
+    def build_reply(self, request):
+        """
+        生成回复：引用用户最后一条消息，并按段落数生成正文
+        """
+        messages = request.get("messages") or []
+        question = messages[-1].get("content", "") if messages else ""
+        paragraphs = [f"你刚才说的是：{question}"]
+        for i in range(1, self.options.paragraphs):
+            paragraphs.append(f"这是模拟回复的第{i + 1}段。" + "内容" * self.options.paragraph_chars)
+        return "\n\n".join(paragraphs)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="模拟OpenAI兼容的模型API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--delay", type=float, default=1.0, help="首字延迟(秒)")
+    parser.add_argument("--chunk-delay", type=float, default=0.05, help="每个数据块之间的间隔(秒)")
+    parser.add_argument("--chunk-size", type=int, default=8, help="每个数据块的字符数")
+    parser.add_argument("--paragraphs", type=int, default=5, help="回复段落数")
+    parser.add_argument("--paragraph-chars", type=int, default=60, help="每段正文重复次数")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="慢请求的概率，用于模拟长尾延迟")
+    parser.add_argument("--slow-delay", type=float, default=10.0, help="慢请求的首字延迟(秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回HTTP 500的概率")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    options = parse_args()
+    server = MockApiServer((options.host, options.port), options)
+    print(f"模拟API已启动: http://{options.host}:{server.server_address[1]}/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()